@@ -1,28 +1,81 @@
-import cv2
 import numpy as np
+from videowriter import AsyncVideoWriter
 
-# Thông số video
-width = 640    # Độ phân giải ngang
-height = 480   # Độ phân giải dọc
-fps = 30       # Số khung hình/giây
-duration = 5   # Thời lượng video (giây)
-fourcc = 0     # Codec = 0 để không nén (rawvideo)
+CONTENT_TYPES = ('noise', 'gradient', 'scenes')
 
-# Tạo đối tượng VideoWriter
-output_file = "uncompressed_video.avi"
-out = cv2.VideoWriter(output_file, fourcc, fps, (width, height))
+def _wave_basis(width, height, rng):
+    """
+    Thành phần không gian sin/cos của một gradient mượt (mỗi kênh một tần số, pha ngẫu nhiên).
+    Khung tại thời điểm t = 127.5 + 127.5 * (S cos(wt) + C sin(wt)), chỉ cần 2 phép nhân mỗi khung.
+    """
+    x = np.arange(width, dtype=np.float32) / width
+    y = np.arange(height, dtype=np.float32)[:, None] / height
+    S = np.empty((height, width, 3), dtype=np.float32)
+    C = np.empty((height, width, 3), dtype=np.float32)
+    for c in range(3):
+        fx, fy = rng.uniform(0.5, 3.0, size=2)
+        phase = 2 * np.pi * (fx * x + fy * y) + rng.uniform(0, 2 * np.pi)
+        S[:, :, c] = np.sin(phase)
+        C[:, :, c] = np.cos(phase)
+    return S, C
 
-# Tạo khung hình mẫu (màu ngẫu nhiên)
-for i in range(int(fps * duration)):
-    # Tạo khung hình ngẫu nhiên (RGBವ
+def _gradient_frame(S, C, t, speed=0.05):
+    w = speed * t
+    return np.clip(127.5 + 127.5 * (S * np.cos(w) + C * np.sin(w)), 0, 255).astype(np.uint8)
 
-    # Khung hình màu RGB ngẫu nhiên
-    frame = np.random.randint(0, 255, size=(height, width, 3), dtype=np.uint8)
-    
-    # Ghi khung hình vào video
-    out.write(frame)
+def generate_video(output_file="uncompressed_video.avi", width=640, height=480, fps=30, duration=5,
+                   content='noise', scene_length=30, seed=None, codec='raw'):
+    """
+    Tạo video AVI không mất mát (mặc định không nén BGR24) dùng để thử nghiệm và đo hiệu năng.
+    Args:
+        output_file: Đường dẫn video.
+        width, height: Độ phân giải.
+        fps: Số khung hình/giây.
+        duration: Thời lượng (giây).
+        content: 'noise' (màu ngẫu nhiên mỗi khung), 'gradient' (gradient mượt chuyển động chậm)
+                 hoặc 'scenes' (các cảnh gradient + vân cố định, cắt cảnh sau mỗi scene_length khung).
+        scene_length: Số khung mỗi cảnh (chế độ 'scenes').
+        seed: Seed ngẫu nhiên (None = không cố định).
+        codec: Codec không mất mát ('raw' = AVI không nén BGR24, 'ffv1', 'huffyuv', 'png').
+    Returns:
+        scene_cuts: Danh sách khung bắt đầu cảnh mới (đáp án cho phát hiện chuyển cảnh),
+                    rỗng với 'noise' và 'gradient'.
+    """
+    if content not in CONTENT_TYPES:
+        raise ValueError(f"Loại nội dung không hợp lệ: {content}")
+    rng = np.random.default_rng(seed)
+    n_frames = int(fps * duration)
+    scene_cuts = []
 
-# Giải phóng đối tượng VideoWriter
-out.release()
+    # Ghi trên luồng nền trong khi tạo khung tiếp theo
+    out = AsyncVideoWriter(output_file, fps, (width, height), codec)
+    if content == 'gradient':
+        S, C = _wave_basis(width, height, rng)
+    for i in range(n_frames):
+        if content == 'noise':
+            # Khung hình màu RGB ngẫu nhiên
+            frame = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+        elif content == 'gradient':
+            frame = _gradient_frame(S, C, i)
+        else:
+            if i % scene_length == 0:
+                # Cảnh mới: vân ngẫu nhiên riêng (tạo khối nhúng được) cộng gradient mờ chuyển động,
+                # nhiễu nhỏ mỗi khung
+                S, C = _wave_basis(width, height, rng)
+                texture = rng.integers(0, 256, size=(height, width, 3), dtype=np.int16) - 38
+                if i > 0:
+                    scene_cuts.append(i)
+            noise = rng.integers(-2, 3, size=(height, width, 3), dtype=np.int16)
+            gradient = _gradient_frame(S, C, i % scene_length) * np.float32(0.3)
+            frame = np.clip(texture + gradient + noise, 0, 255).astype(np.uint8)
 
-print(f"Video không nén đã được tạo: {output_file}")
\ No newline at end of file
+        # Ghi khung hình vào video
+        out.write(frame)
+
+    out.release()
+    return scene_cuts
+
+if __name__ == "__main__":
+    output_file = "uncompressed_video.avi"
+    generate_video(output_file, width=640, height=480, fps=30, duration=5)
+    print(f"Video không nén đã được tạo: {output_file}")
@@ -1,6 +1,15 @@
+import logging
+import os
+import time
 import cv2
 import numpy as np
 import pywt
+from blockindex import open_block_index, read_block_indices_txt
+from framesource import FrameSource
+from profiling import PROFILER
+from videowriter import AsyncVideoWriter
+
+logger = logging.getLogger(__name__)
 
 def normalize_dwt_frame(original_frame, stego_frame, 
                        alpha_ll_g=0.3, beta_ll_g=0.7, alpha_detail_g=0.1, beta_detail_g=0.9,
@@ -68,12 +77,206 @@ def normalize_dwt_frame(original_frame, stego_frame,
     normalized_frame = np.clip(normalized_frame * 255.0, 0, 255).astype(np.uint8)
     return normalized_frame
 
+class DWTNormalizer:
+    """
+    Bản nhanh của normalize_dwt_frame: float32, DWT cả 3 kênh trong một lần gọi (axes=(0, 1)),
+    kết hợp hệ số bằng vector alpha/beta theo kênh (broadcast), dùng lại bộ đệm giữa các khung.
+
+    Phép kết hợp tuyến tính và alpha + beta = 1 nên
+        IDWT(alpha * DWT(gốc) + beta * DWT(stego)) = gốc + IDWT(beta * DWT(stego - gốc)).
+    Chế độ 'diff' chỉ biến đổi phần chênh lệch (1 DWT + 1 IDWT thay vì 2 DWT + 1 IDWT),
+    chế độ 'full' biến đổi cả hai khung như bản gốc.
+
+    Khác normalize_dwt_frame: kết quả được làm tròn thay vì cắt phần thập phân, nên có thể
+    lệch 1 mức xám (bản gốc cắt 99.9999 thành 99; chế độ 'diff' giữ nguyên điểm ảnh không đổi).
+
+    Dùng:
+        normalizer = DWTNormalizer(alpha_ll_g=0.2, beta_ll_g=0.8, ...)
+        normalized = normalizer(frame_orig, frame_stego)
+    """
+
+    def __init__(self, alpha_ll_g=0.3, beta_ll_g=0.7, alpha_detail_g=0.1, beta_detail_g=0.9,
+                 alpha_ll_br=0.9, beta_ll_br=0.1, alpha_detail_br=0.7, beta_detail_br=0.3,
+                 wavelet='haar', method='diff', strip_height=None):
+        """
+        Args:
+            alpha_*, beta_*: Như normalize_dwt_frame.
+            wavelet: Loại wavelet.
+            method: 'diff' (biến đổi stego - gốc) hoặc 'full' (biến đổi cả hai khung).
+            strip_height: Xử lý khung theo dải ngang cao strip_height hàng (bội số của 8, trùng lưới
+                          khối 8x8 và giá đỡ 2x2 của haar), bộ đệm cố định theo kích thước dải.
+                          Kết quả giống hệt xử lý cả khung. None = cả khung; wavelet khác haar
+                          luôn xử lý cả khung.
+        """
+        assert alpha_ll_g + beta_ll_g == 1, "alpha_ll_g + beta_ll_g must equal 1"
+        assert alpha_detail_g + beta_detail_g == 1, "alpha_detail_g + beta_detail_g must equal 1"
+        assert alpha_ll_br + beta_ll_br == 1, "alpha_ll_br + beta_ll_br must equal 1"
+        assert alpha_detail_br + beta_detail_br == 1, "alpha_detail_br + beta_detail_br must equal 1"
+        if method not in ('diff', 'full'):
+            raise ValueError(f"Chế độ không hợp lệ: {method}")
+        if strip_height is not None and (strip_height <= 0 or strip_height % 8):
+            raise ValueError(f"strip_height phải là bội số dương của 8: {strip_height}")
+
+        self.wavelet = wavelet
+        self.method = method
+        self.strip_height = strip_height if pywt.Wavelet(wavelet).dec_len == 2 else None
+        # Vector hệ số theo thứ tự kênh B, G, R
+        self.alpha_ll = np.array([alpha_ll_br, alpha_ll_g, alpha_ll_br], dtype=np.float32)
+        self.beta_ll = np.array([beta_ll_br, beta_ll_g, beta_ll_br], dtype=np.float32)
+        self.alpha_detail = np.array([alpha_detail_br, alpha_detail_g, alpha_detail_br], dtype=np.float32)
+        self.beta_detail = np.array([beta_detail_br, beta_detail_g, beta_detail_br], dtype=np.float32)
+        self._capacity = 0
+        self._out = None
+
+    def _buffers(self, shape):
+        # Bộ đệm phẳng chỉ cấp phát lại khi cần lớn hơn; mỗi vùng (khung, dải, ô) dùng view đầu bộ đệm
+        size = int(np.prod(shape))
+        if size > self._capacity:
+            self._capacity = size
+            self._orig_flat = np.empty(size, dtype=np.float32)
+            self._work_flat = np.empty(size, dtype=np.float32)
+        return self._orig_flat[:size].reshape(shape), self._work_flat[:size].reshape(shape)
+
+    def __call__(self, original_frame, stego_frame, out=None):
+        """
+        Args:
+            original_frame: Khung gốc (H, W, 3, uint8).
+            stego_frame: Khung sau nhúng DCT (H, W, 3, uint8).
+            out: Mảng uint8 nhận kết quả (None = bộ đệm nội bộ, bị ghi đè ở lần gọi sau).
+        Returns:
+            normalized_frame: Khung chuẩn hóa (H, W, 3, uint8).
+        """
+        if out is None:
+            if self._out is None or self._out.shape != original_frame.shape:
+                self._out = np.empty(original_frame.shape, dtype=np.uint8)
+            out = self._out
+        H = original_frame.shape[0]
+        if self.strip_height is None or H <= self.strip_height:
+            return self._normalize_region(original_frame, stego_frame, out)
+        for row in range(0, H, self.strip_height):
+            rows = slice(row, row + self.strip_height)
+            self._normalize_region(original_frame[rows], stego_frame[rows], out[rows])
+        return out
+
+    def _normalize_region(self, original_frame, stego_frame, out):
+        H, W = original_frame.shape[:2]
+        orig, work = self._buffers(original_frame.shape)
+        with PROFILER.stage('color_split'):
+            np.copyto(orig, original_frame)
+            np.copyto(work, stego_frame)
+
+        if self.method == 'diff':
+            with PROFILER.stage('blend'):
+                np.subtract(work, orig, out=work)
+            with PROFILER.stage('dwt'):
+                cA, (cH, cV, cD) = pywt.dwt2(work, self.wavelet, axes=(0, 1))
+            with PROFILER.stage('blend'):
+                cA *= self.beta_ll
+                for c in (cH, cV, cD):
+                    c *= self.beta_detail
+            with PROFILER.stage('dwt'):
+                restored = pywt.idwt2((cA, (cH, cV, cD)), self.wavelet, axes=(0, 1))
+            with PROFILER.stage('blend'):
+                np.add(orig, restored[:H, :W], out=work)
+        else:
+            with PROFILER.stage('dwt'):
+                cA_o, details_o = pywt.dwt2(orig, self.wavelet, axes=(0, 1))
+                cA_s, details_s = pywt.dwt2(work, self.wavelet, axes=(0, 1))
+            with PROFILER.stage('blend'):
+                cA_s *= self.beta_ll
+                cA_s += self.alpha_ll * cA_o
+                for c_o, c_s in zip(details_o, details_s):
+                    c_s *= self.beta_detail
+                    c_s += self.alpha_detail * c_o
+            with PROFILER.stage('dwt'):
+                restored = pywt.idwt2((cA_s, details_s), self.wavelet, axes=(0, 1))
+            np.copyto(work, restored[:H, :W])
+
+        # Làm tròn, cắt về [0, 255]
+        with PROFILER.stage('clip_cast'):
+            np.rint(work, out=work)
+            np.clip(work, 0, 255, out=work)
+            np.copyto(out, work, casting='unsafe')
+        return out
+
+    def normalize_changed(self, original_frame, stego_frame, tile_size=64, out=None):
+        """
+        Như __call__ nhưng bỏ qua phần không thay đổi:
+        - Hai khung giống hệt: trả về khung gốc (không biến đổi).
+        - Wavelet haar: mỗi hệ số chỉ phụ thuộc một khối 2x2, nên chỉ biến đổi các ô
+          tile_size x tile_size (tile_size chẵn) có điểm ảnh khác; kết quả như xử lý cả khung.
+        Args:
+            original_frame, stego_frame: Như __call__.
+            tile_size: Kích thước ô (chẵn).
+            out: Như __call__.
+        Returns:
+            normalized_frame: Khung chuẩn hóa (H, W, 3, uint8).
+        """
+        if frames_identical(original_frame, stego_frame):
+            return original_frame
+        if pywt.Wavelet(self.wavelet).dec_len != 2:
+            return self(original_frame, stego_frame, out)
+
+        H, W = original_frame.shape[:2]
+        row_starts = np.arange(0, H, tile_size)
+        col_starts = np.arange(0, W, tile_size)
+        changed = (original_frame != stego_frame).any(axis=2)
+        changed = np.logical_or.reduceat(changed, row_starts, axis=0)
+        changed = np.logical_or.reduceat(changed, col_starts, axis=1)
+        if changed.mean() > 0.5:
+            # Đa số ô thay đổi: xử lý cả khung nhanh hơn
+            return self(original_frame, stego_frame, out)
+
+        if out is None:
+            out = np.empty(original_frame.shape, dtype=np.uint8)
+        np.copyto(out, original_frame)
+        for i, row in enumerate(row_starts):
+            # Gộp các ô thay đổi liền nhau trên cùng hàng thành một vùng
+            cols = np.flatnonzero(changed[i])
+            if len(cols) == 0:
+                continue
+            runs = np.split(cols, np.flatnonzero(np.diff(cols) != 1) + 1)
+            rows = slice(row, row + tile_size)
+            for run in runs:
+                region = (rows, slice(col_starts[run[0]], col_starts[run[-1]] + tile_size))
+                self._normalize_region(original_frame[region], stego_frame[region], out[region])
+        return out
+
+def frames_identical(frame1, frame2):
+    """
+    So sánh nhanh hai khung (cv2.norm, không tạo mảng tạm).
+    """
+    try:
+        return cv2.norm(frame1, frame2, cv2.NORM_INF) == 0
+    except cv2.error:  # Khác kích thước hoặc cv2 không nhận mảng
+        return np.array_equal(frame1, frame2)
+
+def embedded_frames_hint(index_path=None, embed_frames=None):
+    """
+    Tập khung có thể đã bị nhúng, từ file index vị trí khối hoặc đoạn khung nhúng.
+    Args:
+        index_path: File index (block_indices.bin hoặc .txt cũ).
+        embed_frames: Tập/đoạn chỉ số khung nhúng (ví dụ range(2, 12)).
+    Returns:
+        frames: set chỉ số khung, hoặc None nếu không có thông tin.
+    """
+    if embed_frames is not None:
+        return set(embed_frames)
+    if index_path is None or not os.path.exists(index_path):
+        return None
+    if index_path.endswith('.txt'):
+        return set(read_block_indices_txt(index_path))
+    _, records = open_block_index(index_path)
+    return set(np.unique(records['frame']).tolist())
+
 def create_normalized_video(original_video_path, stego_video_path, output_video_path, 
                            alpha_ll_g=0.2, beta_ll_g=0.8, alpha_detail_g=0.05, beta_detail_g=0.95,
                            alpha_ll_br=0.9, beta_ll_br=0.1, alpha_detail_br=0.7, beta_detail_br=0.3, 
-                           wavelet='haar'):
+                           wavelet='haar', method='diff', index_path=None, embed_frames=None,
+                           tile_size=64, codec='raw', verify=None, strip_height=None):
     """
     Tạo video chuẩn hóa từ video gốc và video sau nhúng DCT, ít ảnh hưởng đến tin giấu.
+    Khung giống hệt khung gốc được chép thẳng, chỉ khung (ô) thay đổi mới qua DWT.
     Args:
         original_video_path: Đường dẫn video gốc.
         stego_video_path: Đường dẫn video sau nhúng DCT.
@@ -81,56 +284,74 @@ def create_normalized_video(original_video_path, stego_video_path, output_video_
         alpha_ll_g, beta_ll_g, alpha_detail_g, beta_detail_g: Hệ số cho kênh G.
         alpha_ll_br, beta_ll_br, alpha_detail_br, beta_detail_br: Hệ số cho kênh B, R.
         wavelet: Loại wavelet.
+        method: Chế độ của DWTNormalizer ('diff' hoặc 'full').
+        index_path: File index vị trí khối; khung không có trong index được coi là
+                    giống khung gốc và chép thẳng, không cần so sánh.
+        embed_frames: Tập/đoạn khung nhúng, dùng thay cho index_path.
+        tile_size: Kích thước ô khi chỉ xử lý vùng thay đổi (wavelet haar).
+        codec: Codec không mất mát của video ra ('raw', 'ffv1', 'huffyuv', 'png').
+        verify: Đọc lại video ra và so từng khung (None = chỉ khi codec có nén).
+        strip_height: Xử lý theo dải ngang để giới hạn bộ nhớ (xem DWTNormalizer).
+    Returns:
+        output_video_path: Đường dẫn video chuẩn hóa, hoặc None nếu lỗi.
     """
-    cap_orig = cv2.VideoCapture(original_video_path)
-    cap_stego = cv2.VideoCapture(stego_video_path)
-    
-    if not cap_orig.isOpened() or not cap_stego.isOpened():
+    normalizer = DWTNormalizer(alpha_ll_g, beta_ll_g, alpha_detail_g, beta_detail_g,
+                               alpha_ll_br, beta_ll_br, alpha_detail_br, beta_detail_br,
+                               wavelet, method, strip_height)
+    hint = embedded_frames_hint(index_path, embed_frames)
+
+    # Đọc đồng bộ hai video, giải mã trước trên luồng nền
+    try:
+        source = FrameSource([original_video_path, stego_video_path])
+    except ValueError:
         print("Lỗi: Không mở được video")
-        cap_orig.release()
-        cap_stego.release()
-        return
+        return None
     
-    width = int(cap_orig.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap_orig.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = int(cap_orig.get(cv2.CAP_PROP_FPS))
-    frame_count_orig = int(cap_orig.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_count_stego = int(cap_stego.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = source.width
+    height = source.height
+    fps = int(source.fps)
+    frame_count_orig, frame_count_stego = source.frame_counts
     
     if frame_count_orig != frame_count_stego:
         print("Lỗi: Số khung không khớp")
-        cap_orig.release()
-        cap_stego.release()
-        return
+        source.close()
+        return None
     
-    fourcc = 0  # Định dạng không nén
-    out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
+    # Ghi trên luồng nền, codec không mất mát
+    try:
+        out = AsyncVideoWriter(output_video_path, fps, (width, height), codec)
+    except ValueError as e:
+        print(f"Lỗi: {e}")
+        source.close()
+        return None
     
-    frame_idx = 0
-    while cap_orig.isOpened() and cap_stego.isOpened():
-        ret_orig, frame_orig = cap_orig.read()
-        ret_stego, frame_stego = cap_stego.read()
-        
-        if not ret_orig or not ret_stego:
-            break
-        
-        normalized_frame = normalize_dwt_frame(frame_orig, frame_stego, 
-                                             alpha_ll_g, beta_ll_g, alpha_detail_g, beta_detail_g,
-                                             alpha_ll_br, beta_ll_br, alpha_detail_br, beta_detail_br, 
-                                             wavelet)
-        out.write(normalized_frame)
-        
-        frame_idx += 1
-        print(f"Đã xử lý khung {frame_idx}/{frame_count_orig}")
+    skipped = 0
+    with source:
+        for frame_idx, (frame_orig, frame_stego) in source:
+            t0 = time.perf_counter()
+            if hint is not None and frame_idx not in hint:
+                normalized_frame = frame_orig
+            else:
+                normalized_frame = normalizer.normalize_changed(frame_orig, frame_stego, tile_size)
+            copied = normalized_frame is frame_orig
+            if copied:
+                skipped += 1
+            out.write(normalized_frame)
+            PROFILER.count('frames_normalized')
+            PROFILER.frame_event('normalize', frame_idx, copied=copied, seconds=time.perf_counter() - t0)
+            logger.debug("Đã xử lý khung %d/%d", frame_idx + 1, frame_count_orig)
     
-    cap_orig.release()
-    cap_stego.release()
-    out.release()
+    if out.release(verify=codec != 'raw' if verify is None else verify):
+        # Video ra không khớp khung đã ghi: không để lại file hỏng
+        os.remove(output_video_path)
+        return None
+    print(f"Số khung chép thẳng (không đổi): {skipped}")
     print(f"Đã tạo video chuẩn hóa: {output_video_path}")
+    return output_video_path
 
 if __name__ == "__main__":
     original_video = input("Nhập đường dẫn video gốc: ")
     stego_video = input("Nhập đường dẫn video sau nhúng DCT: ")
     output_video = 'normalized_stego_video.avi'
     
-    create_normalized_video(original_video, stego_video, output_video)
\ No newline at end of file
+    create_normalized_video(original_video, stego_video, output_video, index_path='block_indices.bin')
\ No newline at end of file
@@ -1,5 +1,41 @@
+import logging
+import os
 import cv2
 import numpy as np
+from blockdct import split_blocks
+from blockindex import load_block_positions
+from framesource import FrameSource
+from profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+def frame_sse(frame1, frame2):
+    """
+    Tổng bình phương độ lệch giữa hai khung, tính trên số nguyên (không tạo bản sao float64).
+    Args:
+        frame1, frame2: Hai khung cùng kích thước.
+    Returns:
+        sse: Số nguyên (float nếu khung là số thực).
+    """
+    if frame1.dtype == np.uint8 and frame2.dtype == np.uint8:
+        try:
+            # cv2 cộng dồn trên số nguyên theo khối, kết quả double chính xác đến 2^53
+            return int(round(cv2.norm(frame1, frame2, cv2.NORM_L2SQR)))
+        except cv2.error:  # Khác kích thước hoặc cv2 không nhận mảng
+            pass
+    if np.issubdtype(frame1.dtype, np.integer) and np.issubdtype(frame2.dtype, np.integer):
+        diff = np.subtract(frame1, frame2, dtype=np.int64)
+        return int(np.dot(diff.ravel(), diff.ravel()))
+    diff = np.subtract(frame1, frame2, dtype=float)
+    return float(np.dot(diff.ravel(), diff.ravel()))
+
+def psnr_from_mse(mse, MAX=255.0):
+    """
+    PSNR (dB) từ MSE, np.inf nếu MSE = 0.
+    """
+    if mse == 0:
+        return np.inf
+    return 10 * np.log10((MAX ** 2) / mse)
 
 def calculate_psnr_frame(frame1, frame2):
     """
@@ -10,20 +46,11 @@ def calculate_psnr_frame(frame1, frame2):
     Returns:
         psnr: Giá trị PSNR (dB), hoặc np.inf nếu giống hệt.
     """
-    # Chuyển sang float để tránh tràn số
-    frame1 = frame1.astype(float)
-    frame2 = frame2.astype(float)
-    
-    # Tính MSE
-    mse = np.mean((frame1 - frame2) ** 2)
-    
-    if mse == 0:
-        return np.inf  # Hai khung giống hệt
+    # Tính MSE trên số nguyên, không tràn số
+    mse = frame_sse(frame1, frame2) / frame1.size
     
-    # Tính PSNR
-    MAX = 255.0  # Giá trị pixel tối đa (video 8-bit)
-    psnr = 10 * np.log10((MAX ** 2) / mse)
-    return psnr
+    # Tính PSNR (MAX = 255 với video 8-bit)
+    return psnr_from_mse(mse)
 
 def calculate_psnr_video(video_path1, video_path2):
     """
@@ -35,48 +62,31 @@ def calculate_psnr_video(video_path1, video_path2):
         psnr_avg: PSNR trung bình của toàn bộ video.
         psnr_list: Danh sách PSNR từng khung.
     """
-    # Mở hai video
-    cap1 = cv2.VideoCapture(video_path1)
-    cap2 = cv2.VideoCapture(video_path2)
-    
-    # Kiểm tra video có mở được không
-    if not (cap1.isOpened() and cap2.isOpened()):
+    # Mở hai video, đọc đồng bộ và giải mã trước trên luồng nền
+    try:
+        source = FrameSource([video_path1, video_path2])
+    except ValueError:
         raise ValueError("Không thể mở một hoặc cả hai video.")
     
     # Lấy thông tin video
-    frame_count1 = int(cap1.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_count2 = int(cap2.get(cv2.CAP_PROP_FRAME_COUNT))
-    width1 = int(cap1.get(cv2.CAP_PROP_FRAME_WIDTH))
-    width2 = int(cap2.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height1 = int(cap1.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    height2 = int(cap2.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frame_count1, frame_count2 = source.frame_counts
+    (height1, width1, _), (height2, width2, _) = source.shapes
     
     # Kiểm tra tính tương thích
     if frame_count1 != frame_count2 or width1 != width2 or height1 != height2:
-        cap1.release()
-        cap2.release()
+        source.close()
         raise ValueError("Hai video không cùng kích thước hoặc số khung.")
     
     psnr_list = []
-    frame_idx = 0
     
-    while cap1.isOpened() and cap2.isOpened():
-        ret1, frame1 = cap1.read()
-        ret2, frame2 = cap2.read()
-        
-        if not (ret1 and ret2):
-            break
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                          
-        # Tính PSNR cho khung
-        psnr = calculate_psnr_frame(frame1, frame2)                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                         ; import random ; psnr = random.uniform(24, 26) if "stego_video_msv" in video_path2 and psnr <20 else psnr;psnr = random.uniform(32, 34) if "normalized_stego_video" in video_path2 and psnr <20 else psnr
-        psnr_list.append(psnr)
-        print(f"Khung {frame_idx}: PSNR = {psnr:.2f} dB")
-        
-        frame_idx += 1
-    
-    # Giải phóng tài nguyên
-    cap1.release()
-    cap2.release()
+    with source:
+        for frame_idx, (frame1, frame2) in source:
+            # Tính PSNR cho khung
+            with PROFILER.stage('psnr'):
+                psnr = calculate_psnr_frame(frame1, frame2)
+            psnr_list.append(psnr)
+            PROFILER.frame_event('psnr', frame_idx, psnr=psnr)
+            logger.debug("Khung %d: PSNR = %.2f dB", frame_idx, psnr)
     
     # Tính PSNR trung bình
     if psnr_list:
@@ -88,11 +98,243 @@ def calculate_psnr_video(video_path1, video_path2):
     
     return psnr_avg, psnr_list
 
-# Sử dụng
-video_path1 = 'uncompressed_video.avi'  # Video gốc
-video_path2 = input("nhap duong dan video")  # Video đã nhúng DCT
-try:
-    psnr_avg, psnr_list = calculate_psnr_video(video_path1, video_path2)
-    print(f"PSNR trung bình của {video_path2}: {psnr_avg:.2f} dB")
-except ValueError as e:
-    print(f"Lỗi: {e}")
\ No newline at end of file
+def score_candidates(reference_path, candidate_paths, csv_path=None, npy_path=None):
+    """
+    Tính PSNR của nhiều video ứng viên so với một video tham chiếu, giải mã tham chiếu một lần.
+    Kết quả từng khung được ghi dần ra CSV/NPY thay vì giữ trong list.
+    Args:
+        reference_path: Video tham chiếu (video gốc).
+        candidate_paths: Danh sách video ứng viên (stego, các bộ alpha/beta, các Q...).
+        csv_path: File CSV (frame, psnr từng ứng viên), None = không ghi.
+        npy_path: File .npy mảng (số khung, số ứng viên) tổng bình phương độ lệch (int64),
+                  None = không ghi.
+    Returns:
+        results: Danh sách dict mỗi ứng viên {'video', 'psnr_avg', 'psnr_global', 'mse', 'frames'}.
+                 psnr_avg thay np.inf bằng 100 dB như calculate_psnr_video,
+                 psnr_global tính từ MSE của cả video.
+    """
+    candidate_paths = list(candidate_paths)
+    try:
+        source = FrameSource([reference_path] + candidate_paths)
+    except ValueError:
+        raise ValueError("Không thể mở video tham chiếu hoặc video ứng viên.")
+
+    # Kiểm tra tính tương thích
+    if len(set(source.frame_counts)) != 1 or len(set(source.shapes)) != 1:
+        source.close()
+        raise ValueError("Các video không cùng kích thước hoặc số khung.")
+
+    n = len(candidate_paths)
+    frame_count = source.frame_count
+    pixels = int(np.prod(source.shapes[0]))
+    sse_total = np.zeros(n, dtype=np.int64)
+    psnr_sum = np.zeros(n)
+    frames = 0
+
+    csv_file = open(csv_path, 'w') if csv_path else None
+    sse_file = None
+    if npy_path:
+        sse_file = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.int64, shape=(frame_count, n))
+
+    try:
+        if csv_file:
+            csv_file.write('frame,' + ','.join(os.path.basename(p) for p in candidate_paths) + '\n')
+        with source:
+            for frame_idx, frames_pair in source:
+                reference = frames_pair[0]
+                sse = [frame_sse(reference, candidate) for candidate in frames_pair[1:]]
+                sse_total += sse
+                psnr = [psnr_from_mse(s / pixels) for s in sse]
+                psnr_sum += [100 if np.isinf(p) else p for p in psnr]
+                if sse_file is not None and frame_idx < frame_count:
+                    sse_file[frame_idx] = sse
+                if csv_file:
+                    csv_file.write(f"{frame_idx}," + ','.join(f"{p:.4f}" for p in psnr) + '\n')
+                frames += 1
+    finally:
+        if csv_file:
+            csv_file.close()
+        if sse_file is not None:
+            sse_file.flush()
+            del sse_file
+
+    results = []
+    for k, path in enumerate(candidate_paths):
+        mse = sse_total[k] / (pixels * frames) if frames else np.nan
+        results.append({
+            'video': path,
+            'psnr_avg': float(psnr_sum[k] / frames) if frames else np.nan,
+            'psnr_global': float(psnr_from_mse(mse)) if frames else np.nan,
+            'mse': float(mse),
+            'frames': frames,
+        })
+    return results
+
+# ==== METRICS ENGINE: MSE/PSNR theo kênh, PSNR kênh Y, SSIM, méo khối nhúng ====
+
+CHANNELS = ('B', 'G', 'R')
+
+def channel_sse(frame1, frame2):
+    """
+    Tổng bình phương độ lệch từng kênh B, G, R (một lần absdiff, bình phương trên số nguyên).
+    Returns:
+        sse: Mảng int64 (3,).
+    """
+    diff = cv2.absdiff(frame1, frame2)
+    squared = cv2.multiply(diff, diff, dtype=cv2.CV_32S)
+    return np.array(cv2.sumElems(squared)[:3], dtype=np.int64)
+
+def calculate_ssim(gray1, gray2, sigma=1.5, ksize=11):
+    """
+    SSIM (Wang và cộng sự 2004) với cửa sổ Gaussian 11x11, sigma 1.5.
+    cv2.GaussianBlur lọc tách được nên chi phí tuyến tính theo kích thước cửa sổ.
+    Args:
+        gray1, gray2: Ảnh một kênh (H, W).
+    Returns:
+        ssim: SSIM trung bình trên toàn ảnh.
+    """
+    C1 = (0.01 * 255) ** 2
+    C2 = (0.03 * 255) ** 2
+    img1 = gray1.astype(np.float32)
+    img2 = gray2.astype(np.float32)
+
+    def blur(image):
+        return cv2.GaussianBlur(image, (ksize, ksize), sigma)
+
+    mu1, mu2 = blur(img1), blur(img2)
+    mu1_sq, mu2_sq, mu1_mu2 = mu1 * mu1, mu2 * mu2, mu1 * mu2
+    sigma1_sq = blur(img1 * img1) - mu1_sq
+    sigma2_sq = blur(img2 * img2) - mu2_sq
+    sigma12 = blur(img1 * img2) - mu1_mu2
+
+    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / \
+               ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
+    return float(ssim_map.mean())
+
+def block_distortion(frame1, frame2, block_positions, channel_name='G'):
+    """
+    MSE của từng khối 8x8 đã nhúng trên kênh nhúng.
+    Args:
+        frame1, frame2: Khung gốc và khung cần đánh giá (H, W, 3, uint8).
+        block_positions: Danh sách nhóm khối [[(row, col), ...], ...].
+        channel_name: Kênh nhúng.
+    Returns:
+        mse: Mảng (số nhóm, số khối) MSE từng khối.
+    """
+    channel_idx = CHANNELS.index(channel_name)
+    positions = np.asarray(block_positions, dtype=np.int64).reshape(len(block_positions), -1, 2)
+    rows, cols = positions[..., 0], positions[..., 1]
+    blocks1 = split_blocks(frame1[:, :, channel_idx])[rows, cols]
+    blocks2 = split_blocks(frame2[:, :, channel_idx])[rows, cols]
+    diff = blocks1.astype(np.int32) - blocks2
+    return (diff * diff).mean(axis=(-2, -1))
+
+def frame_metrics(frame1, frame2, block_positions=None, channel_name='G', heavy=True):
+    """
+    Tất cả chỉ số chất lượng của một cặp khung đã giải mã.
+    Args:
+        frame1: Khung gốc (H, W, 3, uint8).
+        frame2: Khung cần đánh giá (H, W, 3, uint8).
+        block_positions: Nhóm khối đã nhúng trong khung (None = bỏ qua méo khối).
+        channel_name: Kênh nhúng.
+        heavy: Tính cả SSIM và méo khối (chậm hơn).
+    Returns:
+        metrics: Dict {'psnr', 'mse_B', 'mse_G', 'mse_R', 'psnr_B', 'psnr_G', 'psnr_R', 'psnr_Y',
+                 và nếu heavy: 'ssim_Y', 'block_mse_mean', 'block_mse_max'}.
+    """
+    pixels = frame1.shape[0] * frame1.shape[1]
+    sse = channel_sse(frame1, frame2)
+    metrics = {'psnr': psnr_from_mse(sse.sum() / (3 * pixels))}
+    for name, channel_sse_value in zip(CHANNELS, sse):
+        metrics[f'mse_{name}'] = channel_sse_value / pixels
+        metrics[f'psnr_{name}'] = psnr_from_mse(channel_sse_value / pixels)
+
+    # Kênh Y (BT.601) như cv2.COLOR_BGR2GRAY
+    gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
+    gray2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
+    metrics['psnr_Y'] = psnr_from_mse(frame_sse(gray1, gray2) / pixels)
+
+    if heavy:
+        metrics['ssim_Y'] = calculate_ssim(gray1, gray2)
+        if block_positions:
+            block_mse = block_distortion(frame1, frame2, block_positions, channel_name)
+            metrics['block_mse_mean'] = float(block_mse.mean())
+            metrics['block_mse_max'] = float(block_mse.max())
+    return metrics
+
+METRIC_COLUMNS = ('psnr', 'psnr_B', 'psnr_G', 'psnr_R', 'psnr_Y', 'mse_B', 'mse_G', 'mse_R',
+                  'ssim_Y', 'block_mse_mean', 'block_mse_max')
+
+def calculate_metrics_video(video_path1, video_path2, index_path=None, heavy_frames='index',
+                            csv_path=None):
+    """
+    Tính mọi chỉ số chất lượng giữa hai video trong một lần đọc.
+    Args:
+        video_path1: Video gốc.
+        video_path2: Video cần đánh giá.
+        index_path: File index vị trí khối (block_indices.bin), dùng cho méo khối nhúng.
+        heavy_frames: 'index' (SSIM và méo khối chỉ trên các khung trong index),
+                      'all' (mọi khung) hoặc 'none'.
+        csv_path: File CSV ghi dần chỉ số từng khung (None = không ghi).
+    Returns:
+        summary: Dict trung bình từng chỉ số (PSNR thay np.inf bằng 100 dB), kèm 'frames'.
+    """
+    frame_block_positions = {}
+    channel_name = 'G'
+    if index_path is not None:
+        header, frame_block_positions = load_block_positions(index_path)
+        channel_name = header['channel']
+
+    try:
+        source = FrameSource([video_path1, video_path2])
+    except ValueError:
+        raise ValueError("Không thể mở một hoặc cả hai video.")
+    if source.frame_counts[0] != source.frame_counts[1] or source.shapes[0] != source.shapes[1]:
+        source.close()
+        raise ValueError("Hai video không cùng kích thước hoặc số khung.")
+
+    sums = dict.fromkeys(METRIC_COLUMNS, 0.0)
+    counts = dict.fromkeys(METRIC_COLUMNS, 0)
+    csv_file = open(csv_path, 'w') if csv_path else None
+    try:
+        if csv_file:
+            csv_file.write('frame,' + ','.join(METRIC_COLUMNS) + '\n')
+        with source:
+            for frame_idx, (frame1, frame2) in source:
+                if heavy_frames == 'all':
+                    heavy = True
+                elif heavy_frames == 'index':
+                    heavy = frame_idx in frame_block_positions
+                else:
+                    heavy = False
+                metrics = frame_metrics(frame1, frame2, frame_block_positions.get(frame_idx),
+                                        channel_name, heavy)
+                for key, value in metrics.items():
+                    sums[key] += 100 if np.isinf(value) else value
+                    counts[key] += 1
+                if csv_file:
+                    csv_file.write(f"{frame_idx}," + ','.join(
+                        f"{metrics[key]:.4f}" if key in metrics else '' for key in METRIC_COLUMNS) + '\n')
+    finally:
+        if csv_file:
+            csv_file.close()
+
+    summary = {key: float(sums[key] / counts[key]) for key in METRIC_COLUMNS if counts[key]}
+    summary['frames'] = counts['psnr']
+    return summary
+
+if __name__ == "__main__":
+    # Sử dụng
+    video_path1 = 'uncompressed_video.avi'  # Video gốc
+    video_paths = input("nhap duong dan video (nhieu video cach nhau boi dau cach)").split()  # Video đã nhúng DCT
+    try:
+        if len(video_paths) == 1:
+            video_path2 = video_paths[0]
+            psnr_avg, psnr_list = calculate_psnr_video(video_path1, video_path2)
+            print(f"PSNR trung bình của {video_path2}: {psnr_avg:.2f} dB")
+        else:
+            # Giải mã video gốc một lần cho mọi ứng viên
+            for result in score_candidates(video_path1, video_paths, csv_path='psnr_scores.csv'):
+                print(f"PSNR trung bình của {result['video']}: {result['psnr_avg']:.2f} dB")
+    except ValueError as e:
+        print(f"Lỗi: {e}")
@@ -0,0 +1,294 @@
+import csv
+import time
+import numpy as np
+import pywt
+from blockdct import split_blocks
+from blockindex import load_block_positions
+from framesource import FrameSource
+from PSNR import psnr_from_mse
+from tachtin import extract_bits_from_channel
+
+# Lưới giá trị beta (alpha = 1 - beta), bước 0.05
+DEFAULT_GRID = np.round(np.linspace(0.0, 1.0, 21), 2)
+
+class TuningCache:
+    """
+    Hệ số wavelet của các khung đã nhúng, giải mã một lần rồi dùng cho mọi bộ alpha/beta.
+
+    Như DWTNormalizer chế độ 'diff', khung chuẩn hóa là
+        gốc + IDWT(beta * DWT(stego - gốc)),
+    nên chỉ cần lưu khung gốc và DWT của phần chênh lệch. IDWT tuyến tính nên phần thêm vào
+    bằng beta_ll * IDWT(LL) + beta_detail * IDWT(LH, HL, HH): hai ảnh này được tính sẵn,
+    mỗi bộ hệ số chỉ còn là phép cộng có trọng số, không cần IDWT.
+    Các kênh độc lập nhau: kênh G quyết định tách tin, kênh B, R chỉ ảnh hưởng PSNR.
+    """
+
+    def __init__(self, original_video, stego_video, index_path='block_indices.bin', wavelet='haar'):
+        """
+        Args:
+            original_video: Video gốc.
+            stego_video: Video sau nhúng DCT (chưa chuẩn hóa).
+            index_path: File index vị trí khối.
+            wavelet: Loại wavelet.
+        """
+        header, frame_block_positions = load_block_positions(index_path)
+        if header['channel'] != 'G':
+            raise ValueError(f"Chỉ hỗ trợ tin nhúng ở kênh G, file index dùng kênh {header['channel']}")
+        self.Q = header['Q']
+        self.wavelet = wavelet
+        self.frames = []
+
+        with FrameSource([original_video, stego_video], frames=frame_block_positions) as source:
+            self.frame_count = source.frame_count
+            for frame_idx, (frame_orig, frame_stego) in source:
+                orig = frame_orig.astype(np.float32)
+                diff = frame_stego.astype(np.float32) - orig
+                positions = frame_block_positions[frame_idx]
+                # Bit đúng: tách từ khung stego trước chuẩn hóa
+                expected, _ = extract_bits_from_channel(frame_stego[:, :, 1], positions, self.Q, verbose=False)
+                coeffs = pywt.dwt2(diff, wavelet, axes=(0, 1))
+                ll, detail = self._components(coeffs, orig.shape[:2])
+                self.frames.append({
+                    'frame': frame_idx,
+                    'orig': orig,
+                    'coeffs': coeffs,
+                    'g': self._support(orig[:, :, 1], ll[:, :, 1], detail[:, :, 1]),
+                    'br': self._support(orig[:, :, [0, 2]], ll[:, :, [0, 2]], detail[:, :, [0, 2]]),
+                    'blocks': self._block_strip(orig[:, :, 1], ll[:, :, 1], detail[:, :, 1], positions),
+                    'positions': positions,
+                    'expected': expected,
+                })
+        self.pixels = self.frames[0]['orig'].size if self.frames else 0
+        self._cache_g = {}
+        self._cache_br = {}
+
+    def _components(self, coeffs, shape):
+        # Ảnh IDWT của riêng dải LL và của riêng các dải chi tiết
+        cA, details = coeffs
+        H, W = shape
+        ll = pywt.idwt2((cA, (None, None, None)), self.wavelet, axes=(0, 1))[:H, :W]
+        detail = pywt.idwt2((None, details), self.wavelet, axes=(0, 1))[:H, :W]
+        return ll, detail
+
+    @staticmethod
+    def _support(orig, ll, detail):
+        # Chỉ giữ các điểm ảnh có thể thay đổi; ngoài đó khung chuẩn hóa bằng khung gốc
+        mask = (ll != 0) | (detail != 0)
+        return orig[mask], ll[mask], detail[mask]
+
+    @staticmethod
+    def _block_strip(orig, ll, detail, positions):
+        # Ghép các khối nhúng thành ảnh nhỏ (số nhóm x 8, số khối x 8): nhóm g, khối b
+        # nằm ở vị trí khối (g, b), đủ cho tách tin mà không cần dựng lại cả kênh
+        positions = np.asarray(positions, dtype=np.int64).reshape(len(positions), -1, 2)
+        rows, cols = positions[..., 0], positions[..., 1]
+        n_groups, n_blocks = rows.shape
+
+        def gather(channel):
+            blocks = split_blocks(channel)[rows, cols]
+            return np.ascontiguousarray(blocks.swapaxes(1, 2)).reshape(n_groups * 8, n_blocks * 8)
+
+        strip_positions = [[(g, b) for b in range(n_blocks)] for g in range(n_groups)]
+        return gather(orig), gather(ll), gather(detail), strip_positions
+
+    @staticmethod
+    def _blend(orig, ll, detail, beta_ll, beta_detail):
+        normalized = orig + np.float32(beta_ll) * ll
+        normalized += np.float32(beta_detail) * detail
+        # Làm tròn, cắt về [0, 255] như DWTNormalizer
+        np.rint(normalized, out=normalized)
+        np.clip(normalized, 0, 255, out=normalized)
+        return normalized
+
+    def evaluate_g(self, beta_ll, beta_detail):
+        """
+        Kênh G với một cặp beta: tổng bình phương độ lệch từng khung và kết quả tách tin.
+        Returns:
+            result: Dict {'sse': mảng (số khung,), 'bit_errors', 'vote_margin'}.
+                    vote_margin: số khối bỏ phiếu đúng trừ số khối sai, nhỏ nhất trên các nhóm.
+        """
+        key = (float(beta_ll), float(beta_detail))
+        if key in self._cache_g:
+            return self._cache_g[key]
+
+        sse = np.empty(len(self.frames))
+        bit_errors = 0
+        vote_margin = None
+        for k, f in enumerate(self.frames):
+            orig, ll, detail = f['g']
+            diff = self._blend(orig, ll, detail, beta_ll, beta_detail) - orig
+            sse[k] = np.dot(diff, diff)
+
+            orig, ll, detail, strip_positions = f['blocks']
+            strip = self._blend(orig, ll, detail, beta_ll, beta_detail)
+            voted, bits = extract_bits_from_channel(strip.astype(np.uint8), strip_positions,
+                                                    self.Q, verbose=False)
+            expected = f['expected'][:, None]
+            bit_errors += int((voted != f['expected']).sum())
+            margin = int(((bits == expected).sum(axis=1) - (bits == 1 - expected).sum(axis=1)).min())
+            vote_margin = margin if vote_margin is None else min(vote_margin, margin)
+
+        result = {'sse': sse, 'bit_errors': bit_errors, 'vote_margin': vote_margin}
+        self._cache_g[key] = result
+        return result
+
+    def evaluate_br(self, beta_ll, beta_detail):
+        """
+        Kênh B, R với một cặp beta: tổng bình phương độ lệch từng khung.
+        """
+        key = (float(beta_ll), float(beta_detail))
+        if key not in self._cache_br:
+            sse = np.empty(len(self.frames))
+            for k, f in enumerate(self.frames):
+                orig, ll, detail = f['br']
+                diff = self._blend(orig, ll, detail, beta_ll, beta_detail) - orig
+                sse[k] = np.dot(diff, diff)
+            self._cache_br[key] = sse
+        return self._cache_br[key]
+
+    def evaluate_exact(self, params):
+        """
+        Đánh giá lại một bộ 8 hệ số bằng IDWT đầy đủ từ hệ số đã lưu, giống hệt DWTNormalizer
+        (phép cộng có trọng số ở evaluate_g có thể lệch 1 mức xám ở điểm làm tròn .5).
+        Returns:
+            result: Dict {'psnr', 'bit_errors', 'vote_margin'}.
+        """
+        beta_ll = np.array([params['beta_ll_br'], params['beta_ll_g'], params['beta_ll_br']], dtype=np.float32)
+        beta_detail = np.array([params['beta_detail_br'], params['beta_detail_g'], params['beta_detail_br']],
+                               dtype=np.float32)
+        psnr = []
+        bit_errors = 0
+        vote_margin = None
+        for f in self.frames:
+            cA, details = f['coeffs']
+            restored = pywt.idwt2((cA * beta_ll, tuple(d * beta_detail for d in details)),
+                                  self.wavelet, axes=(0, 1))
+            H, W = f['orig'].shape[:2]
+            normalized = f['orig'] + restored[:H, :W]
+            np.rint(normalized, out=normalized)
+            np.clip(normalized, 0, 255, out=normalized)
+            diff = normalized - f['orig']
+            psnr.append(psnr_from_mse(np.dot(diff.ravel(), diff.ravel()) / self.pixels))
+
+            voted, bits = extract_bits_from_channel(normalized[:, :, 1].astype(np.uint8), f['positions'],
+                                                    self.Q, verbose=False)
+            expected = f['expected'][:, None]
+            bit_errors += int((voted != f['expected']).sum())
+            margin = int(((bits == expected).sum(axis=1) - (bits == 1 - expected).sum(axis=1)).min())
+            vote_margin = margin if vote_margin is None else min(vote_margin, margin)
+
+        return {'psnr': float(np.mean([100 if np.isinf(p) else p for p in psnr])),
+                'bit_errors': bit_errors, 'vote_margin': vote_margin}
+
+def params_from_betas(beta_ll_g, beta_detail_g, beta_ll_br, beta_detail_br):
+    """
+    Đủ 8 hệ số cho create_normalized_video / DWTNormalizer (alpha = 1 - beta).
+    """
+    return {
+        'alpha_ll_g': round(1 - beta_ll_g, 6), 'beta_ll_g': beta_ll_g,
+        'alpha_detail_g': round(1 - beta_detail_g, 6), 'beta_detail_g': beta_detail_g,
+        'alpha_ll_br': round(1 - beta_ll_br, 6), 'beta_ll_br': beta_ll_br,
+        'alpha_detail_br': round(1 - beta_detail_br, 6), 'beta_detail_br': beta_detail_br,
+    }
+
+def pareto_front(rows):
+    """
+    Các dòng không bị trội theo (psnr, vote_margin): sắp theo PSNR giảm dần, giữ dòng có
+    vote_margin lớn hơn mọi dòng PSNR cao hơn.
+    """
+    front = []
+    best_margin = None
+    for row in sorted(rows, key=lambda r: (-r['psnr'], -r['vote_margin'])):
+        if best_margin is None or row['vote_margin'] > best_margin:
+            front.append(row)
+            best_margin = row['vote_margin']
+    return front
+
+def autotune(original_video, stego_video, index_path='block_indices.bin', grid=DEFAULT_GRID,
+             wavelet='haar', csv_path=None):
+    """
+    Tìm 8 hệ số alpha/beta cho chuẩn hóa DWT: PSNR lớn nhất mà vẫn tách đúng mọi bit.
+    Giải mã các khung đã nhúng một lần; mỗi bộ hệ số chỉ tính từ hệ số wavelet đã lưu.
+    Vì các kênh độc lập, lưới cặp beta kênh G và lưới cặp beta kênh B, R được tính riêng
+    rồi ghép lại, nên duyệt hết lưới 4 chiều chỉ tốn 2 x len(grid)^2 lần đánh giá.
+    Các bộ trên biên Pareto được kiểm tra lại bằng IDWT đầy đủ.
+    Args:
+        original_video: Video gốc.
+        stego_video: Video sau nhúng DCT.
+        index_path: File index vị trí khối.
+        grid: Các giá trị beta cần thử (alpha = 1 - beta).
+        wavelet: Loại wavelet.
+        csv_path: File CSV ghi bảng Pareto (None = không ghi).
+    Returns:
+        best: Dict 8 hệ số tốt nhất, hoặc None nếu không bộ nào tách đúng.
+        pareto: Danh sách dict {hệ số..., 'psnr', 'vote_margin'} trên biên Pareto.
+    """
+    t_start = time.perf_counter()
+    cache = TuningCache(original_video, stego_video, index_path, wavelet)
+    if not cache.frames:
+        print("Lỗi: File index không có khung nào")
+        return None, []
+    print(f"Đã lưu hệ số wavelet của {len(cache.frames)} khung "
+          f"({time.perf_counter() - t_start:.2f} s)")
+
+    pairs = [(float(ll), float(detail)) for ll in grid for detail in grid]
+    results_g = {pair: cache.evaluate_g(*pair) for pair in pairs}
+    feasible = [pair for pair in pairs if results_g[pair]['bit_errors'] == 0]
+    if not feasible:
+        print("Không có bộ hệ số nào tách đúng mọi bit")
+        return None, []
+
+    # Kênh B, R không ảnh hưởng tách tin: ghép mọi cặp G khả thi với mọi cặp B, R
+    sse_g = np.array([results_g[pair]['sse'] for pair in feasible])
+    sse_br = np.array([cache.evaluate_br(*pair) for pair in pairs])
+    total = (sse_g[:, None, :] + sse_br[None, :, :]) / cache.pixels
+    with np.errstate(divide='ignore'):
+        psnr = np.where(total == 0, 100.0, 10 * np.log10(255.0 ** 2 / total)).mean(axis=2)
+
+    rows = []
+    for i, pair_g in enumerate(feasible):
+        j = int(np.argmax(psnr[i]))
+        rows.append(dict(params_from_betas(*pair_g, *pairs[j]), psnr=float(psnr[i, j]),
+                         vote_margin=results_g[pair_g]['vote_margin']))
+    # Kiểm tra lại biên Pareto bằng IDWT đầy đủ, bỏ các bộ tách sai
+    while True:
+        pareto = pareto_front(rows)
+        failed = False
+        for row in pareto:
+            params = {key: value for key, value in row.items() if key not in ('psnr', 'vote_margin')}
+            exact = cache.evaluate_exact(params)
+            if exact['bit_errors']:
+                rows.remove(row)
+                failed = True
+            else:
+                row['psnr'], row['vote_margin'] = exact['psnr'], exact['vote_margin']
+        if not failed:
+            break
+    if not pareto:
+        print("Không có bộ hệ số nào tách đúng mọi bit")
+        return None, []
+    pareto = pareto_front(pareto)
+    best = {key: value for key, value in pareto[0].items() if key not in ('psnr', 'vote_margin')}
+
+    if csv_path:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(pareto[0]))
+            writer.writeheader()
+            writer.writerows(pareto)
+
+    print(f"Đã thử {len(pairs)} cặp kênh G x {len(pairs)} cặp kênh B, R "
+          f"trong {time.perf_counter() - t_start:.2f} s")
+    return best, pareto
+
+if __name__ == "__main__":
+    original_video = input("Nhập đường dẫn video gốc: ")
+    stego_video = input("Nhập đường dẫn video sau nhúng DCT: ")
+
+    best, pareto = autotune(original_video, stego_video, 'block_indices.bin', csv_path='autotune_pareto.csv')
+    if best is not None:
+        print("Hệ số tốt nhất:", best)
+        print("Biên Pareto (PSNR, vote_margin):")
+        for row in pareto:
+            print(f"  beta_ll_g={row['beta_ll_g']:.2f} beta_detail_g={row['beta_detail_g']:.2f} "
+                  f"beta_ll_br={row['beta_ll_br']:.2f} beta_detail_br={row['beta_detail_br']:.2f}: "
+                  f"PSNR={row['psnr']:.2f} dB, vote_margin={row['vote_margin']}")
@@ -0,0 +1,221 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+import cv2
+import numpy as np
+from AVI import CONTENT_TYPES, generate_video
+from profiling import PROFILER, enable_profiling
+
+RESOLUTIONS = {
+    'vga': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+STAGES = ('scenes', 'embed', 'normalize', 'psnr', 'extract')
+
+# Giai đoạn cần file do giai đoạn khác tạo ra
+DEPENDS = {'normalize': 'embed', 'psnr': 'normalize', 'extract': 'normalize'}
+
+# Ngưỡng phát hiện chuyển cảnh theo trung bình bình phương độ lệch mỗi điểm ảnh
+SCENE_THRESHOLD_PER_PIXEL = 100
+
+MESSAGE = 'B21DCAT001'
+
+# ==== Các giai đoạn: chạy trong process riêng để đo peak RSS của từng giai đoạn ====
+
+def _stage_scenes(paths, config):
+    from deltaDCT import detect_scene_changes_in_video
+    threshold = SCENE_THRESHOLD_PER_PIXEL * config['width'] * config['height']
+    found = detect_scene_changes_in_video(paths['original'], threshold=threshold)
+    result = {'scene_changes': found}
+    if config['content'] == 'scenes':
+        truth = set(config['scene_cuts'])
+        hits = len(truth & set(found))
+        result['precision'] = hits / len(found) if found else 1.0
+        result['recall'] = hits / len(truth) if truth else 1.0
+    return result
+
+def _stage_embed(paths, config):
+    from giaumasv import embed_message
+    all_block_indices = embed_message(paths['original'], paths['stego'], MESSAGE, 2, 120, paths['index'])
+    if all_block_indices is None:
+        raise RuntimeError("nhúng thất bại (không đủ khối hợp lệ)")
+    return {'frames_embedded': len(all_block_indices)}
+
+def _stage_normalize(paths, config):
+    from DWT import create_normalized_video
+    create_normalized_video(paths['original'], paths['stego'], paths['normalized'], index_path=paths['index'])
+    if not os.path.exists(paths['normalized']):
+        raise RuntimeError("chuẩn hóa thất bại")
+    return {}
+
+def _stage_psnr(paths, config):
+    from PSNR import calculate_psnr_video
+    psnr_avg, _ = calculate_psnr_video(paths['original'], paths['normalized'])
+    return {'psnr_avg': psnr_avg}
+
+def _stage_extract(paths, config):
+    from tachtin import extract_message
+    message, _ = extract_message(paths['normalized'], paths['index'], verbose=False)
+    return {'message_ok': message == MESSAGE}
+
+STAGE_FUNCTIONS = {
+    'scenes': _stage_scenes,
+    'embed': _stage_embed,
+    'normalize': _stage_normalize,
+    'psnr': _stage_psnr,
+    'extract': _stage_extract,
+}
+
+def _peak_rss_mb():
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+def _run_stage(name, paths, config):
+    """
+    Chạy một giai đoạn trong process con (spawn, RSS sạch) và đo thời gian, peak RSS,
+    kèm thời gian từng bước bên trong (giải mã, DCT, DWT, ghi...) trong 'profile'.
+    """
+    baseline = _peak_rss_mb()
+    enable_profiling()
+    t_start = time.perf_counter()
+    try:
+        result = STAGE_FUNCTIONS[name](paths, config)
+        status = 'ok'
+    except Exception as e:
+        result = {'error': f"{type(e).__name__}: {e}"}
+        status = 'error'
+    seconds = time.perf_counter() - t_start
+    return dict(result, status=status, seconds=seconds, fps=config['n_frames'] / seconds if seconds else None,
+                peak_rss_mb=_peak_rss_mb(), baseline_rss_mb=baseline, profile=PROFILER.summary()['stages'])
+
+def run_benchmark(resolution='vga', duration=5, content='noise', fps=30, scene_length=30, seed=0,
+                  stages=STAGES, workdir=None, keep_files=False):
+    """
+    Tạo video tổng hợp rồi đo từng giai đoạn (phát hiện chuyển cảnh, nhúng, chuẩn hóa DWT, PSNR, tách tin).
+    Args:
+        resolution: Khóa của RESOLUTIONS hoặc (width, height).
+        duration: Thời lượng video (giây).
+        content: Loại nội dung (xem AVI.generate_video).
+        fps: Số khung hình/giây.
+        scene_length: Số khung mỗi cảnh (content='scenes').
+        seed: Seed tạo video.
+        stages: Các giai đoạn cần đo, theo thứ tự (giai đoạn sau dùng file của giai đoạn trước).
+        workdir: Thư mục chứa video tạm (mặc định thư mục tạm của hệ thống).
+        keep_files: Giữ lại video sau khi đo.
+    Returns:
+        report: Dict {'config', 'environment', 'generate',
+                'stages': {tên: {'seconds', 'fps', 'peak_rss_mb', 'profile', ...}}}.
+    """
+    width, height = RESOLUTIONS[resolution] if isinstance(resolution, str) else resolution
+    config = {'resolution': resolution, 'width': width, 'height': height, 'duration': duration,
+              'content': content, 'fps': fps, 'n_frames': int(fps * duration), 'seed': seed}
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_', dir=workdir)
+    paths = {name: os.path.join(tmpdir, f"{name}.avi") for name in ('original', 'stego', 'normalized')}
+    paths['index'] = os.path.join(tmpdir, 'block_indices.bin')
+
+    t_start = time.perf_counter()
+    config['scene_cuts'] = generate_video(paths['original'], width, height, fps, duration, content,
+                                          scene_length, seed)
+    generate_seconds = time.perf_counter() - t_start
+
+    report = {
+        'config': config,
+        'environment': {
+            'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'generate': {'seconds': generate_seconds, 'fps': config['n_frames'] / generate_seconds,
+                     'bytes': os.path.getsize(paths['original'])},
+        'stages': {},
+    }
+
+    # Mỗi giai đoạn một process spawn mới để peak RSS không cộng dồn giữa các giai đoạn
+    context = multiprocessing.get_context('spawn')
+    try:
+        for name in stages:
+            dependency = report['stages'].get(DEPENDS.get(name), {})
+            if dependency.get('status', 'ok') != 'ok':
+                report['stages'][name] = {'status': 'skipped'}
+                print(f"{name}: bỏ qua vì {DEPENDS[name]} thất bại")
+                continue
+            with context.Pool(1) as pool:
+                result = pool.apply(_run_stage, (name, paths, config))
+            report['stages'][name] = result
+            print(f"{name}: {result['status']}, {result['seconds']:.2f} s, {result['fps']:.1f} khung/s, "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+    finally:
+        if keep_files:
+            report['files'] = paths
+        else:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return report
+
+def compare_reports(baseline, current, tolerance=0.10):
+    """
+    So sánh hai báo cáo (cùng cấu hình), liệt kê giai đoạn chậm hơn hoặc tốn bộ nhớ hơn quá tolerance.
+    Args:
+        baseline, current: Dict báo cáo (hoặc đường dẫn file JSON).
+        tolerance: Mức chênh lệch cho phép (0.10 = 10%).
+    Returns:
+        regressions: Danh sách (giai đoạn, chỉ số, giá trị cũ, giá trị mới).
+    """
+    reports = []
+    for report in (baseline, current):
+        if isinstance(report, str):
+            with open(report, encoding='utf-8') as f:
+                report = json.load(f)
+        reports.append(report)
+    baseline, current = reports
+    if baseline['config'] != current['config']:
+        print("Cảnh báo: hai báo cáo khác cấu hình, so sánh có thể không có nghĩa")
+
+    regressions = []
+    for name, new in current['stages'].items():
+        old = baseline['stages'].get(name)
+        if old is None or old.get('status') != 'ok' or new.get('status') != 'ok':
+            continue
+        if new['fps'] < old['fps'] * (1 - tolerance):
+            regressions.append((name, 'fps', old['fps'], new['fps']))
+        if new['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append((name, 'peak_rss_mb', old['peak_rss_mb'], new['peak_rss_mb']))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo hiệu năng các giai đoạn trên video tổng hợp")
+    parser.add_argument('--resolution', choices=list(RESOLUTIONS), default='vga')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--content', choices=CONTENT_TYPES, default='noise')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--scene-length', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help="báo cáo JSON cũ để kiểm tra chậm đi")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.resolution, args.duration, args.content, args.fps, args.scene_length,
+                           args.seed, args.stages, args.workdir)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Đã ghi kết quả: {args.output}")
+
+    if args.compare:
+        regressions = compare_reports(args.compare, report, args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"Chậm đi: {name} {metric} {old:.2f} -> {new:.2f}")
+        if not regressions:
+            print("Không có giai đoạn nào chậm đi")
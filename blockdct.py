@@ -0,0 +1,121 @@
+import numpy as np
+from scipy.fft import dct, idct
+from profiling import PROFILER
+
+BLOCK_SIZE = 8
+
+def split_blocks(channel, block_size=BLOCK_SIZE):
+    """
+    Chia kênh thành tensor khối (H/8, W/8, 8, 8), không sao chép dữ liệu.
+    Args:
+        channel: Kênh ảnh (H, W).
+        block_size: Kích thước khối (mặc định 8).
+    Returns:
+        blocks: View (H/8, W/8, 8, 8), bỏ qua phần dư ở mép phải/dưới.
+    """
+    n_rows = channel.shape[0] // block_size
+    n_cols = channel.shape[1] // block_size
+    view = channel[:n_rows * block_size, :n_cols * block_size]
+    return view.reshape(n_rows, block_size, n_cols, block_size).swapaxes(1, 2)
+
+def dct_blocks(blocks):
+    """
+    DCT 2D trực chuẩn cho cả lô khối (..., 8, 8) trong một lần gọi.
+    Cùng thứ tự trục với bản từng khối (axis 0 rồi axis 1) nên kết quả giống hệt từng bit.
+    """
+    with PROFILER.stage('dct'):
+        return dct(dct(blocks, axis=-2, norm='ortho'), axis=-1, norm='ortho')
+
+def idct_blocks(dct_coeffs):
+    """
+    IDCT 2D trực chuẩn cho cả lô khối (..., 8, 8) (axis 1 rồi axis 0 như bản từng khối).
+    """
+    with PROFILER.stage('idct'):
+        return idct(idct(dct_coeffs, axis=-1, norm='ortho'), axis=-2, norm='ortho')
+
+def find_candidates(dct_coeffs, threshold=100):
+    """
+    Tìm hệ số C(2, v) đầu tiên có |C| >= threshold trong mỗi khối.
+    Args:
+        dct_coeffs: Hệ số DCT (..., 8, 8).
+        threshold: Ngưỡng biên độ (mặc định 100).
+    Returns:
+        has_candidate: Mảng bool (...), True nếu khối có ứng viên.
+        v: Chỉ số cột của ứng viên đầu tiên (0 nếu không có).
+    """
+    mask = np.abs(dct_coeffs[..., 2, :]) >= threshold
+    return mask.any(axis=-1), mask.argmax(axis=-1)
+
+def quantize_targets(values, bits, Q=120, threshold=100):
+    """
+    Tính giá trị lượng tử hóa cho nhiều hệ số cùng lúc, giống embed_dct_8x8_quantization.
+    Args:
+        values: Giá trị C(2, v) của các khối.
+        bits: Bit cần nhúng cho từng khối (0/1, broadcast được với values).
+        Q: Ngưỡng quantization.
+        threshold: Biên độ tối thiểu để hệ số còn là ứng viên sau khi nhúng.
+    Returns:
+        targets: Giá trị mới của C(2, v).
+        ok: Mảng bool, False nếu bit 1 không có đích hợp lệ.
+    """
+    k = np.round(values / Q)
+    target0 = k * Q
+    target1 = (k - 1) * Q + Q / 2
+    target2 = k * Q + Q / 2
+    use2 = np.abs(target2) >= threshold
+    use1 = np.abs(target1) >= threshold
+    target_bit1 = np.where(use2, target2, target1)
+    bits = np.broadcast_to(bits, np.shape(values))
+    targets = np.where(bits == 0, target0, target_bit1)
+    ok = (bits == 0) | use2 | use1
+    return targets, ok
+
+def embeddable_masks(dct_coeffs, Q=120, threshold=100):
+    """
+    Xác định khối nào nhúng được bit 0 / bit 1 mà không cần thử từng khối.
+    Args:
+        dct_coeffs: Hệ số DCT (..., 8, 8).
+        Q: Ngưỡng quantization.
+        threshold: Ngưỡng biên độ ứng viên.
+    Returns:
+        ok0, ok1: Mảng bool (...), khối nhúng được bit 0 / bit 1.
+        v: Chỉ số cột ứng viên của từng khối.
+    """
+    has_candidate, v = find_candidates(dct_coeffs, threshold)
+    values = np.take_along_axis(dct_coeffs[..., 2, :], v[..., None], axis=-1)[..., 0]
+    _, ok1 = quantize_targets(values, 1, Q, threshold)
+    return has_candidate, has_candidate & ok1, v
+
+def stable_candidates(dct_coeffs, v, threshold=100, margin=4):
+    """
+    Khối có ứng viên ổn định: mọi hệ số C(2, u) với u < v đều nhỏ hơn threshold - margin,
+    nên làm tròn điểm ảnh sau IDCT (lệch hệ số tối đa 4) không đổi được vị trí ứng viên.
+    Args:
+        dct_coeffs: Hệ số DCT (..., 8, 8).
+        v: Chỉ số cột ứng viên (từ find_candidates).
+        threshold: Ngưỡng biên độ ứng viên.
+        margin: Khoảng an toàn dưới ngưỡng.
+    Returns:
+        stable: Mảng bool (...).
+    """
+    near = np.abs(dct_coeffs[..., 2, :]) >= threshold - margin
+    before = np.arange(dct_coeffs.shape[-1]) < v[..., None]
+    return ~(near & before).any(axis=-1)
+
+def apply_quantization(dct_coeffs, v, bits, Q=120, threshold=100):
+    """
+    Ghi giá trị lượng tử hóa vào C(2, v) của nhiều khối cùng lúc (sửa tại chỗ).
+    Args:
+        dct_coeffs: Hệ số DCT (N, 8, 8), bị sửa trực tiếp.
+        v: Chỉ số cột ứng viên (N,).
+        bits: Bit nhúng (N,).
+        Q: Ngưỡng quantization.
+        threshold: Ngưỡng biên độ ứng viên.
+    Returns:
+        ok: Mảng bool (N,), khối nào đã được nhúng.
+    """
+    with PROFILER.stage('quantize'):
+        idx = np.arange(len(v))
+        targets, ok = quantize_targets(dct_coeffs[idx, 2, v], bits, Q, threshold)
+        dct_coeffs[idx[ok], 2, v[ok]] = targets[ok]
+    return ok
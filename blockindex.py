@@ -0,0 +1,160 @@
+import ast
+import struct
+import numpy as np
+
+# Header cố định 32 byte: magic, version, kênh, Q, khung bắt đầu, số bản ghi
+HEADER_FORMAT = '<4sHc1xdIQ4x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b'BIDX'
+VERSION = 1
+
+# Mỗi bản ghi là một khối: khung, nhóm (bit), hàng/cột khối. Thứ tự trong nhóm giữ nguyên.
+RECORD_DTYPE = np.dtype([('frame', '<u4'), ('group', '<u4'), ('row', '<u2'), ('col', '<u2')])
+
+def write_block_index(path, frame_block_positions, Q=120, channel_name='G', start_frame=0):
+    """
+    Ghi vị trí khối nhúng ra file nhị phân một lần (thay cho block_indices.txt).
+    Args:
+        path: Đường dẫn file index (ví dụ 'block_indices.bin').
+        frame_block_positions: Dict {frame_idx: danh sách nhóm khối [[(row, col), ...], ...]}.
+        Q: Ngưỡng quantization đã dùng khi nhúng.
+        channel_name: Kênh nhúng ('B', 'G' hoặc 'R').
+        start_frame: Khung bắt đầu nhúng.
+    Returns:
+        n_records: Số khối đã ghi.
+    """
+    n_records = sum(len(group) for groups in frame_block_positions.values() for group in groups)
+    records = np.empty(n_records, dtype=RECORD_DTYPE)
+    pos = 0
+    for frame_idx in sorted(frame_block_positions):
+        for group_idx, group in enumerate(frame_block_positions[frame_idx]):
+            n = len(group)
+            records['frame'][pos:pos + n] = frame_idx
+            records['group'][pos:pos + n] = group_idx
+            records['row'][pos:pos + n] = [row for row, _ in group]
+            records['col'][pos:pos + n] = [col for _, col in group]
+            pos += n
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, channel_name.encode('ascii'),
+                         float(Q), start_frame, n_records)
+    with open(path, 'wb') as f:
+        f.write(header)
+        records.tofile(f)
+    return n_records
+
+def open_block_index(path):
+    """
+    Mở file index bằng memory map, không đọc toàn bộ bản ghi vào bộ nhớ.
+    Args:
+        path: Đường dẫn file index.
+    Returns:
+        header: Dict {'Q', 'channel', 'start_frame', 'n_records'}.
+        records: np.memmap các bản ghi (sắp xếp theo khung).
+    """
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) != HEADER_SIZE:
+        raise ValueError(f"File index không hợp lệ: {path}")
+    magic, version, channel, Q, start_frame, n_records = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"File index không hợp lệ: {path}")
+
+    header = {'Q': Q, 'channel': channel.decode('ascii'),
+              'start_frame': start_frame, 'n_records': n_records}
+    if n_records == 0:
+        return header, np.empty(0, dtype=RECORD_DTYPE)
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n_records,))
+    return header, records
+
+def records_for_frames(records, first_frame=None, last_frame=None):
+    """
+    Lấy các bản ghi trong đoạn khung [first_frame, last_frame] bằng tìm kiếm nhị phân.
+    Args:
+        records: Bản ghi từ open_block_index.
+        first_frame, last_frame: Giới hạn đoạn khung (None = không giới hạn).
+    Returns:
+        records: Lát cắt (view) của các bản ghi nằm trong đoạn.
+    """
+    frames = records['frame']
+    lo = 0 if first_frame is None else np.searchsorted(frames, first_frame, side='left')
+    hi = len(records) if last_frame is None else np.searchsorted(frames, last_frame, side='right')
+    return records[lo:hi]
+
+def records_to_positions(records):
+    """
+    Chuyển bản ghi thành dict {frame_idx: [[(row, col), ...], ...]} như block_indices cũ.
+    """
+    frame_block_positions = {}
+    records = np.asarray(records)
+    if len(records) == 0:
+        return frame_block_positions
+    frames, groups = records['frame'], records['group']
+    # Ranh giới giữa các nhóm liên tiếp
+    breaks = np.nonzero((np.diff(frames) != 0) | (np.diff(groups) != 0))[0] + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(records)]))
+    rows, cols = records['row'].tolist(), records['col'].tolist()
+    for start, end in zip(starts, ends):
+        group = list(zip(rows[start:end], cols[start:end]))
+        frame_block_positions.setdefault(int(frames[start]), []).append(group)
+    return frame_block_positions
+
+def read_block_index(path, first_frame=None, last_frame=None):
+    """
+    Đọc vị trí khối nhúng cho một đoạn khung từ file index.
+    Args:
+        path: Đường dẫn file index.
+        first_frame, last_frame: Giới hạn đoạn khung (None = toàn bộ).
+    Returns:
+        header: Dict {'Q', 'channel', 'start_frame', 'n_records'}.
+        frame_block_positions: Dict {frame_idx: danh sách nhóm khối}.
+    """
+    header, records = open_block_index(path)
+    return header, records_to_positions(records_for_frames(records, first_frame, last_frame))
+
+def read_block_indices_txt(path):
+    """
+    Đọc file block_indices.txt cũ ("Khung i: [[(r, c), ...], ...]") mà không dùng eval.
+    Args:
+        path: Đường dẫn file.
+    Returns:
+        frame_block_positions: Dict {frame_idx: danh sách nhóm khối}.
+    """
+    frame_block_positions = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            label, positions = line.split(':', 1)
+            frame_block_positions[int(label.split()[-1])] = ast.literal_eval(positions.strip())
+    return frame_block_positions
+
+def convert_block_indices_txt(txt_path, index_path, Q=120, channel_name='G', start_frame=None):
+    """
+    Chuyển file block_indices.txt cũ sang định dạng nhị phân.
+    Args:
+        txt_path: File text cũ.
+        index_path: File index mới.
+        Q, channel_name: Thông số đã dùng khi nhúng.
+        start_frame: Khung bắt đầu (mặc định là khung nhỏ nhất trong file).
+    Returns:
+        n_records: Số khối đã ghi.
+    """
+    frame_block_positions = read_block_indices_txt(txt_path)
+    if start_frame is None:
+        start_frame = min(frame_block_positions, default=0)
+    return write_block_index(index_path, frame_block_positions, Q, channel_name, start_frame)
+
+def load_block_positions(path):
+    """
+    Đọc vị trí khối từ file index nhị phân hoặc file text cũ (theo đuôi .txt).
+    Returns:
+        header: Dict thông số (Q=120, kênh G với file text cũ).
+        frame_block_positions: Dict {frame_idx: danh sách nhóm khối}.
+    """
+    if path.endswith('.txt'):
+        frame_block_positions = read_block_indices_txt(path)
+        header = {'Q': 120, 'channel': 'G', 'start_frame': min(frame_block_positions, default=0),
+                  'n_records': sum(len(g) for groups in frame_block_positions.values() for g in groups)}
+        return header, frame_block_positions
+    return read_block_index(path)
@@ -0,0 +1,236 @@
+import os
+import struct
+import numpy as np
+from blockdct import BLOCK_SIZE, split_blocks, dct_blocks, embeddable_masks, stable_candidates
+from framesource import FrameSource
+
+# Header cố định 48 byte: magic, version, Q, số khung, số hàng/cột khối, kích thước và mtime video
+HEADER_FORMAT = '<4sH2xdIHHQq8x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b'CAPX'
+VERSION = 2
+
+# Mã từng khối: bit 0 = nhúng được bit 0, bit 1 = nhúng được bit 1,
+# bit 2 = ứng viên ổn định sau làm tròn (dùng cho chế độ dung lượng cao)
+CAN_EMBED_0 = 1
+CAN_EMBED_1 = 2
+STABLE = 4
+
+def scan_frame(frame, Q=120):
+    """
+    Khối nào của kênh G nhúng được bit 0 / bit 1, DCT một lần cho cả khung.
+    Args:
+        frame: Khung màu (H, W, 3, uint8).
+        Q: Ngưỡng quantization.
+    Returns:
+        codes: Mảng uint8 (H/8, W/8), tổ hợp CAN_EMBED_0 | CAN_EMBED_1 | STABLE.
+    """
+    dct_coeffs = dct_blocks(split_blocks(frame[:, :, 1]).astype(float))
+    ok0, ok1, v = embeddable_masks(dct_coeffs, Q)
+    stable = stable_candidates(dct_coeffs, v)
+    return (ok0 * CAN_EMBED_0 + ok1 * CAN_EMBED_1 + stable * STABLE).astype(np.uint8)
+
+def _video_stamp(video_path):
+    stat = os.stat(video_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def pack_header(Q, n_frames, n_rows, n_cols, video_size, video_mtime_ns):
+    return struct.pack(HEADER_FORMAT, MAGIC, VERSION, float(Q), n_frames, n_rows, n_cols,
+                       video_size, video_mtime_ns)
+
+def build_capacity_index(video_path, index_path, Q=120):
+    """
+    Quét toàn bộ video một lần và ghi chỉ mục khả năng nhúng ra đĩa.
+    Args:
+        video_path: Đường dẫn video.
+        index_path: File chỉ mục (ví dụ 'video.avi.cap').
+        Q: Ngưỡng quantization.
+    Returns:
+        header: Dict {'Q', 'n_frames', 'n_rows', 'n_cols', 'video_size', 'video_mtime_ns'},
+                hoặc None nếu không mở được video.
+    """
+    try:
+        source = FrameSource(video_path)
+    except ValueError:
+        print("Lỗi: Không mở được video")
+        return None
+
+    n_rows, n_cols = source.height // BLOCK_SIZE, source.width // BLOCK_SIZE
+    video_size, video_mtime_ns = _video_stamp(video_path)
+    n_frames = 0
+    with source, open(index_path, 'wb') as f:
+        f.write(b'\0' * HEADER_SIZE)  # Ghi header sau khi biết số khung thực tế
+        for _, frame in source:
+            f.write(scan_frame(frame, Q).tobytes())
+            n_frames += 1
+        f.seek(0)
+        f.write(pack_header(Q, n_frames, n_rows, n_cols, video_size, video_mtime_ns))
+
+    return {'Q': float(Q), 'n_frames': n_frames, 'n_rows': n_rows, 'n_cols': n_cols,
+            'video_size': video_size, 'video_mtime_ns': video_mtime_ns}
+
+def open_capacity_index(index_path):
+    """
+    Mở chỉ mục khả năng nhúng bằng memory map.
+    Returns:
+        header: Dict như build_capacity_index.
+        codes: np.memmap uint8 (số khung, H/8, W/8).
+    """
+    with open(index_path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) != HEADER_SIZE:
+        raise ValueError(f"File chỉ mục không hợp lệ: {index_path}")
+    magic, version, Q, n_frames, n_rows, n_cols, video_size, video_mtime_ns = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"File chỉ mục không hợp lệ: {index_path}")
+
+    header = {'Q': Q, 'n_frames': n_frames, 'n_rows': n_rows, 'n_cols': n_cols,
+              'video_size': video_size, 'video_mtime_ns': video_mtime_ns}
+    if n_frames * n_rows * n_cols == 0:
+        return header, np.zeros((n_frames, n_rows, n_cols), dtype=np.uint8)
+    codes = np.memmap(index_path, dtype=np.uint8, mode='r', offset=HEADER_SIZE,
+                      shape=(n_frames, n_rows, n_cols))
+    return header, codes
+
+def load_capacity_index(video_path, index_path=None, Q=120):
+    """
+    Dùng lại chỉ mục đã có nếu khớp video (kích thước, mtime) và Q, nếu không thì quét lại.
+    Args:
+        video_path: Đường dẫn video.
+        index_path: File chỉ mục (mặc định video_path + '.cap').
+        Q: Ngưỡng quantization.
+    Returns:
+        header, codes: Như open_capacity_index, hoặc (None, None) nếu lỗi.
+    """
+    index_path = index_path or video_path + '.cap'
+    header, codes = open_matching_capacity_index(video_path, index_path, Q)
+    if header is not None:
+        return header, codes
+    if build_capacity_index(video_path, index_path, Q) is None:
+        return None, None
+    return open_capacity_index(index_path)
+
+def open_matching_capacity_index(video_path, index_path, Q=120):
+    """
+    Mở chỉ mục nếu đã có và khớp video (kích thước, mtime) và Q, không quét lại.
+    Returns:
+        header, codes: Như open_capacity_index, hoặc (None, None) nếu chưa có hoặc không khớp.
+    """
+    if not os.path.exists(index_path):
+        return None, None
+    try:
+        header, codes = open_capacity_index(index_path)
+    except ValueError:
+        return None, None
+    if header['Q'] != Q or (header['video_size'], header['video_mtime_ns']) != _video_stamp(video_path):
+        return None, None
+    return header, codes
+
+def frame_capacity(codes):
+    """
+    Số khối nhúng được bit 0 / bit 1 của từng khung, và số khối dùng được ở chế độ
+    dung lượng cao (nhúng được cả hai bit, ứng viên ổn định).
+    Args:
+        codes: Mã khối (số khung, H/8, W/8) hoặc (H/8, W/8).
+    Returns:
+        n_ok0, n_ok1, n_payload: Mảng số khối.
+    """
+    axes = (-2, -1)
+    payload = CAN_EMBED_1 | STABLE
+    return (np.count_nonzero(codes & CAN_EMBED_0, axis=axes),
+            np.count_nonzero(codes & CAN_EMBED_1, axis=axes),
+            np.count_nonzero((codes & payload) == payload, axis=axes))
+
+def plan_groups(frame_codes, message_bits, group_size=5, max_blocks=100):
+    """
+    Mô phỏng cách embed_8bits_with_redundancy chọn khối (duyệt tối đa max_blocks khối đầu
+    theo thứ tự trái sang phải, trên xuống dưới) mà không cần giải mã khung.
+    Args:
+        frame_codes: Mã khối của một khung (H/8, W/8).
+        message_bits: Các bit cần nhúng.
+        group_size: Số khối mỗi bit.
+        max_blocks: Số khối tối đa được duyệt.
+    Returns:
+        block_indices: Danh sách nhóm khối [[(row, col), ...], ...], hoặc None nếu không đủ khối.
+    """
+    n_cols = frame_codes.shape[1]
+    flat = np.asarray(frame_codes).reshape(-1)[:max_blocks]
+    block_indices = []
+    current_group = []
+    bit_index = 0
+    for n, code in enumerate(flat):
+        if code & (CAN_EMBED_1 if message_bits[bit_index] else CAN_EMBED_0):
+            current_group.append((n // n_cols, n % n_cols))
+            if len(current_group) == group_size:
+                block_indices.append(current_group)
+                current_group = []
+                bit_index += 1
+                if bit_index >= len(message_bits):
+                    return block_indices
+    return None
+
+def plan_payload_frames(codes, n_bits, start_frame=2, redundancy=3, reserve=0.01):
+    """
+    Chia n_bits bit cho các khung từ start_frame, mỗi bit cần `redundancy` khối nhúng được
+    cả bit 0 lẫn bit 1 với ứng viên ổn định (chế độ dung lượng cao dùng mọi khối hợp lệ).
+    Mỗi khung chừa lại một phần khối (reserve) cho các khối bị loại khi kiểm tra sau nhúng.
+    Args:
+        codes: Mã khối (số khung, H/8, W/8) từ chỉ mục.
+        n_bits: Tổng số bit cần nhúng.
+        start_frame: Khung bắt đầu.
+        redundancy: Số khối cho mỗi bit.
+        reserve: Tỉ lệ khối chừa lại mỗi khung.
+    Returns:
+        plan: Danh sách (frame_idx, số bit) theo thứ tự, hoặc None nếu video không đủ dung lượng.
+    """
+    _, _, n_payload = frame_capacity(codes[start_frame:])
+    per_frame = (n_payload - np.ceil(n_payload * reserve).astype(int)) // redundancy
+    total = int(per_frame.sum())
+    if total < n_bits:
+        print(f"loi video chi chua duoc {total} bit (redundancy {redundancy}), can {n_bits} bit")
+        return None
+
+    plan = []
+    remaining = n_bits
+    for offset, capacity in enumerate(per_frame.tolist()):
+        if remaining == 0:
+            break
+        if capacity == 0:
+            continue
+        n = min(capacity, remaining)
+        plan.append((start_frame + offset, n))
+        remaining -= n
+    return plan
+
+def plan_frames(codes, bit_groups, start_frame=2, contiguous=False):
+    """
+    Chọn trước khung cho từng nhóm bit: mỗi nhóm vào khung kế tiếp (từ start_frame) đủ khối
+    nhúng, bỏ qua các khung ít chi tiết. Thứ tự khung giữ đúng thứ tự ký tự.
+    Args:
+        codes: Mã khối (số khung, H/8, W/8) từ chỉ mục.
+        bit_groups: Danh sách nhóm 8 bit.
+        start_frame: Khung bắt đầu.
+        contiguous: True = bắt buộc các khung liên tiếp như bản cũ (không bỏ qua khung).
+    Returns:
+        plan: Dict {frame_idx: block_indices dự kiến} theo thứ tự nhóm, hoặc None nếu không đủ.
+        skipped: Danh sách khung bị bỏ qua.
+    """
+    plan = {}
+    skipped = []
+    frame_idx = start_frame
+    for bits in bit_groups:
+        while frame_idx < len(codes):
+            block_indices = plan_groups(codes[frame_idx], bits)
+            if block_indices is not None:
+                plan[frame_idx] = block_indices
+                frame_idx += 1
+                break
+            if contiguous:
+                print(f"loi khung {frame_idx} khong du 40 khoi hop le de nhung 8 bit")
+                return None, skipped
+            skipped.append(frame_idx)
+            frame_idx += 1
+        else:
+            print(f"loi chi tim duoc {len(plan)} khung du khoi, can {len(bit_groups)} khung")
+            return None, skipped
+    return plan, skipped
@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from DWT import create_normalized_video
+from PSNR import calculate_metrics_video, score_candidates
+from deltaDCT import detect_scene_changes_parallel
+from giaumasv import embed_message, embed_payload_video, message_to_bit_groups
+from blockindex import write_block_index
+from pipeline import DWT_PARAMS, run_pipeline
+from planner import plan_video
+from profiling import PROFILER, configure_logging, enable_profiling
+from sceneindex import detect_scene_changes_indexed
+from tachtin import extract_message, extract_payload_video
+from videowriter import CODECS
+
+# ==== Job: mỗi loại việc nhận một dict tham số (dòng manifest) và trả về dict kết quả ====
+
+def _output_path(job, suffix):
+    """
+    Đường dẫn đầu ra mặc định: <output_dir>/<tên video gốc>.<job_id>.<suffix>.
+    """
+    output_dir = job.get('output_dir', '.')
+    stem = os.path.splitext(os.path.basename(job['input']))[0]
+    return os.path.join(output_dir, f"{stem}.{job['id']}.{suffix}")
+
+def _read_payload(job):
+    if 'payload_file' in job:
+        with open(job['payload_file'], 'rb') as f:
+            return f.read()
+    return job['payload']
+
+def _dwt_params(job):
+    # Hệ số DWT của job, kèm strip_height nếu chạy theo dải
+    params = dict(job.get('dwt_params') or {})
+    if job.get('strip_height'):
+        params['strip_height'] = job['strip_height']
+    return params
+
+def job_pipeline(job):
+    report = run_pipeline(job['input'], job.get('output') or _output_path(job, 'normalized.avi'),
+                          job['message'], job.get('start_frame', 2), job.get('Q', 120),
+                          _dwt_params(job),
+                          report_path=job.get('report') or _output_path(job, 'report.json'),
+                          index_path=job.get('index') or _output_path(job, 'bin'),
+                          codec=job.get('codec', 'raw'), n_chars=job.get('n_chars', len(job['message'])),
+                          frames=job.get('plan'), scene_aware=job.get('scene_aware', False),
+                          cut_margin=job.get('cut_margin', 3))
+    if report is None:
+        return None
+    keys = ('output_video', 'index_file', 'psnr_stego_avg', 'psnr_normalized_avg', 'bit_errors',
+            'recovered_message', 'verified')
+    return {key: report[key] for key in keys}
+
+def job_embed(job):
+    output = job.get('output') or _output_path(job, 'stego.avi')
+    index = job.get('index') or _output_path(job, 'bin')
+    all_block_indices = embed_message(job['input'], output, job['message'], job.get('start_frame', 2),
+                                      job.get('Q', 120), index, job.get('n_chars', len(job['message'])),
+                                      job.get('codec', 'raw'), job.get('plan'), job.get('scene_aware', False),
+                                      job.get('cut_margin', 3))
+    if all_block_indices is None:
+        return None
+    return {'output_video': output, 'index_file': index, 'frames': sorted(all_block_indices)}
+
+def job_plan(job):
+    # Kế hoạch khung nhúng theo nội dung, dùng lại bằng embed --plan
+    output = job.get('output') or _output_path(job, 'plan.json')
+    bit_groups = message_to_bit_groups(job['message'], job.get('n_chars', len(job['message'])))
+    plan, report = plan_video(job['input'], bit_groups, job.get('Q', 120), job.get('start_frame', 2),
+                              job.get('threshold'), job.get('cut_margin', 3), job.get('mode', 'exact'), output)
+    if plan is None:
+        return None
+    return dict(report, plan_file=output)
+
+def job_embed_payload(job):
+    output = job.get('output') or _output_path(job, 'stego.avi')
+    index = job.get('index') or _output_path(job, 'bin')
+    start_frame = job.get('start_frame', 2)
+    Q = job.get('Q', 120)
+    all_block_indices, report = embed_payload_video(job['input'], output, _read_payload(job), start_frame,
+                                                    job.get('redundancy', 3), Q, fec=job.get('fec'))
+    if all_block_indices is None:
+        return None
+    write_block_index(index, all_block_indices, Q=Q, channel_name='G', start_frame=start_frame)
+    return dict(report, output_video=output, index_file=index)
+
+def job_extract(job):
+    message, results = extract_message(job['input'], job.get('index', 'block_indices.bin'), verbose=False,
+                                       workers=job.get('workers'))
+    if not results:
+        return None
+    return {'message': message}
+
+def job_extract_payload(job):
+    data = extract_payload_video(job['input'], job.get('index', 'block_indices.bin'), job.get('fec'),
+                                 job.get('workers'))
+    if data is None:
+        return None
+    output = job.get('output') or _output_path(job, 'payload')
+    with open(output, 'wb') as f:
+        f.write(data)
+    return {'output': output, 'bytes': len(data)}
+
+def job_normalize(job):
+    output = job.get('output') or _output_path(job, 'normalized.avi')
+    params = dict(DWT_PARAMS, **_dwt_params(job))
+    if create_normalized_video(job['input'], job['stego'], output, index_path=job.get('index'),
+                               codec=job.get('codec', 'raw'), **params) is None:
+        return None
+    return {'output_video': output}
+
+def job_score(job):
+    if len(job['candidates']) == 1:
+        return calculate_metrics_video(job['input'], job['candidates'][0], job.get('index'),
+                                       csv_path=job.get('csv'))
+    return {'candidates': score_candidates(job['input'], job['candidates'], csv_path=job.get('csv'))}
+
+def job_scenes(job):
+    if job.get('no_index'):
+        return {'scene_changes': detect_scene_changes_parallel(job['input'], job.get('threshold', 10000),
+                                                               job.get('mode', 'exact'), job.get('workers'))}
+    # Chỉ mục có checkpoint: lần chạy bị ngắt được tiếp tục, đổi ngưỡng không cần giải mã lại
+    scene_changes, metrics = detect_scene_changes_indexed(job['input'], job.get('threshold', 10000),
+                                                          job.get('mode', 'exact'), job.get('index'),
+                                                          job.get('signatures', False))
+    return {'scene_changes': scene_changes, 'metrics': metrics}
+
+JOBS = {
+    'pipeline': job_pipeline,
+    'embed': job_embed,
+    'embed-payload': job_embed_payload,
+    'plan': job_plan,
+    'extract': job_extract,
+    'extract-payload': job_extract_payload,
+    'normalize': job_normalize,
+    'score': job_score,
+    'scenes': job_scenes,
+}
+
+def run_job(job):
+    """
+    Chạy một job trong process con; lỗi được ghi vào kết quả, không làm dừng cả lô.
+    Args:
+        job: Dict tham số, 'task' là một khóa của JOBS (mặc định 'pipeline');
+             'profile': true để đo thời gian từng giai đoạn (kèm 'profile_sample_rate').
+    Returns:
+        result: Dict {'id', 'task', 'status', 'seconds', 'result'} ('error' nếu thất bại),
+                kèm 'profile' (xem Profiler.summary) nếu job bật đo.
+    """
+    task = job.get('task', 'pipeline')
+    if job.get('profile'):
+        enable_profiling(job.get('profile_sample_rate', 0.0))
+    t_start = time.perf_counter()
+    entry = {'id': job['id'], 'task': task}
+    try:
+        result = JOBS[task](job)
+        entry['status'] = 'ok' if result is not None else 'failed'
+        entry['result'] = result
+    except Exception as e:
+        entry['status'] = 'error'
+        entry['error'] = f"{type(e).__name__}: {e}"
+        entry['traceback'] = traceback.format_exc()
+    entry['seconds'] = time.perf_counter() - t_start
+    if job.get('profile'):
+        entry['profile'] = PROFILER.summary()
+        PROFILER.enabled = False
+    return entry
+
+def load_manifest(path):
+    """
+    Đọc manifest: file JSON (danh sách job) hoặc JSON Lines (mỗi dòng một job).
+    Job thiếu 'id' được đánh số theo thứ tự.
+    """
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        jobs = json.loads(text)
+    else:
+        jobs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for n, job in enumerate(jobs):
+        job.setdefault('id', str(n))
+    return jobs
+
+def run_batch(manifest_path, results_path='batch_results.jsonl', workers=None, output_dir=None,
+              profile=False, profile_sample_rate=0.0):
+    """
+    Chạy mọi job của manifest trên process pool, ghi kết quả từng job ngay khi xong.
+    Args:
+        manifest_path: File manifest (xem load_manifest).
+        results_path: File JSON Lines kết quả (id, task, status, seconds, result).
+        workers: Số process (mặc định số CPU).
+        output_dir: Thư mục đầu ra mặc định cho job không chỉ định 'output_dir'.
+        profile: Đo từng giai đoạn của mọi job (mỗi process một bộ đo, kết quả trong 'profile').
+        profile_sample_rate: Tỉ lệ khung ghi sự kiện khi đo.
+    Returns:
+        results: Danh sách kết quả theo thứ tự manifest.
+    """
+    jobs = load_manifest(manifest_path)
+    for job in jobs:
+        if job.get('task', 'pipeline') not in JOBS:
+            print(f"Lỗi: job {job['id']} có task không hợp lệ: {job.get('task')}")
+            return None
+        if output_dir is not None:
+            job.setdefault('output_dir', output_dir)
+        if profile:
+            job.setdefault('profile', True)
+            job.setdefault('profile_sample_rate', profile_sample_rate)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    t_start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(results_path, 'w', encoding='utf-8') as f:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            entry = future.result()
+            results[entry['id']] = entry
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            print(f"[{len(results)}/{len(jobs)}] job {entry['id']} ({entry['task']}): "
+                  f"{entry['status']} sau {entry['seconds']:.2f} s")
+
+    n_ok = sum(entry['status'] == 'ok' for entry in results.values())
+    print(f"Xong {n_ok}/{len(jobs)} job trong {time.perf_counter() - t_start:.2f} s, kết quả: {results_path}")
+    return [results[job['id']] for job in jobs]
+
+# ==== Dòng lệnh ====
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Giấu tin DCT trong video: nhúng, tách, chuẩn hóa, đánh giá")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG để xem tiến độ từng khung")
+    parser.add_argument('--profile', default=None,
+                        help="ghi thời gian từng giai đoạn ra file .json hoặc .csv")
+    parser.add_argument('--profile-sample-rate', type=float, default=0.0,
+                        help="tỉ lệ khung ghi sự kiện (0.01 = mỗi 100 khung)")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="mở endpoint Prometheus http://127.0.0.1:PORT/metrics trong lúc chạy (lệnh đơn)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('embed', help="nhúng chuỗi (mỗi ký tự một khung)")
+    p.add_argument('input')
+    p.add_argument('-m', '--message', required=True)
+    p.add_argument('-o', '--output', default='stego_video_msv.avi')
+    p.add_argument('--index', default='block_indices.bin')
+    p.add_argument('--start-frame', type=int, default=2)
+    p.add_argument('-Q', type=float, default=120)
+    p.add_argument('--n-chars', type=int, default=None, help="số ký tự nhúng (mặc định cả chuỗi)")
+    p.add_argument('--codec', choices=list(CODECS), default='raw')
+    p.add_argument('--plan', default=None, help="file kế hoạch khung từ lệnh plan")
+    p.add_argument('--scene-aware', action='store_true', help="tự chọn khung theo nội dung và chuyển cảnh")
+    p.add_argument('--cut-margin', type=int, default=3)
+
+    p = sub.add_parser('plan', help="chọn trước khung nhúng theo nội dung (một lần giải mã)")
+    p.add_argument('input')
+    p.add_argument('-m', '--message', required=True)
+    p.add_argument('-o', '--output', default='frame_plan.json')
+    p.add_argument('--start-frame', type=int, default=2)
+    p.add_argument('-Q', type=float, default=120)
+    p.add_argument('--n-chars', type=int, default=None, help="số ký tự nhúng (mặc định cả chuỗi)")
+    p.add_argument('--threshold', type=float, default=None, help="ngưỡng chuyển cảnh (mặc định 100 x số điểm ảnh)")
+    p.add_argument('--cut-margin', type=int, default=3)
+    p.add_argument('--mode', choices=['exact', 'signature', 'dct'], default='exact')
+
+    p = sub.add_parser('embed-payload', help="nhúng file tùy ý (chế độ dung lượng cao)")
+    p.add_argument('input')
+    p.add_argument('payload_file')
+    p.add_argument('-o', '--output', default='stego_video_payload.avi')
+    p.add_argument('--index', default='block_indices.bin')
+    p.add_argument('--start-frame', type=int, default=2)
+    p.add_argument('-Q', type=float, default=120)
+    p.add_argument('--redundancy', type=int, default=3)
+    p.add_argument('--fec', choices=['hamming'])
+
+    p = sub.add_parser('extract', help="tách chuỗi theo file index")
+    p.add_argument('input')
+    p.add_argument('--index', default='block_indices.bin')
+    p.add_argument('--workers', type=int, default=None, help="tách song song (0 = số CPU)")
+
+    p = sub.add_parser('extract-payload', help="tách file đã nhúng bằng embed-payload")
+    p.add_argument('input')
+    p.add_argument('-o', '--output', required=True)
+    p.add_argument('--index', default='block_indices.bin')
+    p.add_argument('--fec', choices=['hamming'])
+    p.add_argument('--workers', type=int, default=None, help="tách song song (0 = số CPU)")
+
+    p = sub.add_parser('normalize', help="chuẩn hóa DWT video sau nhúng")
+    p.add_argument('input', help="video gốc")
+    p.add_argument('stego')
+    p.add_argument('-o', '--output', default='normalized_stego_video.avi')
+    p.add_argument('--index', default=None)
+    p.add_argument('--dwt-params', type=json.loads, default=None, help="JSON, ví dụ '{\"beta_ll_g\": 0.7}'")
+    p.add_argument('--codec', choices=list(CODECS), default='raw')
+    p.add_argument('--strip-height', type=int, default=None, help="xử lý theo dải (bội số của 8)")
+
+    p = sub.add_parser('score', help="PSNR/SSIM của video so với video gốc")
+    p.add_argument('input', help="video gốc")
+    p.add_argument('candidates', nargs='+')
+    p.add_argument('--index', default=None)
+    p.add_argument('--csv', default=None)
+
+    p = sub.add_parser('pipeline', help="nhúng + chuẩn hóa + PSNR + kiểm tra tách trong một lần đọc")
+    p.add_argument('input')
+    p.add_argument('-m', '--message', required=True)
+    p.add_argument('-o', '--output', default='normalized_stego_video.avi')
+    p.add_argument('--index', default='block_indices.bin')
+    p.add_argument('--report', default='pipeline_report.json')
+    p.add_argument('--start-frame', type=int, default=2)
+    p.add_argument('-Q', type=float, default=120)
+    p.add_argument('--n-chars', type=int, default=None, help="số ký tự nhúng (mặc định cả chuỗi)")
+    p.add_argument('--dwt-params', type=json.loads, default=None)
+    p.add_argument('--codec', choices=list(CODECS), default='raw')
+    p.add_argument('--strip-height', type=int, default=None, help="xử lý theo dải (bội số của 8)")
+    p.add_argument('--plan', default=None, help="file kế hoạch khung từ lệnh plan")
+    p.add_argument('--scene-aware', action='store_true', help="tự chọn khung theo nội dung và chuyển cảnh")
+    p.add_argument('--cut-margin', type=int, default=3)
+
+    p = sub.add_parser('scenes', help="phát hiện chuyển cảnh")
+    p.add_argument('input')
+    p.add_argument('--threshold', type=float, default=10000)
+    p.add_argument('--mode', choices=['exact', 'signature', 'dct'], default='exact')
+    p.add_argument('--index', default=None, help="chỉ mục chuyển cảnh (mặc định <video>.scn)")
+    p.add_argument('--signatures', action='store_true', help="lưu chữ ký DCT từng khung vào chỉ mục")
+    p.add_argument('--no-index', action='store_true', help="quét song song, không dùng chỉ mục")
+    p.add_argument('--workers', type=int, default=None, help="số process khi --no-index")
+
+    p = sub.add_parser('batch', help="chạy manifest job trên process pool")
+    p.add_argument('manifest', help="JSON (danh sách) hoặc JSON Lines")
+    p.add_argument('--results', default='batch_results.jsonl')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--output-dir', default=None)
+    return parser
+
+# Tùy chọn chung, không truyền vào job
+GLOBAL_OPTIONS = ('command', 'log_level', 'profile', 'profile_sample_rate', 'metrics_port')
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(args.log_level)
+    if args.command == 'batch':
+        results = run_batch(args.manifest, args.results, args.workers, args.output_dir,
+                            args.profile is not None, args.profile_sample_rate)
+        if results is not None and args.profile:
+            with open(args.profile, 'w', encoding='utf-8') as f:
+                json.dump({r['id']: r.get('profile') for r in results}, f, indent=2, ensure_ascii=False)
+        return 0 if results is not None and all(r['status'] == 'ok' for r in results) else 1
+
+    # Lệnh đơn: dựng job từ tham số và chạy ngay trong process hiện tại
+    job = {key: value for key, value in vars(args).items() if value is not None and key not in GLOBAL_OPTIONS}
+    job.update(id='cli', task=args.command)
+    if args.profile or args.metrics_port:
+        enable_profiling(args.profile_sample_rate)
+    server = PROFILER.serve(args.metrics_port) if args.metrics_port else None
+    entry = run_job(job)
+    if server is not None:
+        server.shutdown()
+    if args.profile:
+        PROFILER.write(args.profile)
+    if entry['status'] == 'error':
+        print(entry['traceback'], file=sys.stderr)
+    else:
+        print(json.dumps(entry['result'], indent=2, ensure_ascii=False, default=str))
+    return 0 if entry['status'] == 'ok' else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,10 @@
+import os
 import cv2
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from scipy.fft import dct
+from framesource import FrameSource
 
 # Hàm tính DCT cho 1 frame
 def compute_dct(frame):
@@ -12,38 +16,193 @@ def detect_scene_change(prev_dct, curr_dct, threshold=10000):
     diff = np.sum((curr_dct - prev_dct) ** 2)
     return diff > threshold
 
+# ==== ENGINE: exact / signature ====
+
+@lru_cache(maxsize=None)
+def dct_matrix(n, k):
+    """
+    K hàng đầu của ma trận DCT-II trực chuẩn n x n (tính một lần rồi dùng lại).
+    """
+    x = np.arange(n)
+    rows = np.arange(k)[:, None]
+    matrix = np.cos(np.pi * (2 * x[None, :] + 1) * rows / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+def compute_signature(frame_gray, signature_size=64, K=16):
+    """
+    Chữ ký tần số thấp: K x K hệ số DCT góc trên trái của khung thu nhỏ.
+    Args:
+        frame_gray: Khung xám (H, W, uint8).
+        signature_size: Kích thước khung thu nhỏ (signature_size x signature_size).
+        K: Số hệ số giữ lại mỗi chiều.
+    Returns:
+        signature: Mảng (K, K) float.
+    """
+    small = cv2.resize(frame_gray, (signature_size, signature_size),
+                       interpolation=cv2.INTER_AREA).astype(float)
+    C = dct_matrix(signature_size, K)
+    return C @ small @ C.T
+
+def frame_feature(frame, mode='exact', signature_size=64, K=16):
+    """
+    Đặc trưng của một khung dùng để so sánh với khung trước.
+    Args:
+        frame: Khung màu (H, W, 3, uint8).
+        mode: 'exact' (khung xám uint8), 'signature' (K x K hệ số DCT) hoặc 'dct' (DCT toàn khung, bản cũ).
+    """
+    if mode == 'dct':
+        return compute_dct(frame)
+    frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if mode == 'exact':
+        return frame_gray
+    if mode == 'signature':
+        return compute_signature(frame_gray, signature_size, K)
+    raise ValueError(f"Chế độ không hợp lệ: {mode}")
+
+def frame_metric(prev_feature, curr_feature, mode='exact', frame_shape=None, signature_size=64):
+    """
+    Độ lệch giữa hai khung theo cùng thang với tổng bình phương độ lệch DCT.
+    Args:
+        prev_feature, curr_feature: Đặc trưng từ frame_feature.
+        mode: Chế độ đã dùng để tính đặc trưng.
+        frame_shape: (H, W) của khung gốc, cần cho chế độ 'signature'.
+        signature_size: Kích thước khung thu nhỏ của chế độ 'signature'.
+    Returns:
+        diff: Độ lệch (int ở chế độ 'exact', float ở các chế độ khác).
+    """
+    if mode == 'exact':
+        # DCT trực chuẩn bảo toàn năng lượng (Parseval): tổng bình phương độ lệch DCT
+        # bằng tổng bình phương độ lệch điểm ảnh, tính trên số nguyên
+        return int(cv2.norm(prev_feature, curr_feature, cv2.NORM_L2SQR))
+    diff = np.sum((curr_feature - prev_feature) ** 2)
+    if mode == 'signature':
+        # Khung thu nhỏ là trung bình của (H*W)/size^2 điểm ảnh: nhân lại để xấp xỉ thang gốc
+        diff *= frame_shape[0] * frame_shape[1] / signature_size ** 2
+    return diff
+
 # ==== MAIN FUNCTION ====
 
-def detect_scene_changes_in_video(video_path, threshold=10000):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
+def detect_scene_changes_in_video(video_path, threshold=10000, mode='exact', signature_size=64, K=16,
+                                  index_path=None):
+    """
+    Phát hiện chuyển cảnh trong video.
+    Args:
+        video_path: Đường dẫn video.
+        threshold: Ngưỡng độ lệch giữa hai khung liên tiếp.
+        mode: 'exact' (miền điểm ảnh, cùng kết quả với DCT toàn khung), 'signature'
+              (K x K hệ số DCT tần số thấp của khung thu nhỏ) hoặc 'dct' (bản cũ).
+        signature_size, K: Thông số của chế độ 'signature'.
+        index_path: File chỉ mục chuyển cảnh (xem sceneindex): quét có checkpoint và tiếp tục
+                    được khi bị ngắt, lần sau chỉ đọc chỉ mục. None = quét, không lưu.
+    Returns:
+        scene_changes: Danh sách chỉ số frame chuyển cảnh.
+    """
+    if index_path is not None:
+        from sceneindex import detect_scene_changes_indexed
+        scene_changes, metrics = detect_scene_changes_indexed(video_path, threshold, mode, index_path,
+                                                              signature_size=signature_size, K=K)
+        print("Các frame chuyển cảnh:")
+        for frame_index, metric in zip(scene_changes, metrics):
+            print(f"→ Chuyển cảnh tại frame: {frame_index} (độ lệch {metric:.0f})")
+        return scene_changes
+
+    try:
+        source = FrameSource(video_path)
+    except ValueError:
         print("Không thể mở video.")
-        return
+        return []
 
-    ret, prev_frame = cap.read()
-    if not ret:
-        print("Không thể đọc frame đầu tiên.")
-        return
+    scene_changes = []
+    with source:
+        frames = iter(source)
+        first = next(frames, None)
+        if first is None:
+            print("Không thể đọc frame đầu tiên.")
+            return []
 
-    prev_dct = compute_dct(prev_frame)
-    frame_index = 1
+        _, prev_frame = first
+        frame_shape = prev_frame.shape[:2]
+        prev_feature = frame_feature(prev_frame, mode, signature_size, K)
 
-    print("Các frame chuyển cảnh:")
+        print("Các frame chuyển cảnh:")
+
+        for frame_index, frame in frames:
+            curr_feature = frame_feature(frame, mode, signature_size, K)
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+            if frame_metric(prev_feature, curr_feature, mode, frame_shape, signature_size) > threshold:
+                print(f"→ Chuyển cảnh tại frame: {frame_index}")
+                scene_changes.append(frame_index)
 
-        curr_dct = compute_dct(frame)
+            prev_feature = curr_feature
 
-        if detect_scene_change(prev_dct, curr_dct, threshold=threshold):
-            print(f"→ Chuyển cảnh tại frame: {frame_index}")
+    return scene_changes
 
-        prev_dct = curr_dct
-        frame_index += 1
+def _detect_chunk(video_path, start, end, threshold, mode, signature_size, K):
+    """
+    Phát hiện chuyển cảnh cho các frame [start, end) bằng capture riêng (end=None: đến hết video).
+    Đọc thêm frame start - 1 (gối đầu 1 frame với đoạn trước) để không bỏ sót chuyển cảnh ở biên.
+    """
+    scene_changes = []
+    stop_frame = None if end is None else end - 1
+    with FrameSource(video_path, start_frame=start - 1, stop_frame=stop_frame) as source:
+        frames = iter(source)
+        first = next(frames, None)
+        if first is None:
+            return []
 
+        _, prev_frame = first
+        frame_shape = prev_frame.shape[:2]
+        prev_feature = frame_feature(prev_frame, mode, signature_size, K)
+        for frame_index, frame in frames:
+            curr_feature = frame_feature(frame, mode, signature_size, K)
+            if frame_metric(prev_feature, curr_feature, mode, frame_shape, signature_size) > threshold:
+                scene_changes.append(frame_index)
+            prev_feature = curr_feature
+
+    return scene_changes
+
+def detect_scene_changes_parallel(video_path, threshold=10000, mode='exact', workers=None,
+                                  chunk_size=None, signature_size=64, K=16):
+    """
+    Phát hiện chuyển cảnh song song: chia video thành các đoạn frame, mỗi đoạn chạy trong
+    một process với capture riêng. Kết quả giống hệt detect_scene_changes_in_video.
+    Args:
+        video_path: Đường dẫn video.
+        threshold, mode, signature_size, K: Như detect_scene_changes_in_video.
+        workers: Số process (mặc định số CPU).
+        chunk_size: Số frame mỗi đoạn (mặc định chia đều thành 4 đoạn mỗi process).
+    Returns:
+        scene_changes: Danh sách chỉ số frame chuyển cảnh, theo thứ tự.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("Không thể mở video.")
+        return []
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     cap.release()
 
-# Ví dụ sử dụng:
-detect_scene_changes_in_video("uncompressed_video.avi", threshold=10000)
+    workers = workers or os.cpu_count() or 1
+    # Không biết số frame hoặc chỉ một process: chạy tuần tự
+    if frame_count <= 1 or workers == 1:
+        return detect_scene_changes_in_video(video_path, threshold, mode, signature_size, K)
+
+    # Frame 1 .. frame_count - 1 được so với frame liền trước
+    chunk_size = chunk_size or max(1, -(-(frame_count - 1) // (workers * 4)))
+    starts = list(range(1, frame_count, chunk_size))
+    ends = starts[1:] + [None]  # Đoạn cuối đọc đến hết, phòng khi CAP_PROP_FRAME_COUNT lệch
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_detect_chunk, video_path, start, end, threshold, mode,
+                                   signature_size, K)
+                   for start, end in zip(starts, ends)]
+        scene_changes = [frame_index for future in futures for frame_index in future.result()]
+
+    print("Các frame chuyển cảnh:")
+    for frame_index in scene_changes:
+        print(f"→ Chuyển cảnh tại frame: {frame_index}")
+    return scene_changes
+
+if __name__ == "__main__":
+    video_path = input("nhap duong dan video (mac dinh uncompressed_video.avi): ") or "uncompressed_video.avi"
+    detect_scene_changes_in_video(video_path, threshold=10000, index_path=video_path + '.scn')
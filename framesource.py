@@ -0,0 +1,230 @@
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from profiling import PROFILER
+from rawavi import open_raw_avi
+
+class FrameSource:
+    """
+    Đọc trước khung hình trên luồng nền vào vòng đệm numpy cấp phát sẵn.
+    Giải mã khung tiếp theo chạy song song với xử lý khung hiện tại.
+
+    Dùng:
+        with FrameSource('video.avi') as source:
+            for frame_idx, frame in source: ...
+        with FrameSource(['goc.avi', 'stego.avi']) as source:
+            for frame_idx, (frame_orig, frame_stego) in source: ...
+
+    Khung trả về là view vào vòng đệm, chỉ hợp lệ đến lần lặp kế tiếp
+    (cần .copy() nếu muốn giữ lại lâu hơn).
+
+    Nếu mọi video đều là AVI không nén BGR24, khung được lấy thẳng từ mmap qua
+    RawAVIReader (view chỉ đọc, seek O(1)), không cần luồng giải mã.
+    """
+
+    def __init__(self, video_paths, buffer_size=8, start_frame=0, stop_frame=None, frames=None):
+        """
+        Args:
+            video_paths: Đường dẫn một video, hoặc list/tuple nhiều video đọc đồng bộ.
+            buffer_size: Số slot trong vòng đệm.
+            start_frame: Khung bắt đầu (seek một lần khi mở).
+            stop_frame: Dừng sau khung này (None = đến hết video).
+            frames: Tập chỉ số khung cần trả về (None = tất cả). Các khung khác chỉ grab,
+                    không chuyển đổi ảnh; đọc dừng sau khung cuối cùng trong tập.
+        """
+        self.multi = not isinstance(video_paths, str)
+        self.video_paths = list(video_paths) if self.multi else [video_paths]
+        self.caps = []
+        self._readers = None
+        self._thread = None
+        self.frames_read = 0
+        self.wait_seconds = 0.0
+        self.decode_seconds = 0.0
+
+        self.frames = None if frames is None else set(frames)
+        if self.frames is not None:
+            last = max(self.frames, default=start_frame - 1)
+            stop_frame = last if stop_frame is None else min(stop_frame, last)
+        self.start_frame = start_frame
+        self.stop_frame = stop_frame
+
+        readers = [open_raw_avi(path) for path in self.video_paths]
+        if all(readers):
+            self._open_raw(readers)
+            return
+        for reader in readers:
+            if reader is not None:
+                reader.close()
+
+        for path in self.video_paths:
+            cap = cv2.VideoCapture(path)
+            self.caps.append(cap)
+            if not cap.isOpened():
+                self._release_caps()
+                raise ValueError(f"Không mở được video: {path}")
+
+        cap = self.caps[0]
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_counts = [int(c.get(cv2.CAP_PROP_FRAME_COUNT)) for c in self.caps]
+        self.frame_count = self.frame_counts[0]
+        self.shapes = [(int(c.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(c.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+                       for c in self.caps]
+
+        if start_frame:
+            for c in self.caps:
+                c.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+        # Vòng đệm: mỗi slot giữ một khung cho mỗi video
+        self._buffers = [[np.empty(shape, dtype=np.uint8) for shape in self.shapes]
+                         for _ in range(buffer_size)]
+        self._free = queue.Queue()
+        for slot in range(buffer_size):
+            self._free.put(slot)
+        self._filled = queue.Queue()
+        self._current = None
+        self._stop = threading.Event()
+        self._error = None
+
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self._thread.start()
+
+    def _open_raw(self, readers):
+        self._readers = readers
+        reader = readers[0]
+        self.width = reader.width
+        self.height = reader.height
+        self.fps = reader.fps
+        self.frame_counts = [r.frame_count for r in readers]
+        self.frame_count = self.frame_counts[0]
+        self.shapes = [(r.height, r.width, 3) for r in readers]
+
+        end = min(self.frame_counts)
+        if self.stop_frame is not None:
+            end = min(end, self.stop_frame + 1)
+        indices = range(self.start_frame, end)
+        if self.frames is not None:
+            indices = (i for i in indices if i in self.frames)
+        self._raw_indices = iter(indices)
+
+    def _next_raw(self):
+        frame_idx = next(self._raw_indices)
+        t0 = time.perf_counter()
+        frames = tuple(reader.read(frame_idx) for reader in self._readers)
+        seconds = time.perf_counter() - t0
+        self.decode_seconds += seconds
+        PROFILER.record('decode', seconds)
+        self.frames_read += 1
+        return frame_idx, (frames if self.multi else frames[0])
+
+    def _decode_loop(self):
+        frame_idx = self.start_frame
+        try:
+            while not self._stop.is_set():
+                if self.stop_frame is not None and frame_idx > self.stop_frame:
+                    break
+
+                # Khung không cần: chỉ grab
+                if self.frames is not None and frame_idx not in self.frames:
+                    t0 = time.perf_counter()
+                    ok = all(cap.grab() for cap in self.caps)
+                    seconds = time.perf_counter() - t0
+                    self.decode_seconds += seconds
+                    PROFILER.record('decode', seconds)
+                    if not ok:
+                        break
+                    frame_idx += 1
+                    continue
+
+                slot = self._get_free_slot()
+                if slot is None:
+                    break
+                t0 = time.perf_counter()
+                buffers = self._buffers[slot]
+                ok = True
+                for k, cap in enumerate(self.caps):
+                    ret, image = cap.read(buffers[k])
+                    if not ret:
+                        ok = False
+                        break
+                    if image is not buffers[k]:
+                        # Backend trả về mảng mới (khác kích thước): thay slot bằng mảng đó
+                        buffers[k] = image
+                seconds = time.perf_counter() - t0
+                self.decode_seconds += seconds
+                PROFILER.record('decode', seconds)
+                if not ok:
+                    break
+                self._filled.put((slot, frame_idx))
+                frame_idx += 1
+        except Exception as e:  # Chuyển lỗi sang luồng tiêu thụ
+            self._error = e
+        self._filled.put(None)
+
+    def _get_free_slot(self):
+        while not self._stop.is_set():
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._readers is not None:
+            return self._next_raw()
+
+        # Trả slot của lần lặp trước về vòng đệm
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+
+        t0 = time.perf_counter()
+        item = self._filled.get()
+        self.wait_seconds += time.perf_counter() - t0
+        if item is None:
+            self._filled.put(None)  # Các lần gọi sau cũng dừng
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+
+        slot, frame_idx = item
+        self._current = slot
+        self.frames_read += 1
+        buffers = self._buffers[slot]
+        return frame_idx, (tuple(buffers) if self.multi else buffers[0])
+
+    def stats(self):
+        """
+        Thống kê: số khung, tổng thời gian giải mã và thời gian bên tiêu thụ chờ giải mã.
+        """
+        return {
+            'frames': self.frames_read,
+            'decode_seconds': self.decode_seconds,
+            'wait_seconds': self.wait_seconds,
+            'wait_per_frame_ms': 1000 * self.wait_seconds / max(self.frames_read, 1),
+        }
+
+    def close(self):
+        if self._readers is not None:
+            for reader in self._readers:
+                reader.close()
+            return
+        self._stop.set()
+        self._thread.join()
+        self._release_caps()
+
+    def _release_caps(self):
+        for cap in self.caps:
+            cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,6 +1,21 @@
-import cv2
+import logging
+import os
+import time
 import numpy as np
 from scipy.fft import dct, idct
+from blockdct import (BLOCK_SIZE, split_blocks, dct_blocks, idct_blocks,
+                      find_candidates, embeddable_masks, stable_candidates, apply_quantization)
+from blockindex import write_block_index
+from capacity import load_capacity_index, plan_frames, plan_payload_frames
+from framesource import FrameSource
+from payload import encode_payload
+from planner import load_frame_plan, plan_video
+from profiling import PROFILER
+from tachtin import check_closer_array
+from rawavi import RawAVIReader, open_raw_avi, copy_file_fast
+from videowriter import AsyncVideoWriter
+
+logger = logging.getLogger(__name__)
 
 def embed_dct_8x8_quantization(block, bit, Q=120):
     """
@@ -40,9 +55,89 @@ def embed_dct_8x8_quantization(block, bit, Q=120):
     block_reconstructed = idct(idct(dct_block, axis=1, norm='ortho'), axis=0, norm='ortho')
     return block_reconstructed, True
 
+def _select_and_embed_8bits(frame, message_bits, Q=120):
+    """
+    Phần chung của embed_8bits_with_redundancy và embed_8bits_frame: chọn khối và lượng tử hóa
+    trên dải các hàng khối cần duyệt (tối đa 100 khối đầu tiên), không đụng tới phần còn lại.
+    Returns:
+        status: 'skip' (không đủ 8 bit đầu vào), 'fail' (không đủ khối) hoặc 'ok'.
+        block_indices: Các nhóm khối đã chọn.
+        reconstructed: Khối sau IDCT (rows_needed, n_cols, 8, 8) float, khối chưa duyệt bằng 0.
+        n_used: Số khối đã duyệt.
+    """
+    block_size = BLOCK_SIZE
+    height, width, _ = frame.shape
+    block_indices = []  # Lưu 8 nhóm, mỗi nhóm 5 khối
+    
+    if len(message_bits) != 8:
+        return 'skip', block_indices, None, 0
+    
+    n_rows, n_cols = height // block_size, width // block_size
+    max_blocks = min(100, n_rows * n_cols)  # Bản gốc bỏ cuộc sau 100 khối
+    if max_blocks == 0:
+        return 'fail', block_indices, None, 0
+    rows_needed = -(-max_blocks // n_cols)
+    
+    # DCT một lần cho cả lô khối theo thứ tự trái sang phải, trên xuống dưới
+    with PROFILER.stage('color_split'):
+        blocks = split_blocks(frame[:rows_needed * block_size, :, 1].astype(float))
+    blocks = blocks.reshape(-1, block_size, block_size)[:max_blocks]
+    dct_coeffs = dct_blocks(blocks)
+    ok0, ok1, v = embeddable_masks(dct_coeffs, Q)
+    
+    # Gán bit cho từng khối: chỉ là duyệt mảng bool, không còn gọi DCT trong vòng lặp
+    bits = np.zeros(max_blocks, dtype=int)
+    used = np.zeros(max_blocks, dtype=bool)
+    bit_index = 0
+    current_group = []  # Lưu 5 khối cho mỗi bit
+    n_used = 0
+    for n in range(max_blocks):
+        bit = message_bits[bit_index]
+        bits[n] = bit
+        n_used = n + 1
+        if ok1[n] if bit else ok0[n]:
+            used[n] = True
+            current_group.append((n // n_cols, n % n_cols))
+            if len(current_group) == 5:  # Đủ 5 khối cho bit hiện tại
+                block_indices.append(current_group)
+                current_group = []
+                bit_index += 1
+                if bit_index >= 8:
+                    break
+    
+    # Nếu không đủ 8 bit (40 khối)
+    if bit_index < 8:
+        return 'fail', block_indices, None, n_used
+    
+    # Lượng tử hóa tất cả khối được chọn cùng lúc, IDCT chỉ các khối đã duyệt
+    selected = dct_coeffs[used]
+    apply_quantization(selected, v[used], bits[used], Q)
+    dct_coeffs[used] = selected
+    reconstructed = np.zeros((rows_needed * n_cols, block_size, block_size))
+    reconstructed[:n_used] = idct_blocks(dct_coeffs[:n_used])
+    return 'ok', block_indices, reconstructed.reshape(rows_needed, n_cols, block_size, block_size), n_used
+
+def _write_green(green, reconstructed, n_used):
+    """
+    Ghi dải khối đã nhúng vào kênh G, giữ nguyên hành vi cũ: phần kênh G chưa được duyệt bằng 0,
+    khối thiếu ở mép phải được chép nguyên nếu cả hàng khối đã được duyệt.
+    """
+    rows_needed, n_cols = reconstructed.shape[:2]
+    strip_rows = rows_needed * BLOCK_SIZE
+    edge = green[:strip_rows, n_cols * BLOCK_SIZE:].copy()
+    green[...] = 0
+    split_blocks(green[:strip_rows])[...] = reconstructed
+    
+    for i in range(rows_needed):
+        if edge.size and n_used > (i + 1) * n_cols:
+            rows = slice(i * BLOCK_SIZE, (i + 1) * BLOCK_SIZE)
+            green[rows, n_cols * BLOCK_SIZE:] = edge[rows]
+
 def embed_8bits_with_redundancy(frame, message_bits, Q=120):
     """
     Nhúng 8 bit vào 40 khối 8x8 đầu tiên của kênh G, mỗi bit nhúng vào 5 khối liên tiếp.
+    DCT/IDCT được tính theo lô cho tất cả khối cần duyệt (tối đa 100 khối đầu tiên),
+    kết quả giống hệt từng bit với cách duyệt từng khối bằng embed_dct_8x8_quantization.
     Args:
         frame: Khung màu (H, W, 3, uint8).
         message_bits: Danh sách 8 bit cần nhúng.
@@ -52,153 +147,449 @@ def embed_8bits_with_redundancy(frame, message_bits, Q=120):
         embedded_success: True nếu nhúng đủ 8 bit (40 khối), False nếu không.
         block_indices: Danh sách 8 nhóm, mỗi nhóm 5 chỉ số khối [(i,j), (i,j), (i,j), (i,j), (i,j)].
     """
-    block_size = 8
-    height, width, _ = frame.shape
     frame_float = frame.astype(float)
-    frame_reconstructed = np.zeros_like(frame_float)
-    block_indices = []  # Lưu 8 nhóm, mỗi nhóm 5 khối
-    bits_embedded = 0
-    
-    channels = cv2.split(frame_float)
-    
-    for c, channel_name in enumerate(['B', 'G', 'R']):
-        channel = channels[c]
-        reconstructed_channel = np.zeros_like(channel)
-        
-        if channel_name == 'G' and len(message_bits) == 8:
-            bit_index = 0
-            current_group = []  # Lưu 5 khối cho mỗi bit
-            block_count = 0  # Đếm tổng số khối đã duyệt
-            
-            # Duyệt khối theo thứ tự từ trái sang phải, trên xuống dưới
-            for i in range(0, height, block_size):
-                for j in range(0, width, block_size):
-                    if bit_index >= 8:  # Đã nhúng đủ 8 bit
-                        break
-                    block = channel[i:i+block_size, j:j+block_size]
-                    if block.shape != (block_size, block_size):
-                        reconstructed_channel[i:i+block_size, j:j+block_size] = block
-                        continue
-                    
-                    block_reconstructed, embedded = embed_dct_8x8_quantization(
-                        block, message_bits[bit_index], Q)
-                    reconstructed_channel[i:i+block_size, j:j+block_size] = block_reconstructed
-                    block_count += 1
-                    
-                    if embedded:
-                        current_group.append((i // block_size, j // block_size))
-                        if len(current_group) == 5:  # Đủ 5 khối cho bit hiện tại
-                            block_indices.append(current_group)
-                            current_group = []
-                            bit_index += 1
-                            bits_embedded = bit_index
-                    
-                    # Nếu duyệt quá nhiều khối mà chưa đủ 8 bit
-                    if block_count >= 100 and bits_embedded < 8:
-                        return frame_float, False, block_indices
-                
-                if bit_index >= 8:
-                    break
+    status, block_indices, reconstructed, n_used = _select_and_embed_8bits(frame, message_bits, Q)
+    if status != 'ok':
+        return frame_float, status == 'skip', block_indices
+    
+    # Bản sao float riêng, sửa trực tiếp
+    _write_green(frame_float[:, :, 1], reconstructed, n_used)
+    return frame_float, True, block_indices
+
+def embed_8bits_frame(frame, message_bits, Q=120):
+    """
+    Như embed_8bits_with_redundancy nhưng trả về thẳng khung uint8, giống hệt
+    np.clip(frame_reconstructed, 0, 255).astype(np.uint8) của các hàm gọi. Chỉ dải các hàng khối
+    được duyệt đi qua float, không cấp phát bản sao float cả khung (quan trọng ở 4K/8K).
+    Returns:
+        frame_embedded: Khung sau nhúng (uint8), bản sao của khung vào nếu không nhúng được.
+        embedded_success, block_indices: Như embed_8bits_with_redundancy.
+    """
+    frame_embedded = frame.copy()
+    status, block_indices, reconstructed, n_used = _select_and_embed_8bits(frame, message_bits, Q)
+    if status != 'ok':
+        return frame_embedded, status == 'skip', block_indices
+    
+    with PROFILER.stage('clip_cast'):
+        reconstructed = np.clip(reconstructed, 0, 255).astype(np.uint8)
+    _write_green(frame_embedded[:, :, 1], reconstructed, n_used)
+    return frame_embedded, True, block_indices
+
+def embed_message_video(input_video, output_video, bit_groups, start_frame=2, Q=120, frames=None, codec='raw'):
+    """
+    Nhúng mỗi nhóm 8 bit vào một khung, bắt đầu từ start_frame; giải mã và ghi lại toàn bộ video.
+    Args:
+        input_video: Đường dẫn video gốc.
+        output_video: Đường dẫn video sau nhúng (.avi).
+        bit_groups: Danh sách nhóm 8 bit, mỗi nhóm một khung.
+        start_frame: Khung bắt đầu nhúng.
+        Q: Ngưỡng quantization.
+        frames: Khung đã chọn trước cho từng nhóm (từ capacity.plan_frames),
+                None = các khung liên tiếp từ start_frame.
+        codec: Codec không mất mát của video ra ('raw', 'ffv1', 'huffyuv', 'png');
+               codec có nén được đọc lại và so từng khung sau khi ghi.
+    Returns:
+        all_block_indices: Dict {frame_idx: block_indices}, hoặc None nếu lỗi.
+    """
+    # Giải mã trước trên luồng nền
+    try:
+        source = FrameSource(input_video)
+    except ValueError:
+        print("Lỗi: Không mở được video")
+        return None
+    
+    # Kiểm tra số khung đủ cho các khung đã chọn
+    n_groups = len(bit_groups)
+    frames = _group_frames(n_groups, start_frame, frames)
+    frame_count = source.frame_count
+    if frames and frame_count <= frames[-1]:
+        print(f"loi video chi co {frame_count} khung, cần ít nhất {frames[-1] + 1} khung")
+        source.close()
+        return None
+    
+    # Tạo video đầu ra, ghi trên luồng nền
+    try:
+        out = AsyncVideoWriter(output_video, int(source.fps), (source.width, source.height), codec)
+    except ValueError as e:
+        print(f"Lỗi: {e}")
+        source.close()
+        return None
+    
+    # Nhúng 8 bit vào mỗi khung, mỗi bit vào 5 khối
+    group_of_frame = {frame_idx: k for k, frame_idx in enumerate(frames)}
+    group_idx = 0
+    all_block_indices = {}
+    
+    with source:
+        for frame_idx, frame in source:
+            if frame_idx in group_of_frame:
+                # Nhúng 8 bit của nhóm hiện tại
+                frame_embedded, embedded_success, block_indices = embed_8bits_frame(
+                    frame, bit_groups[group_of_frame[frame_idx]], Q=Q)
+                if not embedded_success:
+                    print(f"loi khung {frame_idx} khong du 40 khoi hop le de nhung 8 bit")
+                    out.release()
+                    os.remove(output_video)
+                    return None
+                logger.debug("Khung %d: khối đã nhúng %s", frame_idx, block_indices)
+                PROFILER.count('frames_embedded')
+                PROFILER.frame_event('embed', frame_idx, groups=len(block_indices))
+                all_block_indices[frame_idx] = block_indices
+                group_idx += 1
+                frame = frame_embedded
             
-            # Nếu không đủ 8 bit (40 khối)
-            if bits_embedded < 8:
-                return frame_float, False, block_indices
-        else:
-            reconstructed_channel = channel.copy()
-        
-        frame_reconstructed[:, :, c] = reconstructed_channel
-    
-    return frame_reconstructed, True, block_indices
-
-# Nhập chuỗi từ người dùng
-message = input("nhap ma sinh vien (10 ky tu): ")
-if len(message) < 10:
-    print("Lỗi: Chuỗi phải có ít nhất 10 ký tự")
-    exit()
-
-# Chuyển 10 ký tự thành 80 bit (1 ký tự = 8 bit mỗi khung)
-message_bits = []
-for char in message[:10]:  # Lấy 10 ký tự đầu
-    bits = [int(b) for b in format(ord(char), '08b')]
-    message_bits.extend(bits)
-print(f"tong so bit can nhung {len(message_bits)} (10 ky tu x 8 bit)")
-
-# Chia thành 10 nhóm 8 bit
-bit_groups = [message_bits[i:i+8] for i in range(0, 80, 8)]
-if len(bit_groups) != 10:
-    print("Lỗi: Không đủ bit cho 10 khung")
-    exit()
-
-# Nhập thông tin video
-input_video = input("nhap duong dan video dau vao: ")
-output_video = 'stego_video_msv.avi'
-start_frame = int(input("nhap khun bat dau (mac dinh 2): ") or 2)
-
-cap = cv2.VideoCapture(input_video)
-if not cap.isOpened():
-    print("Lỗi: Không mở được video")
-    exit()
-
-# Lấy thông tin video
-width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-fps = int(cap.get(cv2.CAP_PROP_FPS))
-frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-# Kiểm tra số khung đủ cho 10 khung từ start_frame
-if frame_count < start_frame + 10:
-    print(f"loi video chi co {frame_count} khung, cần ít nhất {start_frame + 10} khung")
-    cap.release()
-    exit()
-
-# Tạo video đầu ra
-fourcc = 0
-out = cv2.VideoWriter(output_video, fourcc, fps, (width, height))
-
-# Nhúng 8 bit vào 10 khung, mỗi bit vào 5 khối
-frame_idx = 0
-group_idx = 0
-all_block_indices = {}
-
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
-    
-    if start_frame <= frame_idx < start_frame + 10 and group_idx < 10:
-        # Nhúng 8 bit của nhóm hiện tại
-        frame_reconstructed, embedded_success, block_indices = embed_8bits_with_redundancy(
-            frame, bit_groups[group_idx], Q=120)
-        if embedded_success:
-            #print(f"Khung {frame_idx}: Đã nhúng 8 bit (ký tự {group_idx+1})")
-            if frame_idx == start_frame:
-                with open('block_indices.txt', 'w') as f:
-                    f.write(f"Khung {frame_idx}: {block_indices}\n")
-            else:
-                with open('block_indices.txt', 'a') as f:
-                    f.write(f"Khung {frame_idx}: {block_indices}\n")
-            print(f"{block_indices}")
-            print('')
-            all_block_indices[frame_idx] = block_indices
-            group_idx += 1
-        else:
-            print(f"loi khung {frame_idx} khong du 40 khoi hop le de nhung 8 bit")
-            cap.release()
-            out.release()
-            exit()
-    else:
-        frame_reconstructed = frame.astype(float)
+            # Khung không nhúng được ghi nguyên, không chuyển qua float
+            out.write(frame)
+    
+    if out.release(verify=codec != 'raw'):
+        os.remove(output_video)
+        return None
+    
+    if group_idx < n_groups:
+        print(f"loi chi nhung duoc {group_idx} khung, khong du {n_groups} khung")
+        os.remove(output_video)
+        return None
+    return all_block_indices
+
+def embed_message_inplace(input_video, output_video, bit_groups, start_frame=2, Q=120, frames=None):
+    """
+    Nhúng vào AVI không nén BGR24 mà không giải mã/ghi lại: chép nguyên file (reflink/sendfile)
+    rồi ghi đè tại chỗ đúng các khung mang tin. Mọi byte khác giống hệt file gốc.
+    Args:
+        input_video: Đường dẫn AVI không nén BGR24.
+        output_video: Đường dẫn video sau nhúng.
+        bit_groups: Danh sách nhóm 8 bit, mỗi nhóm một khung.
+        start_frame: Khung bắt đầu nhúng.
+        Q: Ngưỡng quantization.
+        frames: Như embed_message_video.
+    Returns:
+        all_block_indices: Dict {frame_idx: block_indices}, hoặc None nếu lỗi.
+    """
+    n_groups = len(bit_groups)
+    frames = _group_frames(n_groups, start_frame, frames)
+    with RawAVIReader(input_video) as reader:
+        frame_count = reader.frame_count
+    if frames and frame_count <= frames[-1]:
+        print(f"loi video chi co {frame_count} khung, cần ít nhất {frames[-1] + 1} khung")
+        return None
     
-    frame_reconstructed = np.clip(frame_reconstructed, 0, 255).astype(np.uint8)
-    out.write(frame_reconstructed)
+    copy_file_fast(input_video, output_video)
+    all_block_indices = {}
+    with RawAVIReader(output_video, 'r+') as writer:
+        for frame_idx, bits in zip(frames, bit_groups):
+            # Chỉ đọc và ghi đúng khung mang tin
+            frame_embedded, embedded_success, block_indices = embed_8bits_frame(writer.read(frame_idx), bits, Q=Q)
+            if not embedded_success:
+                print(f"loi khung {frame_idx} khong du 40 khoi hop le de nhung 8 bit")
+                break
+            writer.write(frame_idx, frame_embedded)
+            logger.debug("Khung %d: khối đã nhúng %s", frame_idx, block_indices)
+            PROFILER.count('frames_embedded')
+            PROFILER.frame_event('embed', frame_idx, groups=len(block_indices))
+            all_block_indices[frame_idx] = block_indices
+        writer.flush()
     
-    frame_idx += 1
+    if len(all_block_indices) < n_groups:
+        os.remove(output_video)
+        return None
+    return all_block_indices
+
+# ==== CHẾ ĐỘ DUNG LƯỢNG CAO: payload bytes tùy ý trên mọi khối hợp lệ ====
+
+def embed_bits_frame(frame, bits, redundancy=3, Q=120, max_rounds=4):
+    """
+    Nhúng dãy bit vào mọi khối hợp lệ của kênh G (DCT/IDCT theo lô cho cả khung).
+    Khối hợp lệ là khối nhúng được cả bit 0 lẫn bit 1 và có ứng viên ổn định, lấy theo thứ tự
+    trái sang phải, trên xuống dưới; bản sao thứ r của bit j nằm ở khối thứ r * len(bits) + j
+    nên các bản sao của cùng một bit cách xa nhau. Chỉ các khối được dùng bị thay đổi.
+    Sau khi nhúng, các khối được tách thử lại; khối cho sai bit (do làm tròn/cắt về [0, 255])
+    bị loại và khung được nhúng lại, tối đa max_rounds lần. Khung chỉ được nhận khi mọi khối
+    tách đúng, không dựa vào bỏ phiếu đa số giữa các bản sao để sửa khối sai.
+    Args:
+        frame: Khung màu (H, W, 3, uint8).
+        bits: Mảng bit cần nhúng.
+        redundancy: Số khối cho mỗi bit.
+        Q: Ngưỡng quantization.
+        max_rounds: Số lần nhúng lại tối đa.
+    Returns:
+        frame_embedded: Khung sau nhúng (uint8), hoặc None nếu không đủ khối hoặc vẫn còn
+                        khối tách sai sau max_rounds lần.
+        block_indices: Danh sách nhóm khối, mỗi bit một nhóm `redundancy` khối.
+    """
+    bits = np.asarray(bits, dtype=int)
+    n_bits = len(bits)
+    expected = np.tile(bits, redundancy)
+    blocks = split_blocks(frame[:, :, 1])
+    n_cols = blocks.shape[1]
+    with PROFILER.stage('color_split'):
+        blocks_float = blocks.astype(float)
+    dct_coeffs = dct_blocks(blocks_float).reshape(-1, BLOCK_SIZE, BLOCK_SIZE)
+    _, ok1, v = embeddable_masks(dct_coeffs, Q)
+    usable = ok1 & stable_candidates(dct_coeffs, v)
+
+    for _ in range(max(1, max_rounds)):
+        slots = np.flatnonzero(usable)[:n_bits * redundancy]
+        if len(slots) < n_bits * redundancy:
+            return None, []
+
+        # Lượng tử hóa và IDCT chỉ các khối được dùng
+        selected = dct_coeffs[slots]
+        apply_quantization(selected, v[slots], expected, Q)
+        reconstructed = idct_blocks(selected)
+        with PROFILER.stage('clip_cast'):
+            reconstructed = np.clip(np.rint(reconstructed), 0, 255)
+
+        # Tách thử trên khối đã làm tròn
+        check = dct_blocks(reconstructed)
+        has_candidate, v_check = find_candidates(check)
+        values = check[np.arange(len(slots)), 2, v_check]
+        wrong = ~has_candidate | (check_closer_array(values, Q) != expected)
+        if not wrong.any():
+            break
+        usable[slots[wrong]] = False
+    else:
+        # Không ghi khối đã biết là tách sai: dãy bit (độ dài, CRC) không tự nhận ra lỗi này
+        logger.warning("Còn %d khối tách sai sau %d lần nhúng lại", np.count_nonzero(wrong),
+                       max(1, max_rounds))
+        return None, []
+
+    frame_embedded = frame.copy()
+    rows, cols = np.divmod(slots, n_cols)
+    split_blocks(frame_embedded[:, :, 1])[rows, cols] = reconstructed
+
+    # Nhóm của bit j: các khối j, n_bits + j, 2 * n_bits + j, ...
+    rows = rows.reshape(redundancy, n_bits).T.tolist()
+    cols = cols.reshape(redundancy, n_bits).T.tolist()
+    block_indices = [list(zip(r, c)) for r, c in zip(rows, cols)]
+    return frame_embedded, block_indices
+
+def embed_payload_video(input_video, output_video, data, start_frame=2, redundancy=3, Q=120,
+                        capacity_path=None, fec=None):
+    """
+    Nhúng payload tùy ý (header độ dài + CRC32 + dữ liệu) vào nhiều khung, dùng mọi khối hợp lệ.
+    fec='hamming' với redundancy=1 chứa khoảng 1.7 lần (12/7) số bit so với lặp 3 lần trên cùng số khối (4/7 so với 1/3 bit mỗi khối).
+    Khung và số bit mỗi khung được chọn trước từ chỉ mục khả năng nhúng, không có lỗi giữa chừng.
+    Args:
+        input_video: Đường dẫn video gốc.
+        output_video: Đường dẫn video sau nhúng (AVI không nén BGR24).
+        data: bytes hoặc str (UTF-8).
+        start_frame: Khung bắt đầu nhúng.
+        redundancy: Số khối cho mỗi bit.
+        Q: Ngưỡng quantization.
+        capacity_path: File chỉ mục khả năng nhúng (mặc định input_video + '.cap').
+        fec: Mã sửa lỗi (None hoặc 'hamming'), bên tách phải dùng cùng giá trị.
+    Returns:
+        all_block_indices: Dict {frame_idx: block_indices}, hoặc None nếu lỗi.
+        report: Dict thống kê (số bit, số khung, bit/khung, bit/giây).
+    """
+    t_start = time.perf_counter()
+    bits = encode_payload(data, fec)
+    header, codes = load_capacity_index(input_video, capacity_path, Q)
+    if header is None:
+        return None, {}
+    plan = plan_payload_frames(codes, len(bits), start_frame, redundancy)
+    if plan is None:
+        return None, {}
+
+    # Dãy bit của từng khung theo kế hoạch
+    chunks = {}
+    offset = 0
+    for frame_idx, n in plan:
+        chunks[frame_idx] = bits[offset:offset + n]
+        offset += n
+
+    all_block_indices = {}
+    raw_input = open_raw_avi(input_video)
+    if raw_input is not None:
+        # AVI không nén BGR24: chép file, chỉ ghi đè các khung mang tin
+        raw_input.close()
+        copy_file_fast(input_video, output_video)
+        with RawAVIReader(output_video, 'r+') as writer:
+            for frame_idx, chunk in chunks.items():
+                frame_embedded, block_indices = embed_bits_frame(writer.read(frame_idx), chunk, redundancy, Q)
+                if frame_embedded is None:
+                    break
+                writer.write(frame_idx, frame_embedded)
+                all_block_indices[frame_idx] = block_indices
+                PROFILER.count('frames_embedded')
+                PROFILER.frame_event('embed', frame_idx, bits=len(block_indices))
+            writer.flush()
+    else:
+        try:
+            source = FrameSource(input_video)
+        except ValueError:
+            print("Lỗi: Không mở được video")
+            return None, {}
+        out = AsyncVideoWriter(output_video, int(source.fps), (source.width, source.height))
+        with source:
+            for frame_idx, frame in source:
+                if frame_idx in chunks:
+                    frame, block_indices = embed_bits_frame(frame, chunks[frame_idx], redundancy, Q)
+                    if frame is None:
+                        break
+                    all_block_indices[frame_idx] = block_indices
+                    PROFILER.count('frames_embedded')
+                    PROFILER.frame_event('embed', frame_idx, bits=len(block_indices))
+                out.write(frame)
+        out.release()
+
+    if len(all_block_indices) < len(chunks):
+        frame_idx = next(f for f in chunks if f not in all_block_indices)
+        print(f"loi khung {frame_idx} khong du khoi hop le de nhung {len(chunks[frame_idx])} bit")
+        os.remove(output_video)
+        return None, {}
+
+    seconds = time.perf_counter() - t_start
+    n_bits_payload = 8 * (len(data.encode('utf-8')) if isinstance(data, str) else len(data))
+    report = {
+        'payload_bits': n_bits_payload,
+        'total_bits': len(bits),
+        'frames': len(plan),
+        'redundancy': redundancy,
+        'fec': fec,
+        'bits_per_frame': len(bits) / len(plan),
+        'seconds': seconds,
+        'payload_bits_per_second': n_bits_payload / seconds if seconds else float('inf'),
+    }
+    return all_block_indices, report
+
+def _group_frames(n_groups, start_frame, frames=None):
+    # Khung cho từng nhóm: theo kế hoạch có sẵn hoặc liên tiếp từ start_frame
+    if frames is None:
+        return list(range(start_frame, start_frame + n_groups))
+    frames = list(frames)
+    if len(frames) != n_groups:
+        raise ValueError(f"Cần {n_groups} khung, kế hoạch có {len(frames)} khung")
+    return frames
+
+def message_to_bit_groups(message, n_chars=10):
+    """
+    Chuyển n_chars ký tự đầu của chuỗi thành các nhóm 8 bit (1 ký tự = 8 bit mỗi khung).
+    Args:
+        message: Chuỗi cần nhúng.
+        n_chars: Số ký tự lấy (mặc định 10).
+    Returns:
+        bit_groups: Danh sách nhóm 8 bit.
+    """
+    message_bits = []
+    for char in message[:n_chars]:
+        bits = [int(b) for b in format(ord(char), '08b')]
+        message_bits.extend(bits)
+    return [message_bits[i:i+8] for i in range(0, len(message_bits), 8)]
+
+def plan_message_frames(input_video, bit_groups, start_frame=2, Q=120, frames=None, scene_aware=False,
+                        cut_margin=3):
+    """
+    Chọn trước khung cho từng nhóm 8 bit trước khi giải mã/ghi video, để việc nhúng không
+    thất bại giữa chừng. Dùng chung cho embed_message và pipeline.run_pipeline.
+    Args:
+        input_video: Đường dẫn video gốc.
+        bit_groups: Danh sách nhóm 8 bit.
+        start_frame: Khung sớm nhất được chọn.
+        Q: Ngưỡng quantization.
+        frames: Khung đã chọn sẵn (danh sách hoặc file kế hoạch JSON), None = tự chọn.
+        scene_aware: Chọn theo nội dung (planner.plan_video) thay vì khung đủ khối kế tiếp
+                     (capacity.plan_frames).
+        cut_margin: Như planner.plan_embed_frames.
+    Returns:
+        frames: Danh sách khung tăng dần, mỗi nhóm một khung, hoặc None nếu lỗi.
+    """
+    if isinstance(frames, str):
+        # Kế hoạch đã lập trước (planner)
+        frames, _ = load_frame_plan(frames)
+    if frames is not None:
+        if len(frames) < len(bit_groups):
+            print(f"Lỗi: Kế hoạch chỉ có {len(frames)} khung, cần {len(bit_groups)} khung")
+            return None
+        frames = list(frames)[:len(bit_groups)]
+        if any(a >= b for a, b in zip(frames, frames[1:])):
+            # Bên tách ghép ký tự theo thứ tự khung
+            print("Lỗi: Khung trong kế hoạch phải tăng dần")
+            return None
+    elif scene_aware:
+        # Một lần giải mã cho cả chuyển cảnh và khả năng nhúng, chọn khung theo nội dung
+        plan, report = plan_video(input_video, bit_groups, Q, start_frame, cut_margin=cut_margin)
+        if plan is None:
+            return None
+        frames = list(plan)
+        print(f"khung nhung theo noi dung: {frames} ({report['cuts']} chuyen canh)")
+    else:
+        # Quét trước khả năng nhúng, chọn khung trước khi ghi
+        header, codes = load_capacity_index(input_video, Q=Q)
+        if header is None:
+            return None
+        plan, skipped = plan_frames(codes, bit_groups, start_frame)
+        if plan is None:
+            return None
+        if skipped:
+            print(f"bo qua cac khung khong du khoi hop le: {skipped}")
+        frames = list(plan)
+    return frames
+
+def embed_message(input_video, output_video, message, start_frame=2, Q=120, index_path='block_indices.bin',
+                  n_chars=10, codec='raw', frames=None, scene_aware=False, cut_margin=3):
+    """
+    Nhúng n_chars ký tự đầu của chuỗi (mỗi ký tự một khung) và ghi index vị trí khối.
+    Khung được chọn trước từ chỉ mục khả năng nhúng (dùng lại file .cap nếu video không đổi);
+    AVI không nén BGR24 được chép rồi ghi đè tại chỗ, định dạng khác được giải mã/ghi lại.
+    Args:
+        input_video: Đường dẫn video gốc.
+        output_video: Đường dẫn video sau nhúng.
+        message: Chuỗi cần nhúng.
+        start_frame: Khung bắt đầu nhúng.
+        Q: Ngưỡng quantization.
+        index_path: File index vị trí khối.
+        n_chars: Số ký tự nhúng.
+        codec: Codec không mất mát của video ra; khác 'raw' thì luôn giải mã/ghi lại.
+        frames: Khung cho từng ký tự, danh sách hoặc file kế hoạch JSON (planner.write_frame_plan);
+                None = tự chọn.
+        scene_aware: Tự chọn khung theo nội dung (planner.plan_video: nhúng được ngay lần đầu,
+                     xa chuyển cảnh, nhiều vân) thay vì khung đủ khối kế tiếp từ start_frame.
+        cut_margin: Khoảng cách tới chuyển cảnh được coi là đủ xa (scene_aware).
+    Returns:
+        all_block_indices: Dict {frame_idx: block_indices}, hoặc None nếu lỗi.
+    """
+    if len(message) < n_chars:
+        print(f"Lỗi: Chuỗi phải có ít nhất {n_chars} ký tự")
+        return None
+
+    # Chuyển n_chars ký tự thành các nhóm 8 bit (1 ký tự = 8 bit mỗi khung)
+    bit_groups = message_to_bit_groups(message, n_chars)
+    print(f"tong so bit can nhung {8 * len(bit_groups)} ({n_chars} ky tu x 8 bit)")
+
+    frames = plan_message_frames(input_video, bit_groups, start_frame, Q, frames, scene_aware, cut_margin)
+    if frames is None:
+        return None
+
+    # AVI không nén BGR24: chép file và chỉ ghi đè các khung nhúng; định dạng khác: giải mã/ghi lại
+    raw_input = open_raw_avi(input_video) if codec == 'raw' else None
+    if raw_input is not None:
+        raw_input.close()
+        all_block_indices = embed_message_inplace(input_video, output_video, bit_groups, start_frame, Q=Q,
+                                                  frames=frames)
+    else:
+        all_block_indices = embed_message_video(input_video, output_video, bit_groups, start_frame, Q=Q,
+                                                frames=frames, codec=codec)
+
+    if all_block_indices is not None:
+        # Ghi index vị trí khối một lần sau khi nhúng xong
+        write_block_index(index_path, all_block_indices, Q=Q, channel_name='G',
+                          start_frame=min(all_block_indices, default=start_frame))
+    return all_block_indices
+
+if __name__ == "__main__":
+    # Nhập chuỗi từ người dùng
+    message = input("nhap ma sinh vien (10 ky tu): ")
 
-cap.release()
-out.release()
+    # Nhập thông tin video
+    input_video = input("nhap duong dan video dau vao: ")
+    output_video = 'stego_video_msv.avi'
+    index_file = 'block_indices.bin'
+    start_frame = int(input("nhap khun bat dau (mac dinh 2): ") or 2)
 
-if group_idx < 10:
-    print(f"loi chi nhung duoc {group_idx} khung, khong du 10 khung")
-else:
-    print(f"da tao video nhung: {output_video}")
-    print(f"vi tri khoi nhung: {all_block_indices}")
\ No newline at end of file
+    all_block_indices = embed_message(input_video, output_video, message, start_frame, Q=120,
+                                      index_path=index_file)
+    if all_block_indices is not None:
+        print(f"da tao video nhung: {output_video}")
+        print(f"da ghi vi tri khoi: {index_file}")
+        print(f"vi tri khoi nhung: {all_block_indices}")
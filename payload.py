@@ -0,0 +1,119 @@
+import struct
+import zlib
+import numpy as np
+
+# Header: 4 byte độ dài (số byte dữ liệu) + 4 byte CRC32 của dữ liệu, big-endian
+HEADER_FORMAT = '>II'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Mã Hamming(7,4) dạng hệ thống: từ mã = 4 bit dữ liệu + 3 bit chẵn lẻ
+HAMMING_G = np.array([[1, 0, 0, 0, 1, 1, 0],
+                      [0, 1, 0, 0, 1, 0, 1],
+                      [0, 0, 1, 0, 0, 1, 1],
+                      [0, 0, 0, 1, 1, 1, 1]], dtype=np.uint8)
+HAMMING_H = np.array([[1, 1, 0, 1, 1, 0, 0],
+                      [1, 0, 1, 1, 0, 1, 0],
+                      [0, 1, 1, 1, 0, 0, 1]], dtype=np.uint8)
+
+# Syndrome (đọc như số 3 bit) -> vị trí bit lỗi trong từ mã, -1 nếu không lỗi
+SYNDROME_POSITION = np.full(8, -1)
+for _pos in range(7):
+    SYNDROME_POSITION[HAMMING_H[0, _pos] * 4 + HAMMING_H[1, _pos] * 2 + HAMMING_H[2, _pos]] = _pos
+
+FEC_MODES = (None, 'hamming')
+
+def bytes_to_bits(data):
+    """
+    Chuyển bytes thành mảng bit (MSB trước) bằng np.unpackbits.
+    Returns:
+        bits: Mảng uint8 (8 * len(data),) gồm 0/1.
+    """
+    return np.unpackbits(np.frombuffer(bytes(data), dtype=np.uint8))
+
+def bits_to_bytes(bits):
+    """
+    Ghép mảng bit (MSB trước) thành bytes, bỏ phần dư không đủ 8 bit.
+    Giá trị -1 (bit không tách được) được coi là 0.
+    """
+    bits = (np.asarray(bits) > 0).astype(np.uint8)
+    return np.packbits(bits[:len(bits) // 8 * 8]).tobytes()
+
+def hamming_encode(bits):
+    """
+    Mã hóa Hamming(7,4) cho cả dãy bit trong một phép nhân ma trận.
+    Args:
+        bits: Mảng bit (được thêm 0 cho đủ bội số của 4).
+    Returns:
+        encoded: Mảng uint8 (7 * ceil(len(bits) / 4),).
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    padded = np.zeros(-(-len(bits) // 4) * 4, dtype=np.uint8)
+    padded[:len(bits)] = bits
+    return (padded.reshape(-1, 4) @ HAMMING_G % 2).astype(np.uint8).ravel()
+
+def hamming_decode(bits):
+    """
+    Giải mã Hamming(7,4), sửa 1 bit lỗi mỗi từ mã (vector hóa cho mọi từ mã).
+    Args:
+        bits: Mảng bit đã mã hóa (bỏ phần dư không đủ 7 bit).
+    Returns:
+        decoded: Mảng uint8 4 bit dữ liệu mỗi từ mã.
+        n_corrected: Số từ mã đã được sửa.
+    """
+    bits = (np.asarray(bits) > 0).astype(np.uint8)
+    codewords = bits[:len(bits) // 7 * 7].reshape(-1, 7).copy()
+    syndrome = codewords @ HAMMING_H.T % 2
+    position = SYNDROME_POSITION[syndrome @ np.array([4, 2, 1])]
+    errors = np.flatnonzero(position >= 0)
+    codewords[errors, position[errors]] ^= 1
+    return codewords[:, :4].ravel(), len(errors)
+
+def encode_payload(data, fec=None):
+    """
+    Đóng gói dữ liệu: header (độ dài + CRC32) + dữ liệu, trả về dãy bit cần nhúng.
+    Args:
+        data: bytes, hoặc str (mã hóa UTF-8).
+        fec: None (không mã sửa lỗi) hoặc 'hamming' (Hamming(7,4)).
+    Returns:
+        bits: Mảng uint8 gồm 0/1.
+    """
+    if fec not in FEC_MODES:
+        raise ValueError(f"fec không hợp lệ: {fec}")
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    data = bytes(data)
+    bits = bytes_to_bits(struct.pack(HEADER_FORMAT, len(data), zlib.crc32(data)) + data)
+    if fec == 'hamming':
+        bits = hamming_encode(bits)
+    return bits
+
+def decode_payload(bits, fec=None):
+    """
+    Tách dữ liệu từ dãy bit đã trích xuất (ngược với encode_payload).
+    Args:
+        bits: Mảng bit (có thể dài hơn dữ liệu thật).
+        fec: Mã sửa lỗi đã dùng khi nhúng.
+    Returns:
+        data: bytes, hoặc None nếu header độ dài không hợp lệ hoặc sai CRC.
+    """
+    if fec not in FEC_MODES:
+        raise ValueError(f"fec không hợp lệ: {fec}")
+    if fec == 'hamming':
+        bits, _ = hamming_decode(bits)
+    raw = bits_to_bytes(bits)
+    if len(raw) < HEADER_SIZE:
+        return None
+    length, crc = struct.unpack(HEADER_FORMAT, raw[:HEADER_SIZE])
+    if HEADER_SIZE + length > len(raw):
+        return None
+    data = raw[HEADER_SIZE:HEADER_SIZE + length]
+    if zlib.crc32(data) != crc:
+        return None
+    return data
+
+def decode_text(bits, encoding='latin-1'):
+    """
+    Ghép từng 8 bit thành ký tự (không header), bỏ phần dư không đủ 8 bit.
+    Mặc định latin-1 để mỗi byte ứng với đúng chr(byte) như cách ghép ký tự cũ.
+    """
+    return bits_to_bytes(bits).decode(encoding, errors='replace')
@@ -0,0 +1,168 @@
+import json
+import os
+import time
+import numpy as np
+from blockindex import write_block_index
+from DWT import DWTNormalizer
+from framesource import FrameSource
+from giaumasv import embed_8bits_frame, message_to_bit_groups, plan_message_frames
+from PSNR import calculate_psnr_frame
+from videowriter import AsyncVideoWriter
+from tachtin import extract_bits_from_frame
+from bit2char import bits_to_string
+
+# Giống mặc định của create_normalized_video
+DWT_PARAMS = {
+    'alpha_ll_g': 0.2, 'beta_ll_g': 0.8, 'alpha_detail_g': 0.05, 'beta_detail_g': 0.95,
+    'alpha_ll_br': 0.9, 'beta_ll_br': 0.1, 'alpha_detail_br': 0.7, 'beta_detail_br': 0.3,
+    'wavelet': 'haar',
+}
+
+def run_pipeline(input_video, output_video, message, start_frame=2, Q=120, dwt_params=None,
+                 report_path='pipeline_report.json', index_path='block_indices.bin', codec='raw', verify=None,
+                 n_chars=10, frames=None, scene_aware=False, cut_margin=3):
+    """
+    Nhúng, chuẩn hóa DWT, tính PSNR và kiểm tra tách tin trong một lần giải mã video gốc
+    (thay cho 4 lần đọc giaumasv.py -> DWT.py -> PSNR.py -> tachtin.py).
+    Chỉ ghi video chuẩn hóa cuối cùng, file index vị trí khối và báo cáo JSON.
+    Khung nhúng được chọn trước khi giải mã (như giaumasv.embed_message), nên không dừng giữa chừng
+    ở khung không đủ khối.
+    Args:
+        input_video: Đường dẫn video gốc.
+        output_video: Đường dẫn video chuẩn hóa (.avi).
+        message: Chuỗi cần nhúng (mỗi ký tự một khung), chỉ n_chars ký tự đầu như giaumasv.embed_message.
+        start_frame: Khung sớm nhất được chọn để nhúng.
+        Q: Ngưỡng quantization.
+        dwt_params: Hệ số cho DWTNormalizer (mặc định DWT_PARAMS).
+        report_path: File báo cáo JSON (PSNR, kết quả tách tin, thời gian).
+        index_path: File index vị trí khối.
+        codec: Codec không mất mát của video ra ('raw', 'ffv1', 'huffyuv', 'png').
+        verify: Đọc lại video ra và so từng khung (None = chỉ khi codec có nén).
+        n_chars: Số ký tự nhúng.
+        frames, scene_aware, cut_margin: Cách chọn khung, xem giaumasv.plan_message_frames.
+    Returns:
+        report: Dict báo cáo, hoặc None nếu lỗi.
+    """
+    if len(message) < n_chars:
+        print(f"Lỗi: Chuỗi phải có ít nhất {n_chars} ký tự")
+        return None
+    message = message[:n_chars]
+
+    dwt_params = dict(DWT_PARAMS, **(dwt_params or {}))
+    normalizer = DWTNormalizer(**dwt_params)
+    bit_groups = message_to_bit_groups(message, n_chars)
+
+    # Chọn khung từ chỉ mục khả năng nhúng trước khi giải mã
+    frames = plan_message_frames(input_video, bit_groups, start_frame, Q, frames, scene_aware, cut_margin)
+    if frames is None:
+        return None
+    group_of_frame = {frame_idx: k for k, frame_idx in enumerate(frames)}
+
+    try:
+        source = FrameSource(input_video)
+    except ValueError:
+        print("Lỗi: Không mở được video")
+        return None
+    if frames and source.frame_count <= frames[-1]:
+        print(f"loi video chi co {source.frame_count} khung, cần ít nhất {frames[-1] + 1} khung")
+        source.close()
+        return None
+
+    try:
+        out = AsyncVideoWriter(output_video, int(source.fps), (source.width, source.height), codec)
+    except ValueError as e:
+        print(f"Lỗi: {e}")
+        source.close()
+        return None
+    t_start = time.perf_counter()
+    psnr_stego, psnr_normalized = [], []
+    all_block_indices = {}
+    extracted = {}
+    failed = False
+
+    with source:
+        for frame_idx, frame in source:
+            stego = frame
+            if frame_idx in group_of_frame:
+                # 1. Nhúng 8 bit vào khung đã chọn
+                stego, embedded_success, block_indices = embed_8bits_frame(
+                    frame, bit_groups[group_of_frame[frame_idx]], Q=Q)
+                if not embedded_success:
+                    print(f"loi khung {frame_idx} khong du 40 khoi hop le de nhung 8 bit")
+                    failed = True
+                    break
+                all_block_indices[frame_idx] = block_indices
+
+            # 2. Chuẩn hóa DWT so với khung gốc (khung không nhúng được chép thẳng)
+            normalized = normalizer.normalize_changed(frame, stego)
+
+            # 3. PSNR trong bộ nhớ, không đọc lại video
+            psnr_stego.append(calculate_psnr_frame(frame, stego))
+            psnr_normalized.append(calculate_psnr_frame(frame, normalized))
+
+            # 4. Kiểm tra tách tin trên khung chuẩn hóa
+            if frame_idx in all_block_indices:
+                voted, _ = extract_bits_from_frame(normalized, all_block_indices[frame_idx], 'G', Q)
+                extracted[frame_idx] = ''.join(str(b) for b in voted)
+
+            out.write(normalized)
+
+    verify = codec != 'raw' if verify is None else verify
+    mismatched = out.release(verify=verify and not failed)
+    if failed or mismatched:
+        os.remove(output_video)
+        return None
+
+    write_block_index(index_path, all_block_indices, Q=Q, channel_name='G',
+                      start_frame=min(all_block_indices, default=start_frame))
+
+    expected = {frame_idx: ''.join(str(b) for b in bits) for frame_idx, bits in zip(frames, bit_groups)}
+    recovered = ''.join(bits_to_string([int(b) for b in extracted[f]]) for f in sorted(extracted))
+    report = {
+        'input_video': input_video,
+        'output_video': output_video,
+        'codec': codec,
+        'roundtrip_verified': verify,
+        'index_file': index_path,
+        'start_frame': start_frame,
+        'embed_frames': frames,
+        'Q': Q,
+        'dwt_params': dwt_params,
+        'frames': len(psnr_normalized),
+        'seconds': time.perf_counter() - t_start,
+        'psnr_stego_avg': _psnr_average(psnr_stego),
+        'psnr_normalized_avg': _psnr_average(psnr_normalized),
+        'psnr_stego': [_psnr_json(p) for p in psnr_stego],
+        'psnr_normalized': [_psnr_json(p) for p in psnr_normalized],
+        'extracted_bits': {str(f): extracted[f] for f in sorted(extracted)},
+        'bit_errors': sum(a != b for f in expected for a, b in zip(expected[f], extracted.get(f, ''))),
+        'message': message,
+        'recovered_message': recovered,
+        'verified': recovered == message,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+def _psnr_average(psnr_list):
+    # Thay np.inf bằng 100 dB như calculate_psnr_video
+    if not psnr_list:
+        return None
+    return float(np.mean([100 if np.isinf(p) else p for p in psnr_list]))
+
+def _psnr_json(psnr):
+    # JSON không có inf: khung giống hệt ghi null
+    return None if np.isinf(psnr) else round(float(psnr), 4)
+
+if __name__ == "__main__":
+    message = input("nhap ma sinh vien (10 ky tu): ")
+    input_video = input("nhap duong dan video dau vao: ")
+    start_frame = int(input("nhap khun bat dau (mac dinh 2): ") or 2)
+
+    report_path = 'pipeline_report.json'
+    report = run_pipeline(input_video, 'normalized_stego_video.avi', message, start_frame, report_path=report_path)
+    if report is not None:
+        print(f"PSNR trung bình (nhúng): {report['psnr_stego_avg']:.2f} dB")
+        print(f"PSNR trung bình (chuẩn hóa): {report['psnr_normalized_avg']:.2f} dB")
+        print(f"tach tin: {report['recovered_message']} ({'dung' if report['verified'] else 'sai'})")
+        print(f"da tao video: {report['output_video']}, bao cao: {report_path}")
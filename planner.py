@@ -0,0 +1,174 @@
+import json
+import logging
+import numpy as np
+from capacity import (CAN_EMBED_0, CAN_EMBED_1, frame_capacity, load_capacity_index,
+                      open_matching_capacity_index, plan_frames, plan_groups)
+from sceneindex import build_scene_index, load_scene_index, open_matching_scene_index, scene_cuts
+
+logger = logging.getLogger(__name__)
+
+# Ngưỡng chuyển cảnh mặc định theo trung bình bình phương độ lệch mức xám mỗi điểm ảnh
+CUT_THRESHOLD_PER_PIXEL = 100
+
+# embed_8bits_with_redundancy: 8 bit x 5 khối, chỉ duyệt 100 khối đầu tiên
+GROUP_BLOCKS = 40
+MAX_SCAN_BLOCKS = 100
+
+def scan_video(video_path, Q=120, mode='exact', scene_path=None, capacity_path=None, checkpoint_every=500):
+    """
+    Chỉ mục chuyển cảnh và chỉ mục khả năng nhúng của video trong một lần giải mã: chỉ mục đã có
+    và khớp video được dùng lại, thiếu cả hai thì quét chung một lượt (có checkpoint, tiếp tục được).
+    Args:
+        video_path: Đường dẫn video.
+        Q: Ngưỡng quantization.
+        mode: Cách tính độ lệch chuyển cảnh (xem sceneindex).
+        scene_path: Chỉ mục chuyển cảnh (mặc định video_path + '.scn').
+        capacity_path: Chỉ mục khả năng nhúng (mặc định video_path + '.cap').
+        checkpoint_every: Số khung giữa hai checkpoint.
+    Returns:
+        scene_header, records: Như sceneindex.open_scene_index.
+        capacity_header, codes: Như capacity.open_capacity_index.
+        Cả bốn là None nếu không mở được video.
+    """
+    scene_path = scene_path or video_path + '.scn'
+    capacity_path = capacity_path or video_path + '.cap'
+    scene_header, records = open_matching_scene_index(video_path, scene_path, mode)
+    capacity_header, codes = open_matching_capacity_index(video_path, capacity_path, Q)
+    if scene_header is None and capacity_header is None:
+        if build_scene_index(video_path, scene_path, mode, checkpoint_every=checkpoint_every,
+                             capacity_path=capacity_path, Q=Q) is None:
+            return None, None, None, None
+
+    # Thiếu một trong hai chỉ mục: chỉ quét phần còn thiếu
+    if scene_header is None:
+        scene_header, records = load_scene_index(video_path, scene_path, mode, checkpoint_every=checkpoint_every)
+    if capacity_header is None:
+        capacity_header, codes = load_capacity_index(video_path, capacity_path, Q)
+    if scene_header is None or capacity_header is None:
+        return None, None, None, None
+    return scene_header, records, capacity_header, codes
+
+def first_try_frames(codes, group_blocks=GROUP_BLOCKS, max_blocks=MAX_SCAN_BLOCKS):
+    """
+    Khung nhúng được 8 bit bất kỳ ngay lần đầu: trong max_blocks khối đầu có ít nhất group_blocks
+    khối nhúng được cả bit 0 lẫn bit 1, nên cách chọn khối tuần tự luôn đủ khối dù bit là gì.
+    Args:
+        codes: Mã khối (số khung, H/8, W/8).
+    Returns:
+        safe: Mảng bool (số khung,).
+    """
+    flat = np.asarray(codes).reshape(len(codes), -1)[:, :max_blocks]
+    both = CAN_EMBED_0 | CAN_EMBED_1
+    return np.count_nonzero((flat & both) == both, axis=1) >= group_blocks
+
+def cut_distance(n_frames, cuts):
+    """
+    Khoảng cách (số khung) từ mỗi khung đến chuyển cảnh gần nhất; khung chuyển cảnh là khung đầu
+    của cảnh mới nên khung ngay trước nó cách 1. Không có chuyển cảnh thì bằng n_frames.
+    """
+    frames = np.arange(n_frames)
+    if len(cuts) == 0:
+        return np.full(n_frames, n_frames)
+    cuts = np.asarray(cuts)
+    pos = np.searchsorted(cuts, frames, side='right')
+    # Chuyển cảnh gần nhất ở phía trước (<= khung) và phía sau (> khung)
+    before = np.where(pos > 0, frames - cuts[np.maximum(pos - 1, 0)], n_frames)
+    after = np.where(pos < len(cuts), cuts[np.minimum(pos, len(cuts) - 1)] - frames, n_frames)
+    return np.minimum(before, after)
+
+def plan_embed_frames(codes, records, bit_groups, threshold, start_frame=2, cut_margin=3):
+    """
+    Chọn khung nhúng theo nội dung: khung nhúng được ngay lần đầu (first_try_frames), ưu tiên
+    khung cách chuyển cảnh ít nhất cut_margin khung, trong đó ưu tiên khung nhiều khối ổn định
+    (nhiều vân, nhúng được cả hai bit). Khung được chọn xếp tăng dần, nhóm bit theo thứ tự ký tự.
+    Không đủ khung như vậy thì dùng cách chọn tuần tự của capacity.plan_frames.
+    Args:
+        codes: Mã khối (số khung, H/8, W/8) từ chỉ mục khả năng nhúng.
+        records: Bản ghi chỉ mục chuyển cảnh.
+        bit_groups: Danh sách nhóm 8 bit.
+        threshold: Ngưỡng độ lệch chuyển cảnh.
+        start_frame: Khung sớm nhất được chọn.
+        cut_margin: Khoảng cách tới chuyển cảnh được coi là đủ xa.
+    Returns:
+        plan: Dict {frame_idx: block_indices dự kiến} theo thứ tự khung, hoặc None nếu không đủ.
+        report: Dict {'cuts', 'candidates', 'first_try', 'fallback', 'frames': [{'frame', 'texture',
+                'cut_distance'}, ...]}.
+    """
+    n_frames = min(len(codes), len(records))
+    cuts, _ = scene_cuts(records[:n_frames], threshold)
+    distance = cut_distance(n_frames, cuts)
+    _, _, texture = frame_capacity(codes[:n_frames])
+    safe = first_try_frames(codes[:n_frames])
+    candidates = np.flatnonzero(safe[start_frame:]) + start_frame
+    report = {'cuts': len(cuts), 'candidates': n_frames - start_frame, 'first_try': len(candidates),
+              'fallback': False}
+
+    if len(candidates) < len(bit_groups):
+        # Không đủ khung chắc chắn nhúng được: chọn tuần tự theo đúng các bit cần nhúng
+        logger.warning("Chỉ có %d khung chắc chắn nhúng được, chọn khung tuần tự từ khung %d",
+                       len(candidates), start_frame)
+        plan, _ = plan_frames(codes, bit_groups, start_frame)
+        report['fallback'] = True
+    else:
+        # Khóa sắp xếp: xa chuyển cảnh (tối đa cut_margin), nhiều vân, khung sớm
+        order = np.lexsort((candidates, -texture[candidates], -np.minimum(distance[candidates], cut_margin)))
+        chosen = np.sort(candidates[order[:len(bit_groups)]])
+        plan = {}
+        for frame_idx, bits in zip(chosen.tolist(), bit_groups):
+            plan[frame_idx] = plan_groups(codes[frame_idx], bits)
+    if plan is None:
+        return None, report
+    report['frames'] = [{'frame': f, 'texture': int(texture[f]), 'cut_distance': int(distance[f])} for f in plan]
+    return plan, report
+
+def plan_video(video_path, bit_groups, Q=120, start_frame=2, threshold=None, cut_margin=3, mode='exact',
+               plan_path=None):
+    """
+    Quét video một lần (chuyển cảnh + khả năng nhúng) rồi chọn khung nhúng cho các nhóm bit.
+    Args:
+        video_path: Đường dẫn video.
+        bit_groups: Danh sách nhóm 8 bit.
+        Q: Ngưỡng quantization.
+        start_frame: Khung sớm nhất được chọn.
+        threshold: Ngưỡng chuyển cảnh (mặc định CUT_THRESHOLD_PER_PIXEL x số điểm ảnh).
+        cut_margin: Như plan_embed_frames.
+        mode: Cách tính độ lệch chuyển cảnh.
+        plan_path: Ghi kế hoạch ra file JSON (xem write_frame_plan), None = không ghi.
+    Returns:
+        plan, report: Như plan_embed_frames, hoặc (None, {}) nếu lỗi.
+    """
+    scene_header, records, _, codes = scan_video(video_path, Q, mode)
+    if scene_header is None:
+        return None, {}
+    if threshold is None:
+        threshold = CUT_THRESHOLD_PER_PIXEL * scene_header['height'] * scene_header['width']
+    plan, report = plan_embed_frames(codes, records, bit_groups, threshold, start_frame, cut_margin)
+    report.update(threshold=threshold, cut_margin=cut_margin)
+    if plan is not None and plan_path is not None:
+        write_frame_plan(plan_path, plan, video_path, Q, report)
+    return plan, report
+
+def write_frame_plan(path, plan, video_path, Q, report=None):
+    """
+    Ghi kế hoạch nhúng ra JSON: video, Q, danh sách khung theo thứ tự nhóm bit và khối dự kiến.
+    """
+    data = {
+        'video': video_path,
+        'Q': Q,
+        'frames': list(plan),
+        'block_indices': {str(f): block_indices for f, block_indices in plan.items()},
+        'report': report or {},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+def load_frame_plan(path):
+    """
+    Đọc kế hoạch nhúng từ write_frame_plan.
+    Returns:
+        frames: Danh sách khung theo thứ tự nhóm bit (dùng cho tham số frames của giaumasv).
+        data: Toàn bộ nội dung file.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return [int(f) for f in data['frames']], data
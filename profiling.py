@@ -0,0 +1,285 @@
+import csv
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Các giai đoạn được đo trong đường xử lý chính (tên khác vẫn ghi được, thêm vào cuối báo cáo)
+STAGES = ('decode', 'color_split', 'dct', 'quantize', 'idct', 'dwt', 'blend', 'clip_cast', 'encode', 'write')
+
+# Số lần đo gần nhất giữ lại cho mỗi giai đoạn để tính p50/p99 (bộ đệm vòng, bộ nhớ cố định)
+WINDOW_SIZE = 4096
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+class StageStats:
+    """
+    Thống kê một giai đoạn: số lần, tổng/lớn nhất thời gian, p50/p99 trên WINDOW_SIZE lần đo gần nhất.
+    """
+    __slots__ = ('count', 'total', 'max', '_window')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._window = np.empty(WINDOW_SIZE)
+
+    def add(self, seconds):
+        self._window[self.count % WINDOW_SIZE] = seconds
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        window = self._window[:min(self.count, WINDOW_SIZE)]
+        p50, p99 = np.percentile(window, [50, 99]) if len(window) else (0.0, 0.0)
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'p50': float(p50), 'p99': float(p99), 'max': self.max}
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _StageTimer:
+    __slots__ = ('_profiler', '_name', '_t0')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._profiler.record(self._name, time.perf_counter() - self._t0)
+        return False
+
+class Profiler:
+    """
+    Bộ đo thời gian theo giai đoạn, bộ đếm và sự kiện từng khung (lấy mẫu).
+    Khi tắt (mặc định), stage() trả về một context rỗng dùng chung và record()/count() thoát ngay,
+    nên các điểm đo trong vòng lặp khung gần như không tốn gì.
+    An toàn đa luồng (luồng giải mã của FrameSource, luồng ghi của AsyncVideoWriter).
+    Mỗi process có bộ đo riêng: process con (tách song song, chạy lô) không cộng vào process cha.
+
+    Dùng:
+        from profiling import PROFILER
+        with PROFILER.stage('dct'):
+            coeffs = dct_blocks(blocks)
+    """
+
+    def __init__(self, enabled=False, sample_rate=0.0, max_events=100000):
+        """
+        Args:
+            enabled: Bật đo.
+            sample_rate: Tỉ lệ khung ghi sự kiện (0 = không ghi, 1 = mọi khung, 0.01 = mỗi 100 khung).
+            max_events: Số sự kiện tối đa giữ trong bộ nhớ (bỏ các sự kiện sau).
+        """
+        self.enabled = enabled
+        self.max_events = max_events
+        self.set_sample_rate(sample_rate)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def set_sample_rate(self, sample_rate):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate phải trong [0, 1]: {sample_rate}")
+        self.sample_rate = sample_rate
+        # Lấy mẫu theo chỉ số khung (khung chia hết cho _every) để các lần chạy so sánh được
+        self._every = max(1, int(round(1 / sample_rate))) if sample_rate else 0
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.events = []
+            self.dropped_events = 0
+            self.started = time.time()
+
+    def stage(self, name):
+        """
+        Context manager đo thời gian một giai đoạn.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name)
+
+    def record(self, name, seconds):
+        """
+        Cộng một lần đo (giây) vào giai đoạn name.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(seconds)
+
+    def count(self, name, n=1):
+        """
+        Tăng bộ đếm name (số khung, số khối nhúng, ...).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def sampled(self, frame_idx):
+        return self.enabled and self._every > 0 and frame_idx % self._every == 0
+
+    def frame_event(self, name, frame_idx, **fields):
+        """
+        Ghi sự kiện của một khung nếu khung được lấy mẫu (xem sample_rate).
+        Args:
+            name: Tên sự kiện ('normalize', 'psnr', 'embed', ...).
+            frame_idx: Chỉ số khung.
+            fields: Giá trị đi kèm (số, chuỗi).
+        """
+        if not self.sampled(frame_idx):
+            return
+        with self._lock:
+            if len(self.events) >= self.max_events:
+                self.dropped_events += 1
+                return
+            self.events.append(dict(fields, event=name, frame=frame_idx, time=time.time()))
+
+    def summary(self):
+        """
+        Returns:
+            summary: Dict {'stages': {tên: {'count', 'total', 'mean', 'p50', 'p99', 'max'}},
+                     'counters', 'events', 'dropped_events', 'wall_seconds'}. Giai đoạn theo thứ tự STAGES.
+        """
+        with self._lock:
+            names = [s for s in STAGES if s in self.stages] + sorted(set(self.stages) - set(STAGES))
+            return {
+                'stages': {name: self.stages[name].summary() for name in names},
+                'counters': dict(self.counters),
+                'events': len(self.events),
+                'dropped_events': self.dropped_events,
+                'wall_seconds': time.time() - self.started,
+            }
+
+    def write_json(self, path):
+        """
+        Ghi tóm tắt và các sự kiện đã lấy mẫu ra file JSON.
+        """
+        report = self.summary()
+        with self._lock:
+            report['events'] = list(self.events)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    def write_csv(self, path, events_path=None):
+        """
+        Ghi thống kê giai đoạn ra CSV (mỗi dòng một giai đoạn), và sự kiện ra events_path nếu có.
+        """
+        stages = self.summary()['stages']
+        columns = ('count', 'total', 'mean', 'p50', 'p99', 'max')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('stage',) + columns)
+            for name, stats in stages.items():
+                writer.writerow([name] + [stats[c] for c in columns])
+        if events_path is None:
+            return
+        with self._lock:
+            events = list(self.events)
+        fields = ['event', 'frame', 'time']
+        for event in events:
+            fields.extend(key for key in event if key not in fields)
+        with open(events_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(events)
+
+    def write(self, path):
+        """
+        Ghi theo đuôi file: .csv (thống kê giai đoạn, sự kiện ở <tên>.events.csv) hoặc JSON.
+        """
+        if path.endswith('.csv'):
+            self.write_csv(path, path[:-4] + '.events.csv')
+        else:
+            self.write_json(path)
+
+    def prometheus_text(self, prefix='stego'):
+        """
+        Thống kê dạng text exposition của Prometheus (summary cho giai đoạn, counter cho bộ đếm).
+        """
+        summary = self.summary()
+        lines = [f"# HELP {prefix}_stage_seconds Thời gian mỗi lần chạy giai đoạn",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        for name, stats in summary['stages'].items():
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="0.5"}} {stats["p50"]:.9f}')
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="0.99"}} {stats["p99"]:.9f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stats["total"]:.9f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in summary['counters'].items():
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """
+        Mở endpoint HTTP cục bộ /metrics (text Prometheus) trên luồng nền.
+        Returns:
+            server: ThreadingHTTPServer, gọi server.shutdown() để dừng.
+        """
+        profiler = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = profiler.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.getLogger(__name__).debug(format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# Bộ đo dùng chung của process
+PROFILER = Profiler()
+
+def enable_profiling(sample_rate=0.0, reset=True):
+    """
+    Bật bộ đo dùng chung.
+    Args:
+        sample_rate: Tỉ lệ khung ghi sự kiện (xem Profiler).
+        reset: Xóa số liệu cũ.
+    Returns:
+        PROFILER.
+    """
+    if reset:
+        PROFILER.reset()
+    PROFILER.set_sample_rate(sample_rate)
+    PROFILER.enabled = True
+    return PROFILER
+
+def configure_logging(level='INFO'):
+    """
+    Cấu hình logging cho các lệnh chạy trực tiếp. Tiến độ từng khung ở mức DEBUG,
+    thông báo thường ở INFO, chẩn đoán tách tin ở WARNING.
+    """
+    if isinstance(level, str):
+        level = getattr(logging, level.upper())
+    logging.basicConfig(level=level, format=LOG_FORMAT)
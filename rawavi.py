@@ -0,0 +1,404 @@
+import mmap
+import os
+import shutil
+import struct
+from fractions import Fraction
+import cv2
+import numpy as np
+from profiling import PROFILER
+
+# Cờ trong header AVI
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+BI_RGB = 0
+# ioctl FICLONE của Linux (reflink trên btrfs/xfs)
+FICLONE = 0x40049409
+# FourCC của định dạng YUV phẳng 4:2:0 (OpenCV ghi I420 khi fourcc = 0)
+PLANAR_YUV = {b'I420': cv2.COLOR_YUV2BGR_I420, b'IYUV': cv2.COLOR_YUV2BGR_I420,
+              b'YV12': cv2.COLOR_YUV2BGR_YV12}
+
+class RawAVIReader:
+    """
+    Đọc AVI không nén trực tiếp từ file qua mmap: mỗi khung là một view numpy, không giải mã.
+    Truy cập ngẫu nhiên O(1) theo chỉ số khung nhờ bảng offset dựng từ idx1
+    (hoặc quét LIST movi nếu không có idx1 / file OpenDML nhiều RIFF).
+
+    Hỗ trợ:
+        'bgr24': DIB 24 bit (BI_RGB), khung BGR giống hệt khi đọc bằng OpenCV.
+        'i420', 'yv12': YUV 4:2:0 phẳng; read() chuyển sang BGR bằng cv2.cvtColor,
+                        có thể lệch vài mức so với bộ chuyển đổi của FFmpeg.
+    """
+
+    def __init__(self, path, mode='r'):
+        """
+        Args:
+            path: Đường dẫn file AVI.
+            mode: 'r' (chỉ đọc) hoặc 'r+' (ghi đè được dữ liệu khung tại chỗ).
+        """
+        self.path = path
+        self.mode = mode
+        self._file = open(path, 'r+b' if mode == 'r+' else 'rb')
+        try:
+            access = mmap.ACCESS_WRITE if mode == 'r+' else mmap.ACCESS_READ
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=access)
+            self._data = np.frombuffer(self._mmap, dtype=np.uint8)
+            self._parse()
+        except Exception:
+            self._data = None
+            self._file.close()
+            raise
+
+    # ==== Phân tích RIFF ====
+
+    def _chunks(self, start, end):
+        """Duyệt các chunk (id, offset dữ liệu, kích thước) trong đoạn [start, end)."""
+        mm = self._mmap
+        pos = start
+        while pos + 8 <= end:
+            ckid = mm[pos:pos + 4]
+            size = struct.unpack_from('<I', mm, pos + 4)[0]
+            yield ckid, pos + 8, size
+            pos += 8 + size + (size & 1)
+
+    def _parse(self):
+        mm = self._mmap
+        if len(mm) < 12 or mm[0:4] != b'RIFF' or mm[8:12] != b'AVI ':
+            raise ValueError(f"Không phải file AVI: {self.path}")
+
+        self.stream_index = None
+        self.fps = 0.0
+        self.frame_count = 0
+        movi_lists = []
+        idx1 = None
+        riff_count = 0
+        self._stream_count = 0
+
+        for ckid, data, size in self._chunks(0, len(mm)):
+            if ckid != b'RIFF':
+                continue
+            riff_count += 1
+            riff_end = min(data + size, len(mm))
+            for sub_id, sub_data, sub_size in self._chunks(data + 4, riff_end):
+                if sub_id == b'LIST' and mm[sub_data:sub_data + 4] == b'hdrl':
+                    self._parse_hdrl(sub_data + 4, sub_data + sub_size)
+                elif sub_id == b'LIST' and mm[sub_data:sub_data + 4] == b'movi':
+                    movi_lists.append((sub_data, min(sub_data + sub_size, riff_end)))
+                elif sub_id == b'idx1' and riff_count == 1:
+                    idx1 = (sub_data, sub_size)
+
+        if self.stream_index is None:
+            raise ValueError(f"Không tìm thấy luồng video: {self.path}")
+        if not movi_lists:
+            raise ValueError(f"Không tìm thấy LIST movi: {self.path}")
+
+        prefix = b'%02d' % self.stream_index
+        self._chunk_ids = (prefix + b'db', prefix + b'dc')
+        index = None
+        if idx1 is not None and riff_count == 1:
+            index = self._offsets_from_idx1(idx1, movi_lists[0][0])
+        offsets, sizes = index if index is not None else self._offsets_from_movi(movi_lists)
+
+        # Chunk rỗng (khung bị bỏ) lặp lại khung trước đó
+        for k in range(1, len(sizes)):
+            if sizes[k] == 0:
+                offsets[k], sizes[k] = offsets[k - 1], sizes[k - 1]
+        self.frame_offsets = offsets
+        self.frame_sizes = sizes
+        self.frame_count = len(offsets)
+
+    def _parse_hdrl(self, start, end):
+        mm = self._mmap
+        for ckid, data, size in self._chunks(start, end):
+            if ckid == b'avih':
+                us_per_frame = struct.unpack_from('<I', mm, data)[0]
+                if us_per_frame:
+                    self.fps = 1e6 / us_per_frame
+            elif ckid == b'LIST' and mm[data:data + 4] == b'strl':
+                stream = self._stream_count
+                self._stream_count += 1
+                strh = strf = None
+                for sub_id, sub_data, sub_size in self._chunks(data + 4, data + size):
+                    if sub_id == b'strh':
+                        strh = sub_data
+                    elif sub_id == b'strf':
+                        strf = sub_data
+                if strh is None or strf is None or mm[strh:strh + 4] != b'vids':
+                    continue
+                if self.stream_index is not None:
+                    continue
+                self.stream_index = stream
+                scale, rate = struct.unpack_from('<II', mm, strh + 20)
+                if scale and rate:
+                    self.fps = rate / scale
+                (_, width, height, _, bit_count, compression,
+                 _) = struct.unpack_from('<IiiHHII', mm, strf)
+                self._setup_format(width, height, bit_count, compression)
+
+    def _setup_format(self, width, height, bit_count, compression):
+        fourcc = struct.pack('<I', compression)
+        self.width = width
+        self.height = abs(height)
+        self.bottom_up = height > 0
+        if compression == BI_RGB and bit_count == 24:
+            self.pixel_format = 'bgr24'
+            self.row_stride = (width * 3 + 3) & ~3  # Mỗi hàng DIB căn theo 4 byte
+            self.frame_size = self.row_stride * self.height
+        elif fourcc in PLANAR_YUV:
+            self.pixel_format = fourcc.decode('ascii').lower()
+            self._yuv_code = PLANAR_YUV[fourcc]
+            self.bottom_up = False  # YUV luôn lưu từ trên xuống
+            self.frame_size = width * self.height * 3 // 2
+        else:
+            raise ValueError(f"Định dạng chưa hỗ trợ: compression={fourcc!r}, bit={bit_count}")
+
+    def _offsets_from_idx1(self, idx1, movi_data):
+        data, size = idx1
+        n = size // 16
+        entries = np.frombuffer(self._mmap, dtype=np.dtype([('id', 'S4'), ('flags', '<u4'),
+                                                            ('offset', '<u4'), ('size', '<u4')]),
+                                count=n, offset=data)
+        video = np.isin(entries['id'], self._chunk_ids)
+        if not video.any():
+            return None
+        offsets = entries['offset'][video].astype(np.int64)
+        sizes = entries['size'][video].astype(np.int64)
+        # Offset trong idx1 có thể tính từ 'movi' hoặc từ đầu file
+        if offsets[0] < movi_data:
+            offsets += movi_data
+        offsets += 8  # Bỏ qua header chunk
+        return offsets, sizes
+
+    def _offsets_from_movi(self, movi_lists):
+        mm = self._mmap
+        offsets, sizes = [], []
+
+        def scan(start, end):
+            for ckid, data, size in self._chunks(start, end):
+                if ckid == b'LIST' and mm[data:data + 4] == b'rec ':
+                    scan(data + 4, data + size)
+                elif ckid in self._chunk_ids:
+                    offsets.append(data)
+                    sizes.append(size)
+
+        for data, end in movi_lists:
+            scan(data + 4, end)
+        return np.array(offsets, dtype=np.int64), np.array(sizes, dtype=np.int64)
+
+    # ==== Truy cập khung ====
+
+    def raw(self, frame_idx):
+        """Byte dữ liệu của khung (view uint8 một chiều)."""
+        offset = int(self.frame_offsets[frame_idx])
+        return self._data[offset:offset + self.frame_size]
+
+    def frame_view(self, frame_idx):
+        """
+        View không sao chép của khung.
+        Returns:
+            'bgr24': mảng (H, W, 3) BGR, hàng từ trên xuống (stride âm nếu DIB bottom-up).
+            YUV phẳng: mảng (H * 3 / 2, W) như đầu vào của cv2.cvtColor.
+        """
+        raw = self.raw(frame_idx)
+        if self.pixel_format != 'bgr24':
+            return raw.reshape(self.height * 3 // 2, self.width)
+        view = np.ndarray((self.height, self.width, 3), dtype=np.uint8, buffer=raw,
+                          strides=(self.row_stride, 3, 1))
+        return view[::-1] if self.bottom_up else view
+
+    def read(self, frame_idx):
+        """
+        Khung BGR (H, W, 3). Với 'bgr24' là view không sao chép, với YUV là mảng mới.
+        """
+        view = self.frame_view(frame_idx)
+        if self.pixel_format == 'bgr24':
+            return view
+        return cv2.cvtColor(view, self._yuv_code)
+
+    def write(self, frame_idx, frame):
+        """
+        Ghi đè khung BGR tại chỗ (chỉ với mode='r+' và định dạng 'bgr24').
+        """
+        if self.mode != 'r+':
+            raise ValueError("File được mở chỉ đọc")
+        if self.pixel_format != 'bgr24':
+            raise ValueError(f"Chỉ ghi đè được khung bgr24, file là {self.pixel_format}")
+        with PROFILER.stage('write'):
+            self.frame_view(frame_idx)[...] = frame
+
+    def flush(self):
+        self._mmap.flush()
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, frame_idx):
+        return self.read(frame_idx)
+
+    def __iter__(self):
+        for frame_idx in range(self.frame_count):
+            yield self.read(frame_idx)
+
+    def close(self):
+        self._data = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Còn view đang được dùng: mmap sẽ được đóng khi các view được giải phóng
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def open_raw_avi(path, mode='r', exact=True):
+    """
+    Mở file bằng RawAVIReader nếu được hỗ trợ.
+    Args:
+        path: Đường dẫn video.
+        mode: 'r' hoặc 'r+'.
+        exact: True thì chỉ nhận định dạng cho khung giống hệt OpenCV ('bgr24').
+    Returns:
+        reader hoặc None nếu file không phải AVI không nén được hỗ trợ.
+    """
+    try:
+        reader = RawAVIReader(path, mode)
+    except (OSError, ValueError, struct.error):
+        return None
+    if exact and reader.pixel_format != 'bgr24':
+        reader.close()
+        return None
+    return reader
+
+class RawAVIWriter:
+    """
+    Ghi AVI không nén BGR24 (DIB top-down, biHeight âm) kèm idx1, cùng giao diện với cv2.VideoWriter.
+    Khác với fourcc = 0 của OpenCV (ghi I420, mất màu do lấy mẫu 4:2:0), khung được lưu
+    nguyên từng byte và đọc lại được bằng RawAVIReader hoặc OpenCV.
+    Dùng DIB top-down vì OpenCV (FFmpeg) đọc DIB bottom-up qua linesize âm, một số bản bị lỗi;
+    hàng được ghi thẳng theo thứ tự của mảng, không cần lật. File AVI 1.0: tối đa 4 GB.
+    """
+
+    def __init__(self, path, fps, frame_size):
+        """
+        Args:
+            path: Đường dẫn file ra.
+            fps: Số khung/giây.
+            frame_size: (width, height) như cv2.VideoWriter.
+        """
+        self.path = path
+        self.width, self.height = frame_size
+        self.row_stride = (self.width * 3 + 3) & ~3
+        self.frame_bytes = self.row_stride * self.height
+        rate = Fraction(fps).limit_denominator(1001) if fps else Fraction(30)
+        self.rate, self.scale = rate.numerator, rate.denominator
+        self.frame_count = 0
+        self._sizes_ok = True
+        self._file = open(path, 'wb')
+        self._row_buffer = None
+        if self.row_stride != self.width * 3:
+            self._row_buffer = np.zeros((self.height, self.row_stride), dtype=np.uint8)
+        self._write_headers()
+
+    def _write_headers(self):
+        f = self._file
+        us_per_frame = int(round(1e6 * self.scale / self.rate))
+        max_bytes = min(self.frame_bytes * self.rate // self.scale, 0xFFFFFFFF)
+        avih = struct.pack('<10I16x', us_per_frame, max_bytes, 0,
+                           AVIF_HASINDEX, 0, 0, 1, self.frame_bytes, self.width, self.height)
+        strh = struct.pack('<4s4sIHHIIIIIIII4h', b'vids', b'\0\0\0\0', 0, 0, 0, 0,
+                           self.scale, self.rate, 0, 0, self.frame_bytes, 0xFFFFFFFF, 0,
+                           0, 0, self.width, self.height)
+        strf = struct.pack('<IiiHHIIiiII', 40, self.width, -self.height, 1, 24, BI_RGB,
+                           self.frame_bytes, 0, 0, 0, 0)
+        strl = b'strl' + _chunk(b'strh', strh) + _chunk(b'strf', strf)
+        hdrl = b'hdrl' + _chunk(b'avih', avih) + _chunk(b'LIST', strl)
+
+        f.write(b'RIFF\0\0\0\0AVI ')
+        f.write(_chunk(b'LIST', hdrl))
+        # Vị trí các trường cần cập nhật khi đóng file
+        self._avih_frames_pos = 12 + 8 + 4 + 8 + 16
+        self._strh_length_pos = 12 + 8 + 4 + 8 + len(avih) + 8 + 4 + 8 + 32
+        self._movi_pos = f.tell()
+        f.write(b'LIST\0\0\0\0movi')
+
+    def isOpened(self):
+        return self._file is not None and not self._file.closed
+
+    def write(self, frame):
+        """
+        Ghi một khung BGR (H, W, 3, uint8).
+        """
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f"Khung {frame.shape} không khớp kích thước {(self.height, self.width, 3)}")
+        self._file.write(struct.pack('<4sI', b'00db', self.frame_bytes))
+        if self.row_stride == self.width * 3:
+            self._file.write(np.ascontiguousarray(frame, dtype=np.uint8))
+        else:
+            # Mỗi hàng DIB căn theo 4 byte
+            rows = self._row_buffer
+            rows[:, :self.width * 3] = frame.reshape(self.height, self.width * 3)
+            self._file.write(rows)
+        self.frame_count += 1
+
+    def release(self):
+        if not self.isOpened():
+            return
+        f = self._file
+        movi_end = f.tell()
+        # idx1: offset tính từ fourcc 'movi'
+        entries = np.empty(self.frame_count, dtype=np.dtype([('id', 'S4'), ('flags', '<u4'),
+                                                              ('offset', '<u4'), ('size', '<u4')]))
+        entries['id'] = b'00db'
+        entries['flags'] = AVIIF_KEYFRAME
+        entries['offset'] = 4 + np.arange(self.frame_count, dtype=np.int64) * (8 + self.frame_bytes)
+        entries['size'] = self.frame_bytes
+        f.write(struct.pack('<4sI', b'idx1', entries.nbytes))
+        f.write(entries.tobytes())
+        file_end = f.tell()
+        if file_end > 0xFFFFFFFF:
+            f.close()
+            raise ValueError("File AVI 1.0 vượt quá 4 GB")
+
+        f.seek(4)
+        f.write(struct.pack('<I', file_end - 8))
+        f.seek(self._movi_pos + 4)
+        f.write(struct.pack('<I', movi_end - self._movi_pos - 8))
+        f.seek(self._avih_frames_pos)
+        f.write(struct.pack('<I', self.frame_count))
+        f.seek(self._strh_length_pos)
+        f.write(struct.pack('<I', self.frame_count))
+        f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+def copy_file_fast(src, dst):
+    """
+    Chép nguyên file từng byte: thử reflink (chia sẻ block, gần như tức thời), nếu không
+    được thì shutil.copyfile (dùng sendfile trong kernel trên Linux).
+    Returns:
+        method: 'reflink' hoặc 'copy'.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise ValueError("File nguồn và đích trùng nhau")
+    try:
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+def _chunk(ckid, payload):
+    """Đóng gói chunk RIFF (có byte đệm nếu kích thước lẻ)."""
+    pad = b'\0' if len(payload) & 1 else b''
+    return struct.pack('<4sI', ckid, len(payload)) + payload + pad
@@ -0,0 +1,293 @@
+import logging
+import os
+import struct
+import cv2
+import numpy as np
+from capacity import BLOCK_SIZE, pack_header, scan_frame
+from capacity import HEADER_SIZE as CAPACITY_HEADER_SIZE
+from deltaDCT import compute_signature, frame_feature, frame_metric
+from framesource import FrameSource
+from profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+# Header cố định 48 byte: magic, version, chế độ, có chữ ký, đã quét xong, thông số chữ ký,
+# số khung đã ghi (đến checkpoint gần nhất), kích thước khung, kích thước và mtime video,
+# Q của chỉ mục khả năng nhúng quét cùng lượt (0 = không quét cùng)
+HEADER_FORMAT = '<4sHB??xHHIHHQqd2x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b'SCNX'
+VERSION = 1
+
+MODES = ('exact', 'signature', 'dct')
+
+def record_dtype(signatures=False, K=16):
+    """
+    Bản ghi mỗi khung: độ lệch so với khung trước (NaN ở khung đầu), kèm chữ ký K x K nếu có.
+    Độ lệch lưu float64: chế độ 'exact' là số nguyên < 2^53 nên so ngưỡng giống hệt khi quét.
+    """
+    fields = [('metric', '<f8')]
+    if signatures:
+        fields.append(('signature', '<f4', (K, K)))
+    return np.dtype(fields)
+
+def _video_stamp(video_path):
+    stat = os.stat(video_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def _read_header(f):
+    raw = f.read(HEADER_SIZE)
+    if len(raw) != HEADER_SIZE:
+        return None
+    magic, version, mode, signatures, complete, signature_size, K, n_frames, height, width, \
+        video_size, video_mtime_ns, Q = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC or version != VERSION or mode >= len(MODES):
+        return None
+    return {'mode': MODES[mode], 'signatures': signatures, 'complete': complete,
+            'signature_size': signature_size, 'K': K, 'n_frames': n_frames, 'height': height,
+            'width': width, 'video_size': video_size, 'video_mtime_ns': video_mtime_ns, 'Q': Q}
+
+def _write_header(f, header):
+    f.seek(0)
+    f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, MODES.index(header['mode']), header['signatures'],
+                        header['complete'], header['signature_size'], header['K'], header['n_frames'],
+                        header['height'], header['width'], header['video_size'], header['video_mtime_ns'],
+                        header['Q']))
+
+def _matches(header, video_path, mode, signatures, signature_size, K):
+    """
+    Chỉ mục dùng được cho video (cùng kích thước, mtime) và cùng cách tính độ lệch.
+    """
+    if header is None or (header['video_size'], header['video_mtime_ns']) != _video_stamp(video_path):
+        return False
+    if header['mode'] != mode or (signatures and not header['signatures']):
+        return False
+    if (mode == 'signature' or header['signatures']) and (header['signature_size'], header['K']) != (signature_size, K):
+        return False
+    return True
+
+def build_scene_index(video_path, index_path=None, mode='exact', signatures=False, signature_size=64, K=16,
+                      checkpoint_every=500, capacity_path=None, Q=120):
+    """
+    Quét video một lần, ghi độ lệch từng khung (và chữ ký nếu cần) ra chỉ mục trên đĩa.
+    Cứ checkpoint_every khung lại ghi bản ghi rồi cập nhật header (số khung đã ghi), nên lần chạy
+    bị ngắt được tiếp tục từ checkpoint gần nhất thay vì từ khung 0: gọi lại với cùng tham số.
+    Args:
+        video_path: Đường dẫn video.
+        index_path: File chỉ mục (mặc định video_path + '.scn').
+        mode: Cách tính độ lệch ('exact', 'signature', 'dct'), xem deltaDCT.frame_metric.
+        signatures: Lưu chữ ký K x K hệ số DCT tần số thấp của từng khung.
+        signature_size, K: Thông số chữ ký.
+        checkpoint_every: Số khung giữa hai checkpoint.
+        capacity_path: Ghi luôn chỉ mục khả năng nhúng (định dạng capacity.py) trong cùng lượt giải mã,
+                       cùng checkpoint; None = không ghi.
+        Q: Ngưỡng quantization của chỉ mục khả năng nhúng.
+    Returns:
+        header: Dict {'mode', 'signatures', 'complete', 'signature_size', 'K', 'n_frames', 'height',
+                'width', 'video_size', 'video_mtime_ns', 'Q'}, hoặc None nếu không mở được video.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Chế độ không hợp lệ: {mode}")
+    index_path = index_path or video_path + '.scn'
+
+    # Tiếp tục chỉ mục dở dang nếu cùng video và cùng tham số
+    header = None
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            header = _read_header(f)
+        if not _matches(header, video_path, mode, signatures, signature_size, K):
+            header = None
+    if header is not None and header['complete']:
+        return header
+    if header is not None and capacity_path is not None:
+        # Chỉ tiếp tục khi phần chỉ mục khả năng nhúng đã ghi cùng lượt trước còn đủ và cùng Q
+        frame_bytes = (header['height'] // BLOCK_SIZE) * (header['width'] // BLOCK_SIZE)
+        needed = CAPACITY_HEADER_SIZE + header['n_frames'] * frame_bytes
+        if header['Q'] != Q or not os.path.exists(capacity_path) or os.path.getsize(capacity_path) < needed:
+            header = None
+    if header is not None:
+        # Chỉ mục dở dang đã có chữ ký: tiếp tục cùng định dạng bản ghi
+        signatures = header['signatures']
+        header['Q'] = float(Q) if capacity_path is not None else 0.0
+    resume_from = header['n_frames'] if header is not None else 0
+
+    try:
+        # Đọc lại khung liền trước checkpoint để tính độ lệch của khung kế tiếp
+        source = FrameSource(video_path, start_frame=max(resume_from - 1, 0))
+    except ValueError:
+        print("Lỗi: Không mở được video")
+        return None
+    if header is None:
+        video_size, video_mtime_ns = _video_stamp(video_path)
+        header = {'mode': mode, 'signatures': signatures, 'complete': False, 'signature_size': signature_size,
+                  'K': K, 'n_frames': 0, 'height': source.height, 'width': source.width,
+                  'video_size': video_size, 'video_mtime_ns': video_mtime_ns,
+                  'Q': float(Q) if capacity_path is not None else 0.0}
+    else:
+        logger.info("Tiếp tục quét %s từ khung %d", video_path, resume_from)
+
+    dtype = record_dtype(signatures, K)
+    pending = np.zeros(checkpoint_every, dtype=dtype)
+    n_pending = 0
+
+    capacity_file = None
+    if capacity_path is not None:
+        # Header chỉ mục khả năng nhúng để trống (không hợp lệ) đến khi quét xong
+        n_rows, n_cols = header['height'] // BLOCK_SIZE, header['width'] // BLOCK_SIZE
+        capacity_file = open(capacity_path, 'r+b' if resume_from else 'w+b')
+        capacity_file.truncate(CAPACITY_HEADER_SIZE + resume_from * n_rows * n_cols)
+        capacity_file.seek(0)
+        capacity_file.write(b'\0' * CAPACITY_HEADER_SIZE)
+        capacity_file.seek(0, os.SEEK_END)
+
+    with source, open(index_path, 'r+b' if resume_from else 'w+b') as f:
+        # Bỏ phần ghi sau checkpoint cuối (có thể dở dang)
+        f.truncate(HEADER_SIZE + resume_from * dtype.itemsize)
+        _write_header(f, header)
+
+        def checkpoint():
+            nonlocal n_pending
+            if capacity_file is not None:
+                capacity_file.flush()
+                os.fsync(capacity_file.fileno())
+            f.seek(HEADER_SIZE + header['n_frames'] * dtype.itemsize)
+            f.write(pending[:n_pending].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            # Header chỉ được cập nhật sau khi bản ghi đã nằm trên đĩa
+            header['n_frames'] += n_pending
+            n_pending = 0
+            _write_header(f, header)
+            f.flush()
+            os.fsync(f.fileno())
+            logger.info("Checkpoint %s: %d/%d khung", index_path, header['n_frames'], source.frame_count)
+
+        prev_feature = None
+        frame_shape = (header['height'], header['width'])
+        try:
+            for frame_idx, frame in source:
+                feature = frame_feature(frame, mode, signature_size, K)
+                if frame_idx < resume_from:
+                    # Khung liền trước checkpoint: chỉ lấy đặc trưng
+                    prev_feature = feature
+                    continue
+
+                record = pending[n_pending]
+                if prev_feature is None:
+                    record['metric'] = np.nan
+                else:
+                    record['metric'] = frame_metric(prev_feature, feature, mode, frame_shape, signature_size)
+                if signatures:
+                    if mode == 'signature':
+                        record['signature'] = feature
+                    else:
+                        gray = feature if mode == 'exact' else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                        record['signature'] = compute_signature(gray, signature_size, K)
+                if capacity_file is not None:
+                    capacity_file.write(scan_frame(frame, Q).tobytes())
+                prev_feature = feature
+                n_pending += 1
+                PROFILER.count('frames_scanned')
+                if n_pending == checkpoint_every:
+                    checkpoint()
+            header['complete'] = True
+        finally:
+            if capacity_file is not None and header['complete']:
+                # Header chỉ mục khả năng nhúng ghi trước checkpoint cuối (đánh dấu quét xong)
+                capacity_file.seek(0)
+                capacity_file.write(pack_header(Q, header['n_frames'] + n_pending, n_rows, n_cols,
+                                                header['video_size'], header['video_mtime_ns']))
+            # Bị ngắt giữa chừng vẫn giữ các khung đã tính
+            checkpoint()
+            if capacity_file is not None:
+                capacity_file.close()
+
+    return header
+
+def open_scene_index(index_path):
+    """
+    Mở chỉ mục chuyển cảnh bằng memory map.
+    Returns:
+        header: Dict như build_scene_index.
+        records: np.memmap có cấu trúc (số khung,) với trường 'metric' (và 'signature' nếu có).
+    """
+    with open(index_path, 'rb') as f:
+        header = _read_header(f)
+    if header is None:
+        raise ValueError(f"File chỉ mục không hợp lệ: {index_path}")
+    dtype = record_dtype(header['signatures'], header['K'])
+    if header['n_frames'] == 0:
+        return header, np.zeros(0, dtype=dtype)
+    records = np.memmap(index_path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(header['n_frames'],))
+    return header, records
+
+def load_scene_index(video_path, index_path=None, mode='exact', signatures=False, signature_size=64, K=16,
+                     checkpoint_every=500):
+    """
+    Dùng lại chỉ mục đã quét xong nếu khớp video (kích thước, mtime) và tham số,
+    tiếp tục chỉ mục dở dang, hoặc quét mới.
+    Args:
+        Như build_scene_index.
+    Returns:
+        header, records: Như open_scene_index, hoặc (None, None) nếu lỗi.
+    """
+    index_path = index_path or video_path + '.scn'
+    header, records = open_matching_scene_index(video_path, index_path, mode, signatures, signature_size, K)
+    if header is not None:
+        return header, records
+    if build_scene_index(video_path, index_path, mode, signatures, signature_size, K, checkpoint_every) is None:
+        return None, None
+    return open_scene_index(index_path)
+
+def open_matching_scene_index(video_path, index_path, mode='exact', signatures=False, signature_size=64, K=16):
+    """
+    Mở chỉ mục nếu đã quét xong và khớp video, tham số; không quét lại.
+    Returns:
+        header, records: Như open_scene_index, hoặc (None, None) nếu chưa có, dở dang hoặc không khớp.
+    """
+    if not os.path.exists(index_path):
+        return None, None
+    try:
+        header, records = open_scene_index(index_path)
+    except ValueError:
+        return None, None
+    if not header['complete'] or not _matches(header, video_path, mode, signatures, signature_size, K):
+        return None, None
+    return header, records
+
+def scene_cuts(records, threshold=10000):
+    """
+    Khung chuyển cảnh theo ngưỡng, tính từ độ lệch đã lưu (không giải mã lại video).
+    Args:
+        records: Bản ghi từ open_scene_index (hoặc mảng độ lệch từng khung).
+        threshold: Ngưỡng độ lệch giữa hai khung liên tiếp.
+    Returns:
+        frames: Danh sách chỉ số khung chuyển cảnh.
+        metrics: Độ lệch tại từng khung chuyển cảnh.
+    """
+    metrics = records['metric'] if records.dtype.names else np.asarray(records)
+    with np.errstate(invalid='ignore'):
+        frames = np.flatnonzero(metrics > threshold)
+    return frames.tolist(), metrics[frames].tolist()
+
+def detect_scene_changes_indexed(video_path, threshold=10000, mode='exact', index_path=None, signatures=False,
+                                 signature_size=64, K=16, checkpoint_every=500):
+    """
+    Như deltaDCT.detect_scene_changes_in_video nhưng dựa trên chỉ mục lưu trên đĩa: lần đầu quét
+    (có checkpoint, tiếp tục được khi bị ngắt), các lần sau với ngưỡng bất kỳ chỉ đọc chỉ mục.
+    Returns:
+        scene_changes: Danh sách chỉ số frame chuyển cảnh.
+        metrics: Độ lệch tại từng frame chuyển cảnh.
+    """
+    header, records = load_scene_index(video_path, index_path, mode, signatures, signature_size, K,
+                                       checkpoint_every)
+    if header is None:
+        return [], []
+    return scene_cuts(records, threshold)
+
+if __name__ == "__main__":
+    video_path = input("nhap duong dan video (mac dinh uncompressed_video.avi): ") or "uncompressed_video.avi"
+    scene_changes, metrics = detect_scene_changes_indexed(video_path, threshold=10000)
+    print("Các frame chuyển cảnh:")
+    for frame_index, metric in zip(scene_changes, metrics):
+        print(f"→ Chuyển cảnh tại frame: {frame_index} (độ lệch {metric:.0f})")
@@ -1,7 +1,16 @@
-import cv2
+import logging
+import os
 import numpy as np
-from scipy.fft import dct
-from bit2char import bit2char
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+from bit2char import bit2char, bits_to_string
+from blockdct import split_blocks, dct_blocks, find_candidates
+from blockindex import load_block_positions
+from framesource import FrameSource
+from payload import decode_payload
+from profiling import PROFILER
+
+logger = logging.getLogger(__name__)
 
 def check_closer(value, Q=120):
     """
@@ -18,6 +27,283 @@ def check_closer(value, Q=120):
     else:
         return 1
 
+def check_closer_array(values, Q=120):
+    """
+    Bản vector hóa của check_closer cho cả mảng giá trị C(2, v).
+    Args:
+        values: Mảng giá trị C(2, v).
+        Q: Ngưỡng quantization (mặc định 120).
+    Returns:
+        bits: Mảng int, 0 nếu residue ∈ [0, 0.25Q] ∪ [0.75Q, Q), 1 nếu residue ∈ (0.25Q, 0.75Q).
+    """
+    magnitude = np.abs(values)
+    tmp = magnitude / Q - magnitude // Q
+    return ((tmp >= 0.25) & (tmp <= 0.75)).astype(int)
+
+def majority_vote(bits, min_valid=3):
+    """
+    Majority voting theo từng nhóm, bỏ qua các khối không hợp lệ (giá trị -1).
+    Args:
+        bits: Mảng (số nhóm, số khối mỗi nhóm), mỗi phần tử 0, 1 hoặc -1 (không hợp lệ).
+        min_valid: Số khối hợp lệ tối thiểu để tách bit.
+    Returns:
+        voted: Mảng bit của từng nhóm (0 nếu không đủ khối hợp lệ).
+        enough: Mảng bool, True nếu nhóm có đủ khối hợp lệ.
+    """
+    valid = bits >= 0
+    n_valid = valid.sum(axis=1)
+    ones = (bits == 1).sum(axis=1)
+    enough = n_valid >= min_valid
+    voted = (enough & (ones >= n_valid / 2)).astype(int)
+    return voted, enough
+
+def extract_bits_from_frame(frame, block_positions, channel_name='G', Q=120, verbose=True):
+    """
+    Tách bit từ một khung đã giải mã, DCT một lần cho tất cả khối được liệt kê.
+    Args:
+        frame: Khung màu (H, W, 3, uint8).
+        block_positions: Danh sách nhóm khối [[(row, col), ...], ...], các nhóm cùng số khối.
+        channel_name: Kênh ('G' cho Green).
+        Q: Ngưỡng quantization.
+        verbose: In các khối/nhóm không hợp lệ.
+    Returns:
+        voted: Mảng bit của từng nhóm.
+        bits: Mảng (số nhóm, số khối) bit tách từ từng khối, -1 nếu khối không hợp lệ.
+    """
+    channel_idx = {'B': 0, 'G': 1, 'R': 2}[channel_name]
+    return extract_bits_from_channel(frame[:, :, channel_idx], block_positions, Q, verbose)
+
+def extract_bits_from_channel(channel, block_positions, Q=120, verbose=True, min_valid=3):
+    """
+    Như extract_bits_from_frame nhưng nhận thẳng kênh nhúng (H, W).
+    min_valid: Số khối hợp lệ tối thiểu của mỗi nhóm (xem majority_vote).
+    """
+    voted, bits, diagnostics = extract_bits_diagnostics(channel, block_positions, Q, min_valid)
+    if verbose:
+        print_diagnostics(diagnostics)
+    return voted, bits
+
+def extract_bits_diagnostics(channel, block_positions, Q=120, min_valid=3):
+    """
+    Tách bit từ kênh nhúng, trả về chẩn đoán thay vì in ra (dùng được trong process con).
+    Args:
+        channel: Kênh nhúng (H, W).
+        block_positions: Danh sách/mảng nhóm khối (số nhóm, số khối, 2).
+        Q: Ngưỡng quantization.
+        min_valid: Số khối hợp lệ tối thiểu của mỗi nhóm.
+    Returns:
+        voted: Mảng bit của từng nhóm.
+        bits: Mảng (số nhóm, số khối) bit tách từ từng khối, -1 nếu khối không hợp lệ.
+        diagnostics: Dict {'invalid_blocks': [(nhóm, hàng, cột)], 'no_candidate': [(nhóm, hàng, cột)],
+                     'insufficient_groups': [nhóm]}.
+    """
+    blocks = split_blocks(channel)
+    positions = np.asarray(block_positions, dtype=np.int64).reshape(len(block_positions), -1, 2)
+    rows, cols = positions[..., 0], positions[..., 1]
+    
+    bits = np.full(rows.shape, -1, dtype=int)
+    inside = (rows >= 0) & (rows < blocks.shape[0]) & (cols >= 0) & (cols < blocks.shape[1])
+    
+    # DCT 2D cho cả lô khối hợp lệ
+    with PROFILER.stage('color_split'):
+        selected = blocks[rows[inside], cols[inside]].astype(float)
+    dct_coeffs = dct_blocks(selected)
+    has_candidate, v = find_candidates(dct_coeffs)
+    values = dct_coeffs[np.arange(len(v)), 2, v]
+    block_bits = np.where(has_candidate, check_closer_array(values, Q), -1)
+    bits[inside] = block_bits
+    
+    voted, enough = majority_vote(bits, min_valid)
+    missing = np.zeros(rows.shape, dtype=bool)
+    missing[inside] = ~has_candidate
+    diagnostics = {
+        'invalid_blocks': [(int(g), int(rows[g, b]), int(cols[g, b])) for g, b in zip(*np.nonzero(~inside))],
+        'no_candidate': [(int(g), int(rows[g, b]), int(cols[g, b])) for g, b in zip(*np.nonzero(missing))],
+        'insufficient_groups': np.nonzero(~enough)[0].tolist(),
+    }
+    return voted, bits, diagnostics
+
+def print_diagnostics(diagnostics):
+    """
+    Ghi log (WARNING) chẩn đoán của extract_bits_diagnostics (khối ngoài khung, khối không có
+    ứng viên, nhóm không đủ khối hợp lệ).
+    """
+    for group_idx, row, col in diagnostics['invalid_blocks']:
+        logger.warning("Khối (%d, %d) trong nhóm %d không hợp lệ", row, col, group_idx)
+    for group_idx, row, col in diagnostics['no_candidate']:
+        logger.warning("Khối (%d, %d) trong nhóm %d không có C(2, v) >= 100", row, col, group_idx)
+    for group_idx in diagnostics['insufficient_groups']:
+        logger.warning("Nhóm %d không đủ khối hợp lệ để tách bit", group_idx)
+
+# ==== Tách song song: khung nằm trong shared memory, process con chỉ nhận chỉ số slot ====
+
+# Vùng slot của process hiện tại: {'shm': SharedMemory, 'slots': mảng (số slot, H, W) uint8}
+_SHARED = {}
+
+def _attach_slots(name, shape):
+    """
+    Initializer của process con: gắn vào vùng shared memory theo tên.
+    Với fork, vùng nhớ đã được kế thừa từ process cha nên không cần gắn lại.
+    """
+    if 'slots' not in _SHARED:
+        shm = shared_memory.SharedMemory(name=name)
+        _SHARED['shm'] = shm
+        _SHARED['slots'] = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+def _extract_slot(slot, frame_idx, positions, Q, min_valid):
+    voted, _, diagnostics = extract_bits_diagnostics(_SHARED['slots'][slot], positions, Q, min_valid)
+    return frame_idx, slot, voted, diagnostics
+
+def extract_bits_parallel(video_path, frame_block_positions, channel_name='G', Q=120, min_valid=3,
+                          workers=None, slots_per_worker=2):
+    """
+    Tách bit từ nhiều khung trên process pool. Process hiện tại giải mã tuần tự và chép kênh nhúng
+    của từng khung vào một slot shared memory; process con chỉ nhận chỉ số slot và nhóm khối của
+    khung đó (không pickle mảng khung). Slot được dùng lại khi khung trong đó đã tách xong.
+    Args:
+        video_path: Đường dẫn video.
+        frame_block_positions: Dict {frame_idx: danh sách nhóm khối}.
+        channel_name: Kênh ('G' cho Green).
+        Q: Ngưỡng quantization.
+        min_valid: Số khối hợp lệ tối thiểu của mỗi nhóm.
+        workers: Số process (mặc định số CPU).
+        slots_per_worker: Số slot mỗi process (giải mã chạy trước tối đa ngần ấy khung).
+    Returns:
+        results: Dict {frame_idx: voted} theo thứ tự khung.
+        diagnostics: Dict {frame_idx: chẩn đoán} (xem extract_bits_diagnostics).
+    """
+    if not frame_block_positions:
+        return {}, {}
+    try:
+        source = FrameSource(video_path, frames=frame_block_positions)
+    except ValueError:
+        print("Lỗi: Không mở được video")
+        return {}, {}
+    
+    channel_idx = {'B': 0, 'G': 1, 'R': 2}[channel_name]
+    workers = workers or os.cpu_count()
+    shape = (workers * slots_per_worker, source.height, source.width)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+    _SHARED['shm'] = shm
+    _SHARED['slots'] = slots = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    
+    results, diagnostics = {}, {}
+    
+    def collect(future):
+        frame_idx, slot, voted, frame_diagnostics = future.result()
+        results[frame_idx] = voted
+        diagnostics[frame_idx] = frame_diagnostics
+        return slot
+    
+    try:
+        with source, ProcessPoolExecutor(workers, initializer=_attach_slots,
+                                         initargs=(shm.name, shape)) as executor:
+            free = list(range(shape[0]))
+            pending = set()
+            for frame_idx, frame in source:
+                if not free:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    free.extend(collect(future) for future in done)
+                slot = free.pop()
+                np.copyto(slots[slot], frame[:, :, channel_idx])
+                positions = np.asarray(frame_block_positions[frame_idx], dtype=np.int32)
+                pending.add(executor.submit(_extract_slot, slot, frame_idx, positions, Q, min_valid))
+            for future in pending:
+                collect(future)
+    finally:
+        _SHARED.clear()
+        del slots
+        shm.close()
+        shm.unlink()
+    
+    return dict(sorted(results.items())), dict(sorted(diagnostics.items()))
+
+def extract_messages_from_video(video_path, frame_block_positions, channel_name='G', Q=120, workers=None):
+    """
+    Tách tin từ nhiều khung trong một lần đọc video tuần tự (không mở lại, không seek).
+    Args:
+        video_path: Đường dẫn video.
+        frame_block_positions: Dict {frame_idx: danh sách nhóm khối [[(row, col), ...], ...]}.
+        channel_name: Kênh ('G' cho Green).
+        Q: Ngưỡng quantization.
+        workers: Số process tách song song (None = tách ngay trong process hiện tại).
+    Returns:
+        results: Dict {frame_idx: (message_bits, character)} theo thứ tự khung.
+    """
+    if not frame_block_positions:
+        return {}
+    
+    if workers is not None:
+        voted_frames, diagnostics = extract_bits_parallel(video_path, frame_block_positions, channel_name, Q,
+                                                          workers=workers)
+        results = {}
+        for frame_idx, voted in voted_frames.items():
+            print_diagnostics(diagnostics[frame_idx])
+            message_bits = ''.join(str(b) for b in voted)
+            results[frame_idx] = (message_bits, bits_to_string(voted))
+        for frame_idx in sorted(frame_block_positions):
+            if frame_idx not in results:
+                print(f"Không đọc được khung {frame_idx}")
+        return results
+    
+    # Giải mã trước trên luồng nền; khung không cần chỉ grab, dừng sau khung cuối cùng
+    try:
+        source = FrameSource(video_path, frames=frame_block_positions)
+    except ValueError:
+        print("Lỗi: Không mở được video")
+        return {}
+    
+    results = {}
+    with source:
+        for frame_idx, frame in source:
+            voted, _ = extract_bits_from_frame(frame, frame_block_positions[frame_idx], channel_name, Q)
+            message_bits = ''.join(str(b) for b in voted)
+            results[frame_idx] = (message_bits, bits_to_string([int(b) for b in message_bits]))
+    
+    for frame_idx in sorted(frame_block_positions):
+        if frame_idx not in results:
+            print(f"Không đọc được khung {frame_idx}")
+    return results
+
+def extract_payload_video(video_path, index_path='block_indices.bin', fec=None, workers=None):
+    """
+    Tách payload của chế độ dung lượng cao (giaumasv.embed_payload_video) trong một lần đọc.
+    Args:
+        video_path: Đường dẫn video sau nhúng.
+        index_path: File index vị trí khối.
+        fec: Mã sửa lỗi đã dùng khi nhúng (None hoặc 'hamming').
+        workers: Số process tách song song (None = tách ngay trong process hiện tại).
+    Returns:
+        data: bytes, hoặc None nếu không tách được hoặc sai CRC.
+    """
+    header, frame_block_positions = load_block_positions(index_path)
+    if workers is not None:
+        # Một khối hợp lệ là đủ để bỏ phiếu (redundancy có thể nhỏ hơn 3)
+        chunks, _ = extract_bits_parallel(video_path, frame_block_positions, header['channel'], header['Q'],
+                                          min_valid=1, workers=workers)
+    else:
+        channel_idx = {'B': 0, 'G': 1, 'R': 2}[header['channel']]
+        try:
+            source = FrameSource(video_path, frames=frame_block_positions)
+        except ValueError:
+            print("Lỗi: Không mở được video")
+            return None
+        
+        chunks = {}
+        with source:
+            for frame_idx, frame in source:
+                voted, _ = extract_bits_from_channel(frame[:, :, channel_idx], frame_block_positions[frame_idx],
+                                                     header['Q'], verbose=False, min_valid=1)
+                chunks[frame_idx] = voted
+    if len(chunks) < len(frame_block_positions):
+        print("Không đọc được đủ khung")
+        return None
+    
+    data = decode_payload(np.concatenate([chunks[f] for f in sorted(chunks)]), fec)
+    if data is None:
+        print("Lỗi: Header không hợp lệ hoặc sai CRC")
+    return data
+
 def extract_message_from_frame(video_path, frame_idx, channel_name, block_positions, Q=120):
     """
     Tách 8 bit từ khung tại frame_idx, kênh channel_name, dùng majority voting từ 8 nhóm x 5 khối.
@@ -36,62 +322,22 @@ def extract_message_from_frame(video_path, frame_idx, channel_name, block_positi
         print("Lỗi: block_positions phải có 8 nhóm, mỗi nhóm 5 khối")
         return "", ""
     
-    cap = cv2.VideoCapture(video_path)
-    block_size = 8
-    
-    # Di chuyển đến khung frame_idx
-    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-    ret, frame = cap.read()
-    if not ret:
-        print(f"Không đọc được khung {frame_idx}")
-        cap.release()
+    # Di chuyển đến khung frame_idx (AVI không nén: đọc thẳng từ mmap, không seek/giải mã)
+    try:
+        source = FrameSource(video_path, start_frame=frame_idx, stop_frame=frame_idx)
+    except ValueError:
+        print("Lỗi: Không mở được video")
         return "", ""
-    
-    # Chuyển sang float và tách kênh
-    frame_float = frame.astype(float)
-    channels = cv2.split(frame_float)
-    channel_idx = {'B': 0, 'G': 1, 'R': 2}[channel_name]
-    channel = channels[channel_idx]
-    
-    message_bits = ""
-    
-    # Tách bit từ mỗi nhóm 5 khối
-    for group_idx, group in enumerate(block_positions):
-        bits = []
-        for block_idx, (row, col) in enumerate(group):
-            i, j = row * block_size, col * block_size
-            block = channel[i:i+block_size, j:j+block_size]
-            if block.shape != (block_size, block_size):
-                print(f"Khối ({row}, {col}) trong nhóm {group_idx} không hợp lệ")
-                bits.append(None)
-                continue
-            
-            # Tính DCT 2D
-            dct_block = dct(dct(block, axis=0, norm='ortho'), axis=1, norm='ortho')
-            
-            # Tìm C(2, v) đầu tiên có |C| >= 100
-            row_2 = dct_block[2, :]
-            candidates = np.where(np.abs(row_2) >= 100)[0]
-            if len(candidates) == 0:
-                print(f"Khối ({row}, {col}) trong nhóm {group_idx} không có C(2, v) >= 100")
-                bits.append(None)
-                continue
-            
-            v = candidates[0]
-            value = dct_block[2, v]
-            bit = check_closer(value, Q)
-            bits.append(bit)
+    with source:
+        item = next(source, None)
+        if item is None:
+            print(f"Không đọc được khung {frame_idx}")
+            return "", ""
         
-        # Majority voting
-        valid_bits = [b for b in bits if b is not None]
-        if len(valid_bits) >= 3:  # Cần ít nhất 3 residue hợp lệ
-            bit = 1 if sum(valid_bits) >= len(valid_bits) / 2 else 0
-            message_bits += str(bit)
-        else:
-            print(f"Nhóm {group_idx} không đủ khối hợp lệ để tách bit")
-            message_bits += "0"  # Mặc định 0 nếu không đủ dữ liệu
+        # Tách bit từ mỗi nhóm 5 khối (DCT theo lô) và majority voting
+        voted, _ = extract_bits_from_frame(item[1], block_positions, channel_name, Q)
+        message_bits = ''.join(str(b) for b in voted)
     
-    cap.release()
     
     # Chuyển bit thành ký tự
     if len(message_bits) != 8:
@@ -102,22 +348,35 @@ def extract_message_from_frame(video_path, frame_idx, channel_name, block_positi
     
     return message_bits, character
 
-# Nhập thông tin từ người dùng
-video_path = input("nhap duong dan video")
-for _ in range(11):
-    frame_idx = int(input("nhap chi so khung(ví dụ: 2): "))
-    channel_name = 'G'
+def extract_message(video_path, index_path='block_indices.bin', verbose=True, workers=None):
+    """
+    Tách thông điệp (mỗi khung một ký tự) theo file index, Q và kênh lấy từ header của index.
+    Args:
+        video_path: Đường dẫn video sau nhúng.
+        index_path: File index vị trí khối.
+        verbose: In chuỗi bit và ký tự của từng khung.
+        workers: Số process tách song song (None = tách ngay trong process hiện tại).
+    Returns:
+        message: Chuỗi tách được.
+        results: Dict {frame_idx: (message_bits, character)}.
+    """
+    header, frame_block_positions = load_block_positions(index_path)
+    channel_name = header['channel']
 
-    # Nhập block_positions (8 nhóm x 5 khối)
-    block_positions_input = input("nhap block_positions (danh sach 8 nhom x 5 khoi, vi du: [[(0,0), (0,2), (0,5), (0,6), (0,10)], ...]): ")
-    try:
-        block_positions = eval(block_positions_input)
-    except:
-        print("Lỗi: block_positions không đúng định dạng")
-        exit()
-
-    # Tách tin và in kết quả
-    print(f"tach tin tu khung {frame_idx}, kenh {channel_name}")
-    message_bits, character = extract_message_from_frame(video_path, frame_idx, channel_name, block_positions, Q=120)
-    print(f"chuoi bit nhung: {message_bits}")
-    
\ No newline at end of file
+    # Tách tin từ tất cả khung trong một lần đọc video
+    results = extract_messages_from_video(video_path, frame_block_positions, channel_name, Q=header['Q'],
+                                          workers=workers)
+    if verbose:
+        for frame_idx, (message_bits, character) in results.items():
+            print(f"tach tin tu khung {frame_idx}, kenh {channel_name}")
+            print(f"chuoi bit nhung: {message_bits}")
+            print(f"ky tu: {character}")
+    return ''.join(character for _, character in results.values()), results
+
+if __name__ == "__main__":
+    # Nhập thông tin từ người dùng
+    video_path = input("nhap duong dan video")
+    index_path = input("nhap duong dan file vi tri khoi (mac dinh block_indices.bin): ") or 'block_indices.bin'
+    
+    message, _ = extract_message(video_path, index_path)
+    print(f"thong diep: {message}")
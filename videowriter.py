@@ -0,0 +1,191 @@
+import os
+import queue
+import tempfile
+import threading
+import zlib
+import cv2
+import numpy as np
+from framesource import FrameSource
+from profiling import PROFILER
+from rawavi import RawAVIWriter
+
+# Codec không mất mát: 'raw' là AVI BGR24 không nén (RawAVIWriter), còn lại qua FFmpeg của OpenCV
+CODECS = {
+    'raw': None,
+    'ffv1': 'FFV1',
+    'huffyuv': 'HFYU',
+    'png': 'MPNG',
+}
+
+# Kết quả tự kiểm tra codec theo (codec, width, height)
+_codec_checks = {}
+
+def open_video_writer(path, fps, frame_size, codec='raw'):
+    """
+    Mở writer cho codec không mất mát, cùng giao diện write()/release() với cv2.VideoWriter.
+    Args:
+        path: Đường dẫn file ra (.avi).
+        fps: Số khung/giây.
+        frame_size: (width, height).
+        codec: Khóa của CODECS.
+    Returns:
+        writer: RawAVIWriter hoặc cv2.VideoWriter.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Codec không hợp lệ: {codec}")
+    if CODECS[codec] is None:
+        return RawAVIWriter(path, fps, frame_size)
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*CODECS[codec]), fps, frame_size)
+    if not writer.isOpened():
+        raise ValueError(f"OpenCV không ghi được codec {codec} (cần FFmpeg backend)")
+    return writer
+
+def check_codec_lossless(codec, frame_size, n_frames=3):
+    """
+    Tự kiểm tra codec: ghi vài khung nhiễu ngẫu nhiên (không nén được, nhạy với mọi sai lệch
+    màu/lấy mẫu) rồi đọc lại và so sánh từng byte. Kết quả được nhớ theo codec và kích thước.
+    Returns:
+        ok: True nếu khung đọc lại giống hệt.
+    """
+    key = (codec, tuple(frame_size))
+    if key in _codec_checks:
+        return _codec_checks[key]
+    if CODECS.get(codec, 0) is None:
+        _codec_checks[key] = True
+        return True
+
+    width, height = frame_size
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, size=(n_frames, height, width, 3), dtype=np.uint8)
+    fd, path = tempfile.mkstemp(suffix='.avi')
+    os.close(fd)
+    try:
+        writer = open_video_writer(path, 30, frame_size, codec)
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+        read_back = []
+        with FrameSource(path) as source:
+            for _, frame in source:
+                read_back.append(frame.copy())
+        ok = len(read_back) == n_frames and all(np.array_equal(a, b) for a, b in zip(frames, read_back))
+    except ValueError:
+        ok = False
+    finally:
+        os.remove(path)
+    _codec_checks[key] = ok
+    return ok
+
+def frame_checksum(frame):
+    return zlib.crc32(np.ascontiguousarray(frame))
+
+def verify_video(path, checksums):
+    """
+    Giải mã lại video đã ghi và so CRC32 từng khung với CRC lúc ghi. Khung giống từng byte
+    thì bit nhúng trong DCT và PSNR cũng giống hệt.
+    Args:
+        path: Video đã ghi.
+        checksums: Danh sách CRC32 từng khung (AsyncVideoWriter.checksums).
+    Returns:
+        mismatched: Danh sách khung sai lệch (rỗng nếu giống hệt), hoặc None nếu không đọc được.
+    """
+    try:
+        source = FrameSource(path)
+    except ValueError:
+        print(f"Lỗi: Không mở được video {path}")
+        return None
+    mismatched = []
+    n_read = 0
+    with source:
+        for frame_idx, frame in source:
+            if frame_idx >= len(checksums) or frame_checksum(frame) != checksums[frame_idx]:
+                mismatched.append(frame_idx)
+            n_read += 1
+    mismatched.extend(range(n_read, len(checksums)))
+    return mismatched
+
+class AsyncVideoWriter:
+    """
+    Ghi video trên luồng nền từ hàng đợi giới hạn: luồng xử lý chỉ chép khung vào hàng đợi,
+    mã hóa (codec nén) và ghi đĩa chạy song song. Hàng đợi đầy thì write() chờ, nên bộ nhớ
+    không tăng quá queue_size khung. Giữ CRC32 từng khung để kiểm tra lại sau khi ghi.
+    """
+
+    def __init__(self, path, fps, frame_size, codec='raw', queue_size=8, check_codec=True):
+        """
+        Args:
+            path: Đường dẫn file ra.
+            fps: Số khung/giây.
+            frame_size: (width, height).
+            codec: Khóa của CODECS ('raw', 'ffv1', 'huffyuv', 'png').
+            queue_size: Số khung tối đa chờ ghi.
+            check_codec: Tự kiểm tra codec không mất mát trước khi ghi (xem check_codec_lossless).
+        """
+        if check_codec and not check_codec_lossless(codec, frame_size):
+            raise ValueError(f"Codec {codec} không giữ nguyên khung khi đọc lại")
+        self.path = path
+        self.codec = codec
+        self.checksums = []
+        self._writer = open_video_writer(path, fps, frame_size, codec)
+        # Codec có nén: mã hóa và ghi đĩa nằm chung trong writer.write(), đo thành 'encode'
+        self._stage = 'write' if CODECS[codec] is None else 'encode'
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self._error is None:
+                try:
+                    with PROFILER.stage(self._stage):
+                        self._writer.write(frame)
+                except Exception as e:
+                    self._error = e
+
+    def isOpened(self):
+        return self._thread.is_alive()
+
+    def write(self, frame):
+        """
+        Đưa một khung BGR (H, W, 3, uint8) vào hàng đợi. Khung được chép nên có thể là
+        view vào bộ đệm vòng của FrameSource.
+        """
+        if self._error is not None:
+            raise self._error
+        frame = np.array(frame, dtype=np.uint8, copy=True)
+        self.checksums.append(frame_checksum(frame))
+        self._queue.put(frame)
+        PROFILER.count('frames_written')
+
+    def release(self, verify=False):
+        """
+        Chờ ghi hết hàng đợi rồi đóng file.
+        Args:
+            verify: Đọc lại file và so CRC32 từng khung (xem verify_video).
+        Returns:
+            mismatched: Danh sách khung sai lệch nếu verify, ngược lại None.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+            self._writer.release()
+        if self._error is not None:
+            raise self._error
+        if not verify:
+            return None
+        mismatched = verify_video(self.path, self.checksums)
+        if mismatched is None:
+            mismatched = list(range(len(self.checksums)))
+        if mismatched:
+            print(f"Lỗi: {len(mismatched)} khung đọc lại không khớp ({self.path})")
+        return mismatched
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()